@@ -3,19 +3,29 @@ from discord import app_commands
 from discord.ui import Select, View, Button, Modal, TextInput
 import json
 import os
+import hashlib
+import heapq
 from datetime import datetime, timedelta, date, timezone
 import asyncio
+import atexit
+import bisect
+import queue
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 # --- Logging Setup ---
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 log_handler = TimedRotatingFileHandler('bot.log', when='D', interval=7, backupCount=4) # Rotates weekly
 log_handler.setFormatter(log_formatter)
+# Log calls only enqueue the record; the listener thread writes and rotates bot.log off the event loop
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger()
 # To see more detailed logs for debugging, change logging.INFO to logging.DEBUG
 logger.setLevel(logging.INFO) 
-logger.addHandler(log_handler)
+logger.addHandler(QueueHandler(log_queue))
 
 # --- Configuration ---
 # Add "log_channel_id" for the scheduled list posting.
@@ -24,16 +34,22 @@ logger.addHandler(log_handler)
 #   "ping_role_id": "YOUR_DISCORD_ROLE_ID",
 #   "log_channel_id": "YOUR_CHANNEL_ID_FOR_SCHEDULED_LISTS"
 # }
+# Optional: "retention_hours" (default 49) - how long after its time slot a buff is kept before it is archived.
 with open('config.json', 'r') as f:
     config = json.load(f)
 
 DISCORD_TOKEN = config['token']
 PING_ROLE_ID = int(config['ping_role_id'])
 LOG_CHANNEL_ID = int(config['log_channel_id'])
+RETENTION_HOURS = int(config.get('retention_hours', 49))
 
 # --- Data Management ---
 DATA_FILE = "buff_requests.json"
+ARCHIVE_FILE = "buff_requests_archive.jsonl" # Expired buffs, one JSON object per line
+SYNC_HASH_FILE = "command_sync.hash" # Hash of the last slash-command tree pushed to Discord
 sent_reminders = set() # To avoid duplicate reminders
+expiry_heap = [] # (slot epoch seconds, request id), oldest slot on top
+_heap_stamp = None # (mtime, size) of DATA_FILE when expiry_heap was built
 
 def load_data():
     if os.path.exists(DATA_FILE):
@@ -47,67 +63,136 @@ def load_data():
 def save_data(data):
     with open(DATA_FILE, 'w') as f:
         json.dump(data, f, indent=4)
+    _rebuild_expiry_heap(data)
 
-def cleanup_old_data():
-    """Removes entries older than 49 hours, handling both naive and aware datetimes."""
-    requests = load_data()
-    if not requests:
-        return
+def _file_stamp():
+    if not os.path.exists(DATA_FILE):
+        return None
+    st = os.stat(DATA_FILE)
+    return (st.st_mtime_ns, st.st_size)
 
-    # Use timezone-aware datetime object for comparison
-    forty_nine_hours_ago = datetime.now(timezone.utc) - timedelta(hours=49)
-    
-    # Create a new dictionary to hold the requests we want to keep
-    cleaned_requests = {}
-    
+def _rebuild_expiry_heap(requests):
+    global _heap_stamp
+    expiry_heap.clear()
     for req_id, req_data in requests.items():
         try:
-            # Load the request time from the stored ISO string
-            request_time = datetime.fromisoformat(req_data['request_time'])
-            
-            # FIX: If the loaded datetime is naive (from old data), make it aware by setting its timezone to UTC
-            if request_time.tzinfo is None:
-                request_time = request_time.replace(tzinfo=timezone.utc)
-            
-            # Keep the request if it's NOT older than 49 hours
-            if request_time > forty_nine_hours_ago:
-                cleaned_requests[req_id] = req_data
+            time_slot = datetime.fromisoformat(req_data['time_slot'])
         except (ValueError, KeyError) as e:
-            # This handles malformed or missing 'request_time' entries in the JSON
-            logger.warning(f"Skipping request with ID {req_id} due to invalid time data: {e}")
+            logger.warning("Skipping request with ID %s due to invalid time data: %s", req_id, e)
             continue
+        # Old entries were saved naive; treat them as UTC
+        if time_slot.tzinfo is None:
+            time_slot = time_slot.replace(tzinfo=timezone.utc)
+        expiry_heap.append((time_slot.timestamp(), req_id))
+    heapq.heapify(expiry_heap)
+    _heap_stamp = _file_stamp()
 
-    # Only save if there's a change
-    if len(cleaned_requests) != len(requests):
-        save_data(cleaned_requests)
-        logger.info(f"Cleaned up {len(requests) - len(cleaned_requests)} old buff requests.")
+def cleanup_old_data():
+    """Archives entries whose time slot is more than RETENTION_HOURS old, handling both naive and aware datetimes.
+
+    Uses a time-ordered heap that is only rebuilt when the data file changes, so the per-minute call is cheap.
+    """
+    if _file_stamp() != _heap_stamp:
+        _rebuild_expiry_heap(load_data())
+
+    horizon = (datetime.now(timezone.utc) - timedelta(hours=RETENTION_HOURS)).timestamp()
+    if not expiry_heap or expiry_heap[0][0] >= horizon:
+        return
+
+    requests = load_data()
+    expired = []
+    while expiry_heap and expiry_heap[0][0] < horizon:
+        _, req_id = heapq.heappop(expiry_heap)
+        if req_id in requests:
+            expired.append(req_id)
+    if not expired:
+        return
+
+    expired_at = datetime.now(timezone.utc).isoformat()
+    with open(ARCHIVE_FILE, 'a') as f:
+        for req_id in expired:
+            f.write(json.dumps({"id": req_id, **requests.pop(req_id), "expired_at": expired_at}) + "\n")
+            sent_reminders.discard(req_id)
+    save_data(requests)
+    logger.info("Archived %s old buff requests.", len(expired))
 
 # --- Bot Setup ---
 intents = discord.Intents.default()
 intents.members = True 
-client = discord.Client(intents=intents)
+class BuffBot(discord.Client):
+    """Starts background work once from setup_hook; on_ready fires again on every reconnect."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.background_tasks = []
+
+    async def setup_hook(self):
+        await sync_commands_if_changed()
+        self.background_tasks = [
+            asyncio.create_task(reminder_task(), name="reminder_task"),
+            asyncio.create_task(schedule_task(), name="schedule_task"),
+        ]
+
+    async def close(self):
+        for task in self.background_tasks:
+            task.cancel()
+        await super().close()
+
+client = BuffBot(intents=intents)
 tree = app_commands.CommandTree(client)
 
+def command_tree_hash() -> str:
+    payload = []
+    for cmd in tree.get_commands():
+        try:
+            payload.append(cmd.to_dict(tree)) # discord.py 2.4+
+        except TypeError:
+            payload.append(cmd.to_dict())
+    raw = json.dumps({"application_id": client.application_id, "commands": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+async def sync_commands_if_changed():
+    """Pushes slash commands to Discord only when the tree differs from the last successful sync."""
+    current = command_tree_hash()
+    previous = None
+    if os.path.exists(SYNC_HASH_FILE):
+        with open(SYNC_HASH_FILE, 'r') as f:
+            previous = f.read().strip()
+    if current == previous:
+        logger.info("Slash commands unchanged since last sync; skipping tree.sync().")
+        return
+    await tree.sync()
+    with open(SYNC_HASH_FILE, 'w') as f:
+        f.write(current)
+    logger.info("Synced slash commands with Discord.")
+
 # --- Helper Function ---
+MAX_FIELDS = 25 # Discord rejects embeds with more fields
+
+def slot_time(req):
+    """Start of the request's time slot; old entries were saved naive, treat them as UTC."""
+    start = datetime.fromisoformat(req['time_slot'])
+    return start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+
+def add_buff_field(embed: discord.Embed, guild: discord.Guild, req):
+    # The member lookup happens only for rows that are actually shown
+    user = guild.get_member(req['user_id'])
+    user_mention = user.mention if user else f"User ID: {req['user_id']}"
+    time_range_str = f"{slot_time(req).strftime('%Y-%m-%d %H:%M')} UTC"
+    # Make the username bold
+    embed.add_field(name=f"Title: {req['title']} | Region: {req['region']}",
+                    value=f"User: **{user_mention} ({req['user_name']})**\nTime Slot: {time_range_str}", inline=False)
+
 async def create_buffs_embed(guild: discord.Guild):
+    """The soonest MAX_FIELDS requests; /viewbuffs pages through the rest."""
     requests = load_data()
     if not requests:
         return None
 
     embed = discord.Embed(title="Current Buff Requests", color=discord.Color.blue())
-    sorted_requests = sorted(requests.values(), key=lambda x: x['time_slot'])
-
-    for req in sorted_requests:
-        user = guild.get_member(req['user_id'])
-        user_mention = user.mention if user else f"User ID: {req['user_id']}"
-        start_time_obj = datetime.fromisoformat(req['time_slot'])
-        time_range_str = f"{start_time_obj.strftime('%Y-%m-%d %H:%M')} UTC"
-        
-        # Make the username bold
-        field_name = f"Title: {req['title']} | Region: {req['region']}"
-        field_value = f"User: **{user_mention} ({req['user_name']})**\nTime Slot: {time_range_str}"
-        embed.add_field(name=field_name, value=field_value, inline=False)
-    
+    for req in heapq.nsmallest(MAX_FIELDS, requests.values(), key=slot_time):
+        add_buff_field(embed, guild, req)
+    if len(requests) > MAX_FIELDS:
+        embed.set_footer(text=f"Showing the next {MAX_FIELDS} of {len(requests)} requests. Use /viewbuffs to see them all.")
     return embed
 
 # --- UI Components ---
@@ -190,7 +275,7 @@ class BuffRequestView(View):
             "request_time": request_time_utc.isoformat()
         }
         save_data(requests)
-        logger.info(f"New buff request by {interaction.user} ({sanitized_name}): {self.buff_title} in {self.region} at {self.time_slot}")
+        logger.info("New buff request by %s (%s): %s in %s at %s", interaction.user, sanitized_name, self.buff_title, self.region, self.time_slot)
 
         embed = discord.Embed(title="New Capital Buff Request!", description=f"{interaction.user.mention} (**{sanitized_name}**) has requested the **{self.buff_title}** buff for **{start_time_obj.strftime('%Y-%m-%d')} at {time_range_str}** in the **{self.region}** region.", color=discord.Color.green())
         ping_role = interaction.guild.get_role(PING_ROLE_ID)
@@ -266,6 +351,98 @@ class RegionSelect(Select):
         self.view.add_item(EnterCustomNameButton())
         await interaction.response.edit_message(content="Last step! Specify your name for the request.", view=self.view)
 
+# /viewbuffs pages through one message. Requests are sorted by slot once per command; a page renders
+# only its own PAGE_SIZE fields (and member lookups), and the date filter is a bisect on that order.
+PAGE_SIZE = 10
+
+class BuffListView(View):
+    def __init__(self, guild: discord.Guild, owner_id: int, requests: list):
+        super().__init__(timeout=300)
+        self.guild = guild
+        self.owner_id = owner_id
+        self.requests = requests # request dicts, oldest slot first
+        self.starts = [slot_time(req).timestamp() for req in requests]
+        self.matches = requests
+        self.filters = {"title": None, "region": None, "day": None}
+        self.page = 0
+        self.message = None
+
+        titles = sorted({req['title'] for req in requests})[:24]
+        regions = sorted({req['region'] for req in requests})[:24]
+        days = sorted({slot_time(req).date() for req in requests})[:24]
+        self._filter_select("title", "Filter by title...", "All titles", [(t, t) for t in titles])
+        self._filter_select("region", "Filter by region...", "All regions", [(r, r) for r in regions])
+        self._filter_select("day", "Filter by date...", "All dates", [(d.strftime('%A, %B %d'), d.isoformat()) for d in days])
+
+        self.prev_button = Button(label="Prev", style=discord.ButtonStyle.secondary, row=3)
+        self.prev_button.callback = self.on_prev
+        self.add_item(self.prev_button)
+        self.next_button = Button(label="Next", style=discord.ButtonStyle.secondary, row=3)
+        self.next_button.callback = self.on_next
+        self.add_item(self.next_button)
+
+    def _filter_select(self, key: str, placeholder: str, all_label: str, choices: list):
+        options = [discord.SelectOption(label=all_label, value="")] + [discord.SelectOption(label=label, value=value) for label, value in choices]
+        select = Select(placeholder=placeholder, options=options, row=len(self.children))
+
+        async def callback(interaction: discord.Interaction):
+            value = select.values[0]
+            for option in select.options:
+                option.default = bool(value) and option.value == value
+            self.filters[key] = (date.fromisoformat(value) if key == "day" else value) if value else None
+            self.apply_filters()
+            await interaction.response.edit_message(embed=self.render(), view=self)
+
+        select.callback = callback
+        self.add_item(select)
+
+    def apply_filters(self):
+        requests = self.requests
+        day = self.filters["day"]
+        if day is not None:
+            first = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc).timestamp()
+            requests = requests[bisect.bisect_left(self.starts, first):bisect.bisect_left(self.starts, first + 86400)]
+        title, region = self.filters["title"], self.filters["region"]
+        if title is not None or region is not None:
+            requests = [req for req in requests if title in (None, req['title']) and region in (None, req['region'])]
+        self.matches = requests
+        self.page = 0
+
+    def render(self) -> discord.Embed:
+        pages = max(1, -(-len(self.matches) // PAGE_SIZE))
+        self.page = max(0, min(self.page, pages - 1))
+        embed = discord.Embed(title="Current Buff Requests", color=discord.Color.blue())
+        for req in self.matches[self.page * PAGE_SIZE:(self.page + 1) * PAGE_SIZE]:
+            add_buff_field(embed, self.guild, req)
+        if not self.matches:
+            embed.description = "No buff requests match these filters."
+        embed.set_footer(text=f"Page {self.page + 1}/{pages} · {len(self.matches)} of {len(self.requests)} requests")
+        self.prev_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= pages - 1
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id == self.owner_id:
+            return True
+        await interaction.response.send_message("Use /viewbuffs to page through your own copy of the list.", ephemeral=True)
+        return False
+
+    async def on_prev(self, interaction: discord.Interaction):
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    async def on_next(self, interaction: discord.Interaction):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    async def on_timeout(self):
+        for item in self.children: item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
 # --- Slash Commands ---
 @tree.command(name="requestbuff", description="Request a capital buff.")
 async def requestbuff(interaction: discord.Interaction):
@@ -275,18 +452,21 @@ async def requestbuff(interaction: discord.Interaction):
 
 @tree.command(name="viewbuffs", description="View all active buff requests.")
 async def viewbuffs(interaction: discord.Interaction):
-    buff_list_embed = await create_buffs_embed(interaction.guild)
-    if buff_list_embed:
-        await interaction.response.send_message(embed=buff_list_embed)
-    else:
+    requests = sorted(load_data().values(), key=slot_time)
+    if not requests:
         await interaction.response.send_message("There are no active buff requests.", ephemeral=True)
+        return
+
+    view = BuffListView(interaction.guild, interaction.user.id, requests)
+    await interaction.response.send_message(embed=view.render(), view=view)
+    view.message = await interaction.original_response()
 
 @tree.command(name="clearbuffs", description="[Admin] Manually clears all buff requests.")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def clearbuffs(interaction: discord.Interaction):
     save_data({})
     sent_reminders.clear()
-    logger.info(f"Buffs cleared manually by {interaction.user.name} ({interaction.user.id}).")
+    logger.info("Buffs cleared manually by %s (%s).", interaction.user.name, interaction.user.id)
     await interaction.response.send_message("All buff requests have been cleared.", ephemeral=True)
 
 @clearbuffs.error
@@ -294,7 +474,7 @@ async def on_clearbuffs_error(interaction: discord.Interaction, error: app_comma
     if isinstance(error, app_commands.MissingPermissions):
         await interaction.response.send_message("You do not have permission.", ephemeral=True)
     else:
-        logger.error(f"Error in clearbuffs command: {error}")
+        logger.error("Error in clearbuffs command: %s", error)
         await interaction.response.send_message("An error occurred.", ephemeral=True)
 
 # --- Background Tasks ---
@@ -303,6 +483,7 @@ async def reminder_task():
     while not client.is_closed():
         try:
             logger.debug("Reminder task checking for upcoming buffs...")
+            cleanup_old_data()
             requests = load_data()
             now_utc = datetime.now(timezone.utc)
             
@@ -310,18 +491,18 @@ async def reminder_task():
                 logger.debug("Reminder check: No active requests found.")
 
             for req_id, req in requests.items():
-                logger.debug(f"Checking request ID: {req_id}")
+                logger.debug("Checking request ID: %s", req_id)
                 if req_id in sent_reminders:
-                    logger.debug(f"Skipping request {req_id}, reminder already sent.")
+                    logger.debug("Skipping request %s, reminder already sent.", req_id)
                     continue
 
                 start_time = datetime.fromisoformat(req['time_slot'])
                 time_diff = start_time - now_utc
-                logger.debug(f"Request {req_id} starts at {start_time}. Time difference: {time_diff}")
+                logger.debug("Request %s starts at %s. Time difference: %s", req_id, start_time, time_diff)
                 
                 # Check if the time difference is between 4 and 5 minutes.
                 if timedelta(minutes=4) < time_diff <= timedelta(minutes=5):
-                    logger.info(f"Time condition met for request {req_id}. Preparing to send reminder.")
+                    logger.info("Time condition met for request %s. Preparing to send reminder.", req_id)
                     guild = client.guilds[0] # Assumes the bot is in one server
                     if not guild:
                         logger.warning("Reminder task could not find a guild.")
@@ -337,17 +518,17 @@ async def reminder_task():
                         reminder_msg = f"{role.mention} Reminder: The **{req['title']}** buff in **{req['region']}** requested by **{user_mention}** starts in 5 minutes!"
                         await channel.send(reminder_msg)
                         sent_reminders.add(req_id)
-                        logger.info(f"Successfully sent 5-minute reminder for request {req_id}")
+                        logger.info("Successfully sent 5-minute reminder for request %s", req_id)
                     else:
                         if not channel:
-                            logger.warning(f"Could not send reminder for {req_id}: Channel with ID {LOG_CHANNEL_ID} not found.")
+                            logger.warning("Could not send reminder for %s: Channel with ID %s not found.", req_id, LOG_CHANNEL_ID)
                         if not role:
-                            logger.warning(f"Could not send reminder for {req_id}: Role with ID {PING_ROLE_ID} not found.")
+                            logger.warning("Could not send reminder for %s: Role with ID %s not found.", req_id, PING_ROLE_ID)
                 else:
-                    logger.debug(f"Time condition not met for request {req_id}. Skipping.")
+                    logger.debug("Time condition not met for request %s. Skipping.", req_id)
 
         except Exception as e:
-            logger.error(f"An unexpected error occurred in reminder_task: {e}", exc_info=True)
+            logger.error("An unexpected error occurred in reminder_task: %s", e, exc_info=True)
             
         await asyncio.sleep(60) # Check every minute
 
@@ -355,7 +536,6 @@ async def schedule_task():
     await client.wait_until_ready()
     while not client.is_closed():
         try:
-            cleanup_old_data() # Also clean up data on this schedule
             guild = client.guilds[0]
             channel = guild.get_channel(LOG_CHANNEL_ID)
             if channel:
@@ -364,7 +544,7 @@ async def schedule_task():
                     await channel.send("--- Scheduled Buff List Update ---", embed=embed)
                     logger.info("Posted scheduled buff list.")
         except Exception as e:
-            logger.error(f"Error in schedule_task: {e}", exc_info=True)
+            logger.error("Error in schedule_task: %s", e, exc_info=True)
             
         # Sleep for 12 hours
         await asyncio.sleep(12 * 60 * 60)
@@ -372,13 +552,9 @@ async def schedule_task():
 # --- Bot Events ---
 @client.event
 async def on_ready():
-    await tree.sync()
-    logger.info(f'Logged in as {client.user}!')
+    # Also fires after reconnects; background tasks and command sync live in BuffBot.setup_hook
+    logger.info('Logged in as %s!', client.user)
     print(f'Logged in as {client.user}!')
-    
-    # Start background tasks
-    client.loop.create_task(reminder_task())
-    client.loop.create_task(schedule_task())
 
 if __name__ == "__main__":
-    client.run(DISCORD_TOKEN)
\ No newline at end of file
+    client.run(DISCORD_TOKEN, log_handler=None) # keep discord.py on our queued root handler instead of its own stderr one
\ No newline at end of file
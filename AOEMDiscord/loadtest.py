@@ -0,0 +1,363 @@
+"""Offline load and race harness for the buff bot.
+
+Imports main.py inside a scratch directory (its own config.json, data file and bot.log) and drives
+the real views and slash-command callbacks with stub Interaction / Guild / Channel / Member objects,
+so no Discord connection or token is needed. Each simulated user walks
+/requestbuff -> ConfirmationView -> DateSelect -> TitleSelect -> TimeSelect -> RegionSelect -> finalize_request
+with random think time between clicks; a share of them then edit or delete their booking via /mybuffs.
+Afterwards a fake clock is stepped minute by minute over the booked window to run the reminder path.
+
+    python loadtest.py --users 2000 --concurrency 500
+    python loadtest.py --users 300 --think 0.05 --seed 7 --keep
+
+Reports interactions per second, event-loop lag, data file I/O time, duplicate (title, slot)
+bookings, lost or phantom bookings and missing or extra reminders. Needs discord.py and the s77
+package importable, exactly like main.py.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PING_ROLE_ID = 1000
+LOG_CHANNEL_ID = 2000
+
+# --- Discord Stubs ---
+class FakeRole:
+    def __init__(self, role_id):
+        self.id = role_id
+        self.mention = f"<@&{role_id}>"
+
+class FakeMember:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = f"Player {user_id}"
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self):
+        return self.name
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.messages = []
+
+    async def send(self, content=None, *, embed=None, **kwargs):
+        self.messages.append((content, embed))
+
+class FakeGuild:
+    def __init__(self):
+        self.channel = FakeChannel(LOG_CHANNEL_ID)
+        self.role = FakeRole(PING_ROLE_ID)
+        self.members = {}
+
+    def get_channel(self, channel_id):
+        return self.channel if channel_id == self.channel.id else None
+
+    def get_role(self, role_id):
+        return self.role if role_id == self.role.id else None
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+class FakeMessage:
+    """The single (ephemeral) message a command response and its component clicks keep editing."""
+    def __init__(self):
+        self.content = None
+        self.view = None
+
+    def update(self, content, view):
+        if content is not None:
+            self.content = content
+        if view is not ...:
+            self.view = view
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        self.interaction.reply = content
+        if view is not None:
+            self.interaction.message.update(content, view)
+
+    async def edit_message(self, *, content=None, view=..., **kwargs):
+        self.interaction.message.update(content, view)
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send_modal(self, modal):
+        self.interaction.reply = modal
+
+class FakeFollowup:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send(self, content=None, *, embed=None, **kwargs):
+        await self.channel.send(content, embed=embed)
+
+class FakeInteraction:
+    """One command or component click; clicks of the same flow share a FakeMessage."""
+    def __init__(self, sim, user, message=None, data=None):
+        self.user = user
+        self.guild = sim.guild
+        self.channel = sim.guild.channel
+        self.message = message or FakeMessage()
+        self.data = data or {}
+        self.reply = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(sim.guild.channel)
+        sim.interactions += 1
+
+    async def edit_original_response(self, *, content=None, view=..., **kwargs):
+        self.message.update(content, view)
+
+def choose(select, interaction, value):
+    """Sets a Select's chosen value the way discord.py does when a component interaction arrives."""
+    interaction.data = {"custom_id": select.custom_id, "component_type": 3, "values": [value]}
+    try:
+        select._refresh_state(interaction, interaction.data)
+    except TypeError: # discord.py 2.0 signature
+        select._refresh_state(interaction.data)
+
+def find(view, cls):
+    return next(item for item in view.children if isinstance(item, cls))
+
+# --- Fake Clock ---
+class FakeClock:
+    """Frozen wall clock (time.time) that only moves when advanced; asyncio keeps using the real monotonic clock."""
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+# --- Simulation ---
+class Simulation:
+    def __init__(self, bot, args):
+        self.bot = bot
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.guild = FakeGuild()
+        self.interactions = 0
+        self.outcomes = collections.Counter()
+        self.expected = collections.Counter() # user_id -> bookings the bot confirmed minus deletes it confirmed
+        self.lag = []
+
+    async def think(self):
+        if self.args.think:
+            await asyncio.sleep(self.rng.uniform(0, self.args.think))
+
+    async def book(self, user):
+        bot = self.bot
+        first = FakeInteraction(self, user)
+        await bot.requestbuff.callback(first)
+        msg = first.message
+        await self.think()
+        await msg.view.confirm.callback(FakeInteraction(self, user, msg))
+
+        await self.think()
+        click = FakeInteraction(self, user, msg)
+        date_select = find(msg.view, bot.DateSelect)
+        choose(date_select, click, self.rng.choice(date_select.options).value)
+        await date_select.callback(click)
+
+        await self.think()
+        click = FakeInteraction(self, user, msg)
+        title_select = find(msg.view, bot.TitleSelect)
+        choose(title_select, click, self.rng.choice(bot.BUFF_TITLES))
+        await title_select.callback(click)
+        if not any(isinstance(item, bot.TimeSelect) for item in msg.view.children):
+            self.outcomes["no free slot"] += 1
+            return
+
+        def has(cls):
+            return any(isinstance(item, cls) for item in msg.view.children)
+        for _ in range(3):
+            await self.think()
+            click = FakeInteraction(self, user, msg)
+            time_select = find(msg.view, bot.TimeSelect)
+            choose(time_select, click, self.rng.choice(time_select.options).value)
+            await time_select.callback(click)
+            if has(bot.RegionSelect) or not has(bot.TimeSelect):
+                break
+            self.outcomes["time picker refreshed"] += 1
+        if not has(bot.RegionSelect):
+            self.outcomes["gave up at time picker"] += 1
+            return
+
+        await self.think()
+        click = FakeInteraction(self, user, msg)
+        region_select = find(msg.view, bot.RegionSelect)
+        choose(region_select, click, self.rng.choice(region_select.options).value)
+        await region_select.callback(click)
+
+        await self.think()
+        await find(msg.view, bot.UseDiscordNameButton).callback(FakeInteraction(self, user, msg))
+        if msg.content and msg.content.startswith("Request submitted"):
+            self.outcomes["booked"] += 1
+            self.expected[user.id] += 1
+        else:
+            self.outcomes["rejected at finalize"] += 1
+
+    async def edit(self, user):
+        bot = self.bot
+        first = FakeInteraction(self, user)
+        await bot.mybuffs.callback(first)
+        msg = first.message
+        if not isinstance(msg.view, bot.MyBuffsView):
+            return
+        view = msg.view
+        await self.think()
+        await view.on_select(FakeInteraction(self, user, msg, {"values": [self.rng.choice(view.buff_select.options).value]}))
+
+        await self.think()
+        action = self.rng.choice(("time", "title", "delete"))
+        if action == "delete":
+            await view.on_delete(FakeInteraction(self, user, msg))
+            if msg.content and "successfully deleted" in msg.content:
+                self.expected[user.id] -= 1
+                self.outcomes["deleted"] += 1
+            return
+        await (view.on_change_time if action == "time" else view.on_change_title)(FakeInteraction(self, user, msg))
+        change_view = msg.view
+        if change_view is None or not change_view.children[0].options:
+            self.outcomes[f"change {action}: nothing free"] += 1
+            return
+        select = change_view.children[0]
+        await self.think()
+        await select.callback(FakeInteraction(self, user, msg, {"values": [self.rng.choice(select.options).value]}))
+        self.outcomes[f"change {action}: " + ("ok" if msg.content and msg.content.startswith("Your buff") else "conflict")] += 1
+
+    async def user_flow(self, user_id, gate):
+        user = FakeMember(user_id)
+        self.guild.members[user_id] = user
+        async with gate:
+            try:
+                await self.book(user)
+                if self.rng.random() < self.args.edit_fraction:
+                    await self.edit(user)
+            except Exception as e:
+                self.outcomes[f"error: {type(e).__name__}: {e}"] += 1
+
+    async def sample_lag(self, stop):
+        interval = 0.01
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.lag.append(max(0.0, time.perf_counter() - start - interval))
+
+    async def run_reminders(self, clock):
+        """Steps the fake clock a minute at a time until every stored slot has started."""
+        bot = self.bot
+        await bot.load_data()
+        start = clock.now
+        due = sum(1 for rec in bot.records.values() if rec.slot * 3600 - start > 300)
+        last = max((rec.slot for rec in bot.records.values()), default=0) * 3600
+        before = len(self.guild.channel.messages)
+        ticks = 0
+        tick_start = time.perf_counter()
+        while clock.now <= last:
+            clock.advance(60)
+            await bot.cleanup_old_data()
+            await bot.send_due_reminders(self.guild)
+            ticks += 1
+        sent = sum(1 for content, _ in self.guild.channel.messages[before:] if content and "Reminder:" in content)
+        return {"ticks": ticks, "seconds": time.perf_counter() - tick_start, "due": due, "sent": sent}
+
+def audit(bot, expected):
+    """Compares the data file with what the bot told users."""
+    with open(bot.DATA_FILE) as f:
+        raw = json.load(f)
+    per_key = collections.Counter()
+    per_user = collections.Counter()
+    for req in raw.values():
+        per_key[(req['title'], bot.parse_slot(req['time_slot']))] += 1
+        per_user[req['user_id']] += 1
+    duplicates = sum(n - 1 for n in per_key.values() if n > 1)
+    lost = sum(max(0, n - per_user.get(uid, 0)) for uid, n in expected.items())
+    phantom = sum(max(0, n - expected.get(uid, 0)) for uid, n in per_user.items())
+    return {"stored": len(raw), "duplicates": duplicates, "lost": lost, "phantom": phantom}
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run(args):
+    clock = FakeClock(time.time())
+    with mock.patch("time.time", clock.time):
+        import main as bot
+        sim = Simulation(bot, args)
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sim.sample_lag(stop))
+        gate = asyncio.Semaphore(args.concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(sim.user_flow(10_000 + i, gate) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+        booking_lag = list(sim.lag)
+        result = audit(bot, sim.expected)
+        reminders = await sim.run_reminders(clock)
+        for view in list(bot.live_views):
+            view.stop()
+
+    io = {op: row for (op,), row in bot.DATA_IO_SECONDS.series.items()}
+    print(f"users={args.users} concurrency={args.concurrency} think<={args.think}s seed={args.seed}")
+    print(f"interactions: {sim.interactions} in {elapsed:.2f}s = {sim.interactions / elapsed:.0f}/s")
+    print(f"event loop lag: p50={percentile(booking_lag, 0.5) * 1000:.1f}ms p99={percentile(booking_lag, 0.99) * 1000:.1f}ms max={max(booking_lag, default=0) * 1000:.1f}ms")
+    for op in ("load", "save"):
+        total, count = (io[op][-2], io[op][-1]) if op in io else (0.0, 0)
+        print(f"data {op}: {count} calls, {total * 1000:.0f}ms total, {total / count * 1000 if count else 0:.2f}ms avg")
+    print(f"data file: {os.path.getsize(bot.DATA_FILE) if os.path.exists(bot.DATA_FILE) else 0} bytes, {result['stored']} entries")
+    print("outcomes:")
+    for name, count in sorted(sim.outcomes.items()):
+        print(f"  {name}: {count}")
+    print(f"duplicate bookings: {result['duplicates']}  lost: {result['lost']}  phantom: {result['phantom']}")
+    print(f"reminders: {reminders['sent']} sent / {reminders['due']} due over {reminders['ticks']} ticks ({reminders['seconds']:.2f}s)")
+    return 1 if result['duplicates'] or result['lost'] or result['phantom'] or reminders['sent'] != reminders['due'] else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000, help="simulated users (default 1000)")
+    parser.add_argument("--concurrency", type=int, default=200, help="users in flight at once (default 200)")
+    parser.add_argument("--think", type=float, default=0.01, help="max random pause between clicks in seconds (default 0.01)")
+    parser.add_argument("--edit-fraction", type=float, default=0.3, help="share of users who then use /mybuffs (default 0.3)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="scratch directory (default: a new temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory (data file, archive, bot.log)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="buffbot-load-")
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, "config.json"), "w") as f:
+        json.dump({"token": "loadtest", "ping_role_id": str(PING_ROLE_ID), "log_channel_id": str(LOG_CHANNEL_ID)}, f)
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+    try:
+        code = asyncio.run(run(args))
+    finally:
+        if args.keep:
+            print(f"scratch files kept in {workdir}")
+        elif not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(code)
+
+if __name__ == "__main__":
+    main()
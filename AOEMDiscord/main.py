@@ -3,19 +3,28 @@ from discord import app_commands
 from discord.ui import Select, View, Button, Modal, TextInput
 import json
 import os
+import hashlib
+import fcntl
+import tempfile
+import heapq
 from datetime import datetime, timedelta, date, timezone
 import asyncio
+import bisect
+import aiohttp
+from aiohttp import web
+import functools
+import time
+import weakref
 import logging
-from logging.handlers import TimedRotatingFileHandler
 
-# --- Logging Setup ---
-log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-log_handler = TimedRotatingFileHandler('bot.log', when='D', interval=7, backupCount=4) # Rotates weekly
-log_handler.setFormatter(log_formatter)
-logger = logging.getLogger()
-# To see more detailed logs for debugging, change logging.INFO to logging.DEBUG
-logger.setLevel(logging.INFO) 
-logger.addHandler(log_handler)
+# Shared with the S77 web app: the S77 bot unit puts /opt/s77/app on PYTHONPATH,
+# a standalone install copies app-s77/s77 next to this file.
+from s77.core import TITLES, REGIONS, BuffRecord, slot_start, parse_slot, slot_of, now_slot
+from s77.services.logs import setup_logging, new_context, end_context
+try:
+    from s77.services.filewatch import FileWatcher
+except ImportError:
+    FileWatcher = None
 
 # --- Configuration ---
 # Add "log_channel_id" for the scheduled list posting.
@@ -24,126 +33,556 @@ logger.addHandler(log_handler)
 #   "ping_role_id": "YOUR_DISCORD_ROLE_ID",
 #   "log_channel_id": "YOUR_CHANNEL_ID_FOR_SCHEDULED_LISTS"
 # }
+# Optional: "metrics_port" (default 0 = off) - serves Prometheus metrics on http://127.0.0.1:<port>/metrics.
+# Optional: "retention_hours" (default 24) - how long after its time slot a buff is kept before it is archived.
+# Optional: "log_json" (default false) - write bot.log as JSON lines.
 with open('config.json', 'r') as f:
     config = json.load(f)
 
 DISCORD_TOKEN = config['token']
 PING_ROLE_ID = int(config['ping_role_id'])
 LOG_CHANNEL_ID = int(config['log_channel_id'])
+RETENTION_HOURS = int(config.get('retention_hours', 24))
+
+# --- Logging Setup ---
+# Log calls only enqueue the record; a background thread writes bot.log and rotates it weekly, off the event loop.
+# Optional "log_json": true in config.json writes JSON lines carrying the interaction step and user id.
+setup_logging('bot.log', json_lines=bool(config.get('log_json', False)), text_format='%(asctime)s - %(levelname)s - %(message)s',
+              rotate_when='D', rotate_interval=7, backup_count=4)
+logger = logging.getLogger()
+# To see more detailed logs for debugging, change logging.INFO to logging.DEBUG
+logger.setLevel(logging.INFO) 
+
+# --- Metrics ---
+METRICS_PORT = int(config.get('metrics_port', 0))
+
+class Histogram:
+    """Minimal Prometheus histogram keyed by label values."""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, labels, buckets
+        self.series = {} # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *label_values):
+        row = self.series.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for label_values, row in self.series.items():
+            pairs = [f'{k}="{v}"' for k, v in zip(self.labels, label_values)]
+            for bound, count in zip(list(self.buckets) + ["+Inf"], row[:len(self.buckets)] + [row[-1]]):
+                bucket_pairs = ','.join(pairs + ['le="%s"' % bound])
+                lines.append(f"{self.name}_bucket{{{bucket_pairs}}} {count}")
+            suffix = "{" + ','.join(pairs) + "}" if pairs else ""
+            lines.append(f"{self.name}_sum{suffix} {row[-2]}")
+            lines.append(f"{self.name}_count{suffix} {row[-1]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name, self.doc, self.labels = name, doc, labels
+        self.series = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.series.items():
+            pairs = ','.join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            lines.append(f"{self.name}{{{pairs}}} {value}" if pairs else f"{self.name} {value}")
+        return lines
+
+class Gauge:
+    """Gauge read from a callable at scrape time."""
+    def __init__(self, name: str, doc: str, read):
+        self.name, self.doc, self.read = name, doc, read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+INTERACTION_SECONDS = Histogram("bot_interaction_seconds", "Interaction handler latency per command and view step.", ("step",))
+DISCORD_API_SECONDS = Histogram("bot_discord_api_seconds", "Discord REST call latency.", ("method", "route"))
+DISCORD_RATE_LIMITS = Counter("bot_discord_rate_limited_total", "Discord REST responses with HTTP 429.")
+DATA_IO_SECONDS = Histogram("bot_data_io_seconds", "load_data/save_data duration (load only counts real file reads).", ("op",))
+REMINDER_LATENESS = Histogram("bot_reminder_lateness_seconds", "Reminder send time minus its target (5 minutes before the slot).", buckets=(1, 5, 10, 30, 60, 90, 120, 300))
+LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "Event loop lag sampled once per second.", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+live_views = weakref.WeakSet()
+METRICS = [
+    INTERACTION_SECONDS, DISCORD_API_SECONDS, DISCORD_RATE_LIMITS, DATA_IO_SECONDS, REMINDER_LATENESS, LOOP_LAG,
+    Gauge("bot_data_file_bytes", "Size of the buff data file.", lambda: os.path.getsize(DATA_FILE) if os.path.exists(DATA_FILE) else 0),
+    Gauge("bot_live_views", "View objects that are still accepting interactions.", lambda: sum(1 for v in list(live_views) if not v.is_finished())),
+]
+
+def timed(step: str):
+    """Records the wrapped interaction handler's latency under `step` and tags its log records with the step and user."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            interaction = next((a for a in args if isinstance(a, discord.Interaction)), None)
+            token = new_context(interaction=step, user=interaction.user.id if interaction else None)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                INTERACTION_SECONDS.observe(time.perf_counter() - start, step)
+                end_context(token)
+        return wrapper
+    return decorator
+
+class TrackedView(View):
+    """View that counts towards bot_live_views."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        live_views.add(self)
+
+class RateLimitCounter(logging.Filter):
+    # discord.py retries 429s internally and only reports them through the discord.http logger
+    def filter(self, record):
+        if "429" in record.getMessage():
+            DISCORD_RATE_LIMITS.inc()
+        return True
+
+def instrument_http(http):
+    """Wraps discord.py's HTTPClient.request so every REST call is timed by method and route template."""
+    original = http.request
+
+    async def request(route, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(route, **kwargs)
+        finally:
+            DISCORD_API_SECONDS.observe(time.perf_counter() - start, route.method, route.path)
+    http.request = request
+
+async def loop_lag_task():
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(1)
+        LOOP_LAG.observe(max(0.0, time.perf_counter() - start - 1))
+
+async def metrics_handler(request):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+metrics_runner = None
+
+async def start_metrics():
+    """Starts the loopback /metrics endpoint and loop-lag sampler once; a no-op when metrics_port is 0."""
+    global metrics_runner
+    if not METRICS_PORT or metrics_runner is not None:
+        return
+    instrument_http(client.http)
+    logging.getLogger("discord.http").addFilter(RateLimitCounter())
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    metrics_runner = web.AppRunner(app, access_log=None)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, "127.0.0.1", METRICS_PORT).start()
+    client.background_tasks.append(asyncio.create_task(loop_lag_task(), name="loop_lag_task")) # cancelled by BuffBot.close()
+    logger.info("Serving metrics on http://127.0.0.1:%s/metrics", METRICS_PORT)
 
 # --- Data Management ---
 DATA_FILE = "buff_requests.json"
+ARCHIVE_FILE = "buff_requests_archive.jsonl" # Expired buffs, one JSON object per line
+SYNC_HASH_FILE = "command_sync.hash" # Hash of the last slash-command tree pushed to Discord
 sent_reminders = set() # To avoid duplicate reminders
 
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-    return {}
-
-def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
-
-def cleanup_old_data():
-    """Removes buff requests where the scheduled time slot is more than 24 hours in the past."""
-    requests = load_data()
-    if not requests:
-        return
+BUFF_TITLES = list(TITLES.names)
+
+# In-memory view of DATA_FILE, rebuilt whenever the file changes on disk. Legacy dicts are only
+# parsed here; hot paths use BuffRecords with integer epoch-hour slots and title codes.
+# records maps request id -> BuffRecord, slot_index maps (title code, slot) -> request id,
+# user_index maps user_id -> set of request ids, expiry_heap holds (slot, request id) oldest first.
+records = {}
+slot_index = {}
+user_index = {}
+expiry_heap = []
+_data_cache = {"stamp": None, "data": {}, "base": {}, "writing": False} # base: the file as last read or written, to diff saves against
+
+def rebuild_indexes(requests: dict):
+    records.clear()
+    slot_index.clear()
+    user_index.clear()
+    expiry_heap.clear()
+    for req_id, req in requests.items():
+        try:
+            rec = BuffRecord.from_legacy(req_id, req)
+        except (ValueError, KeyError, TypeError):
+            continue
+        records[req_id] = rec
+        slot_index[rec.key] = req_id
+        user_index.setdefault(rec.user_id, set()).add(req_id)
+        expiry_heap.append((rec.slot, req_id))
+    heapq.heapify(expiry_heap)
+
+# All file I/O runs in worker threads so a large data file never stalls heartbeats or other users.
+# Read-modify-write of DATA_FILE happens under data_lock; a booking additionally holds its slot's lock
+# from the final conflict re-check until the booking is committed.
+data_lock = asyncio.Lock()
+slot_locks = weakref.WeakValueDictionary() # (title code, slot) -> asyncio.Lock, dropped once nobody holds it
+
+def slot_lock(title: str, slot: int) -> asyncio.Lock:
+    key = (TITLES.code(title), slot)
+    lock = slot_locks.get(key)
+    if lock is None:
+        lock = slot_locks[key] = asyncio.Lock()
+    return lock
+
+def _file_stamp():
+    try:
+        st = os.stat(DATA_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _read_file():
+    with open(DATA_FILE, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return {}
 
-    twenty_four_hours_ago = datetime.now(timezone.utc) - timedelta(hours=24)
-    
-    # Use a list of keys to delete to avoid modifying the dictionary while iterating
-    keys_to_delete = []
-    
-    for req_id, req_data in requests.items():
+def _snapshot(data):
+    return {req_id: dict(req) for req_id, req in data.items()}
+
+def _write_file(changes, removed):
+    """Applies the bot's changes to the file's current contents and returns (merged data, stamp).
+
+    Runs under the same flock the web app takes (discord_sync._locked on SHARED_JSON + ".lock"), so a
+    web booking written since our last read is merged rather than overwritten.
+    """
+    with open(DATA_FILE + ".lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
         try:
-            # Base the cleanup on the 'time_slot' of the event
-            time_slot = datetime.fromisoformat(req_data['time_slot'])
-            
-            # Make the datetime object timezone-aware if it's naive (for handling old data)
-            if time_slot.tzinfo is None:
-                time_slot = time_slot.replace(tzinfo=timezone.utc)
-            
-            # If the scheduled time is older than 24 hours ago, mark it for deletion
-            if time_slot < twenty_four_hours_ago:
-                keys_to_delete.append(req_id)
-                # Add a detailed log message for each expired buff
-                logger.info(f"Cleaning up expired buff: '{req_data.get('title', 'N/A')}' for user '{req_data.get('user_name', 'N/A')}' (Scheduled at: {req_data.get('time_slot', 'N/A')})")
-
-        except (ValueError, KeyError) as e:
-            logger.warning(f"Skipping request during cleanup with ID {req_id} due to invalid data: {e}")
+            data = _read_file() if os.path.exists(DATA_FILE) else {}
+            for req_id in removed:
+                data.pop(req_id, None)
+            data.update(changes)
+            # Write-then-rename so the web app and the file watcher never see a half-written file
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(DATA_FILE) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(DATA_FILE)))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f, indent=4)
+                os.replace(tmp, DATA_FILE)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            return data, _file_stamp()
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+async def load_data():
+    """Returns the request dict, re-reading DATA_FILE (in a thread) only when it changed since the last read or write."""
+    stamp = _file_stamp()
+    if stamp is None:
+        if _data_cache["stamp"] is not None:
+            _data_cache.update(stamp=None, data={}, base={})
+            rebuild_indexes({})
+        return _data_cache["data"]
+    # While our own write is in flight the file already has its new stamp but the cached dict is the newer copy
+    if stamp != _data_cache["stamp"] and not _data_cache["writing"]:
+        cached = _data_cache["stamp"]
+        start = time.perf_counter()
+        data = await asyncio.to_thread(_read_file)
+        DATA_IO_SECONDS.observe(time.perf_counter() - start, "load")
+        if _data_cache["stamp"] == cached: # nobody refreshed or saved while we were reading
+            _data_cache.update(stamp=stamp, data=data, base=_snapshot(data))
+            rebuild_indexes(data)
+    return _data_cache["data"]
+
+async def save_data(data):
+    """Saves the entries added, changed or removed in `data` since the last load or save, in a thread.
+
+    Call with data_lock held when the data came from load_data().
+    """
+    start = time.perf_counter()
+    base = _data_cache["base"]
+    changes = {req_id: dict(req) for req_id, req in data.items() if base.get(req_id) != req} # copied: the loop may keep editing `data`
+    removed = [req_id for req_id in base if req_id not in data]
+    _data_cache["writing"] = True
+    try:
+        merged, stamp = await asyncio.to_thread(_write_file, changes, removed)
+    finally:
+        _data_cache["writing"] = False
+    _data_cache.update(stamp=stamp, data=merged, base=_snapshot(merged))
+    rebuild_indexes(merged)
+    DATA_IO_SECONDS.observe(time.perf_counter() - start, "save")
+
+def is_slot_taken(title: str, slot: int, exclude_id: str = None) -> bool:
+    """O(1) conflict check against the (title, slot) index (refresh it with load_data() first). `exclude_id` lets a buff ignore its own slot."""
+    owner = slot_index.get((TITLES.code(title), slot))
+    return owner is not None and owner != exclude_id
+
+def free_hours(title: str, day: date, exclude_id: str = None):
+    """Returns the slots on `day` that have not ended yet and are still open for `title` (refresh with load_data() first)."""
+    now = now_slot()
+    code = TITLES.code(title)
+    first = slot_of(datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc))
+    hours = []
+    for slot in range(first, first + 24):
+        if slot + 1 <= now:
             continue
+        owner = slot_index.get((code, slot))
+        if owner is None or owner == exclude_id:
+            hours.append(slot)
+    return hours
+
+def time_slot_options(slots):
+    options = []
+    for slot in slots:
+        dt_obj = slot_start(slot)
+        label = f"{dt_obj.strftime('%H:%M')} - {(dt_obj + timedelta(hours=1)).strftime('%H:%M')} UTC"
+        options.append(discord.SelectOption(label=label, value=dt_obj.isoformat()))
+    return options
+
+async def cleanup_old_data():
+    """Archives buff requests whose time slot is more than RETENTION_HOURS in the past.
+
+    Pops from the time-ordered expiry heap, so a tick with nothing to expire costs one comparison
+    and the live file stays bounded to roughly two days of slots.
+    """
+    async with data_lock:
+        requests = await load_data()
+        horizon = now_slot() - RETENTION_HOURS
+        expired = []
+        while expiry_heap and expiry_heap[0][0] < horizon:
+            _, req_id = heapq.heappop(expiry_heap)
+            req = requests.get(req_id)
+            if req is not None:
+                expired.append((req_id, req))
+
+        if not expired:
+            return
 
-    # If there are items to delete, remove them from the original dictionary and save
-    if keys_to_delete:
-        for key in keys_to_delete:
-            if key in requests:
-                del requests[key]
-        save_data(requests)
-        logger.info(f"Finished cleanup. Removed {len(keys_to_delete)} expired buff requests.")
+        expired_at = datetime.now(timezone.utc).isoformat()
+        lines = [json.dumps({"id": req_id, **req, "expired_at": expired_at}) + "\n" for req_id, req in expired]
+        await asyncio.to_thread(_append_archive, lines)
+        for req_id, req in expired:
+            logger.info("Archiving expired buff: '%s' for user '%s' (Scheduled at: %s)", req.get('title', 'N/A'), req.get('user_name', 'N/A'), req.get('time_slot', 'N/A'))
+            del requests[req_id]
+            sent_reminders.discard(req_id)
+        await save_data(requests)
+    logger.info("Finished cleanup. Archived %s expired buff requests.", len(expired))
+
+def _append_archive(lines):
+    with open(ARCHIVE_FILE, 'a') as f:
+        f.writelines(lines)
+
+# --- Web Bridge ---
+# Optional config keys to book through the S77 web app's local bridge API instead of only the shared file:
+#   "bridge_url": "http://127.0.0.1:8000", "bridge_token": "SAME_AS_S77_BRIDGE_TOKEN"
+#   "bridge_socket": "/opt/s77/shared/s77.sock" (optional, when the web app also listens on a Unix socket)
+BRIDGE_URL = config.get('bridge_url')
+BRIDGE_TOKEN = config.get('bridge_token', '')
+BRIDGE_SOCKET = config.get('bridge_socket')
+
+class BridgeClient:
+    """Keep-alive client for the S77 bridge API. Calls return None when the web app is unreachable so callers fall back to the file store."""
+    def __init__(self, base_url: str, token: str, socket_path: str = None):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.socket_path = socket_path
+        self.session = None
+
+    def _session(self):
+        # One pooled session for the whole bot, created lazily inside the running event loop
+        if self.session is None or self.session.closed:
+            if self.socket_path:
+                connector = aiohttp.UnixConnector(path=self.socket_path, limit=8, keepalive_timeout=60)
+            else:
+                connector = aiohttp.TCPConnector(limit=8, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, headers={"X-S77-Bridge-Token": self.token}, timeout=aiohttp.ClientTimeout(total=5))
+        return self.session
+
+    async def _request(self, method: str, path: str, expect=(200,), **kwargs):
+        """Returns (status, body) for the statuses in `expect`; anything else is logged and returns None.
+
+        A 401 (wrong token), 404 (wrong bridge_url) or 400 is a setup problem rather than an answer, so
+        callers fall back to the file store instead of reporting it as, say, a taken slot.
+        """
+        try:
+            async with self._session().request(method, self.base_url + path, **kwargs) as resp:
+                if resp.status not in expect:
+                    logger.warning("Bridge %s %s failed with HTTP %s: %s", method, path, resp.status, (await resp.text())[:200])
+                    return None
+                body = await resp.json(content_type=None) if resp.content_length != 0 else None
+                return resp.status, body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Bridge %s %s unreachable: %s", method, path, e)
+            return None
+
+    async def create(self, user_id: int, user_name: str, title: str, region: str, time_slot: str):
+        """Returns the HTTP status (201 created, 409 conflict) or None when unreachable or misconfigured."""
+        result = await self._request("POST", "/bridge/buffs", expect=(201, 409), json={"aoe_name": user_name, "title": title, "region": region, "start_iso": time_slot, "discord_user_id": user_id})
+        return result[0] if result else None
+
+    async def delete(self, title: str, time_slot: str):
+        result = await self._request("DELETE", "/bridge/buffs", params={"title": title, "start_iso": time_slot})
+        return result[1].get("deleted", False) if result else None
+
+    async def move(self, title: str, time_slot: str, new_title: str, new_time_slot: str):
+        """Returns the HTTP status (200 moved, 409 conflict) or None when unreachable, misconfigured or not in the web DB."""
+        # 404 is expected for bookings that only live in the shared file, so it is not logged as a failure
+        result = await self._request("PATCH", "/bridge/buffs", expect=(200, 404, 409), json={"title": title, "start_iso": time_slot, "new_title": new_title, "new_start_iso": new_time_slot})
+        return result[0] if result and result[0] != 404 else None
+
+    async def clear(self):
+        """Deletes every upcoming web booking; returns the number of DB rows removed, or None when unreachable or misconfigured."""
+        result = await self._request("POST", "/bridge/clear")
+        return result[1].get("db_deleted", 0) if result else None
+
+    async def list_buffs(self, days: int = 3):
+        result = await self._request("GET", "/bridge/buffs", params={"days": days})
+        return result[1]["items"] if result else None
+
+    async def free_hours(self, title: str, day: date):
+        result = await self._request("GET", "/bridge/availability", params={"title": title, "date": day.isoformat()})
+        return result[1]["free_hours"] if result else None
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+bridge = BridgeClient(BRIDGE_URL, BRIDGE_TOKEN, BRIDGE_SOCKET) if BRIDGE_URL else None
+
+async def available_hours(title: str, day: date, exclude_id: str = None):
+    """Free slots for `title` on `day`, from the web app when bridged (it also sees web bookings), else the local index."""
+    if bridge and exclude_id is None:
+        hours = await bridge.free_hours(title, day)
+        if hours is not None:
+            first = slot_of(datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc))
+            return [first + h for h in hours]
+    await load_data()
+    return free_hours(title, day, exclude_id)
+
+async def current_records():
+    """BuffRecords for listings, preferring the web app's merged view when bridged."""
+    if bridge:
+        items = await bridge.list_buffs()
+        if items is not None:
+            return [BuffRecord.from_legacy(it['id'], {"user_name": it['aoe_name'], "title": it['title'], "region": it['region'], "time_slot": it['start_iso']}) for it in items]
+    await load_data()
+    return list(records.values())
 
 # --- Bot Setup ---
 intents = discord.Intents.default()
 intents.members = True 
-client = discord.Client(intents=intents)
+class BuffBot(discord.Client):
+    """Starts background work once from setup_hook; on_ready fires again on every reconnect."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.background_tasks = []
+
+    async def setup_hook(self):
+        await sync_commands_if_changed()
+        self.background_tasks = [
+            asyncio.create_task(reminder_task(), name="reminder_task"),
+            asyncio.create_task(schedule_task(), name="schedule_task"),
+        ]
+        await start_data_watch()
+        await start_metrics()
+
+    async def close(self):
+        for task in self.background_tasks:
+            task.cancel()
+        if data_watcher is not None:
+            data_watcher.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if bridge:
+            await bridge.close()
+        await super().close()
+
+client = BuffBot(intents=intents)
 tree = app_commands.CommandTree(client)
 
+def command_tree_hash() -> str:
+    payload = []
+    for cmd in tree.get_commands():
+        try:
+            payload.append(cmd.to_dict(tree)) # discord.py 2.4+
+        except TypeError:
+            payload.append(cmd.to_dict())
+    raw = json.dumps({"application_id": client.application_id, "commands": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+async def sync_commands_if_changed():
+    """Pushes slash commands to Discord only when the tree differs from the last successful sync."""
+    current = command_tree_hash()
+    previous = None
+    if os.path.exists(SYNC_HASH_FILE):
+        with open(SYNC_HASH_FILE, 'r') as f:
+            previous = f.read().strip()
+    if current == previous:
+        logger.info("Slash commands unchanged since last sync; skipping tree.sync().")
+        return
+    await tree.sync()
+    with open(SYNC_HASH_FILE, 'w') as f:
+        f.write(current)
+    logger.info("Synced slash commands with Discord.")
+
 # --- Helper Function ---
 async def create_buffs_embeds(guild: discord.Guild, limit: int = None):
     """Creates and returns a list of embeds for the buff list, filtering out past events."""
-    requests = load_data()
-    if not requests:
+    recs = await current_records()
+    if not recs:
         return []
 
-    now_utc = datetime.now(timezone.utc)
+    now = now_slot()
     # Filter out any requests where the time slot has already passed
-    future_requests = [req for req in requests.values() if datetime.fromisoformat(req['time_slot']) > now_utc]
+    future_requests = [rec for rec in recs if rec.slot > now]
 
     if not future_requests:
         return []
 
     if limit:
         # Sort by the event time to get the soonest upcoming buffs, then take the limit
-        sorted_requests = sorted(future_requests, key=lambda x: x['time_slot'])[:limit]
+        sorted_requests = sorted(future_requests, key=lambda rec: rec.slot)[:limit]
         title = f"Next {limit} Upcoming Buffs"
     else:
         # If no limit, show all future requests sorted chronologically by event time
-        sorted_requests = sorted(future_requests, key=lambda x: x['time_slot'])
+        sorted_requests = sorted(future_requests, key=lambda rec: rec.slot)
         title = "Current Buff Requests"
     
     embeds = []
     current_embed = discord.Embed(title=title, color=discord.Color.blue())
     field_count = 0
 
-    for req in sorted_requests:
+    for rec in sorted_requests:
         if field_count >= 25:
             embeds.append(current_embed)
             current_embed = discord.Embed(title=f"{title} (Cont.)", color=discord.Color.blue())
             field_count = 0
 
-        start_time_obj = datetime.fromisoformat(req['time_slot'])
-        time_range_str = f"{start_time_obj.strftime('%Y-%m-%d %H:%M')} UTC"
-        
-        field_name = f"Title: {req['title']} | Region: {req['region']}"
-        field_value = f"User: **{req['user_name']}**\nTime Slot: {time_range_str}"
-        current_embed.add_field(name=field_name, value=field_value, inline=False)
+        add_buff_field(current_embed, rec)
         field_count += 1
     
     embeds.append(current_embed)
     return embeds
 
+def add_buff_field(embed: discord.Embed, rec: BuffRecord):
+    time_range_str = f"{rec.start.strftime('%Y-%m-%d %H:%M')} UTC"
+    embed.add_field(name=f"Title: {rec.title_name} | Region: {rec.region_name}",
+                    value=f"User: **{rec.user_name}**\nTime Slot: {time_range_str}", inline=False)
+
 # --- UI Components ---
 
-class ConfirmationView(View):
+class ConfirmationView(TrackedView):
     def __init__(self):
         super().__init__(timeout=60)
         self.confirmed = None
 
     @discord.ui.button(label="Yes", style=discord.ButtonStyle.success)
+    @timed("confirm.yes")
     async def confirm(self, interaction: discord.Interaction, button: Button):
         self.confirmed = True
         buff_view = BuffRequestView(interaction)
@@ -151,6 +590,7 @@ class ConfirmationView(View):
         self.stop()
 
     @discord.ui.button(label="No", style=discord.ButtonStyle.danger)
+    @timed("confirm.no")
     async def cancel(self, interaction: discord.Interaction, button: Button):
         self.confirmed = False
         await interaction.response.edit_message(content="Please apply at the IC before continuing or DIOR will come knocking", view=None)
@@ -164,22 +604,25 @@ class AoEMNameModal(Modal, title='Enter Your In-Game Name'):
         super().__init__(timeout=300)
         self.parent_view = view
 
+    @timed("name_modal.submit")
     async def on_submit(self, interaction: discord.Interaction):
         await self.parent_view.finalize_request(interaction, self.name_input.value)
 
 class UseDiscordNameButton(Button):
     def __init__(self):
         super().__init__(label="Use Discord Name", style=discord.ButtonStyle.primary, row=0)
+    @timed("name.discord")
     async def callback(self, interaction: discord.Interaction):
         await self.view.finalize_request(interaction, interaction.user.display_name)
 
 class EnterCustomNameButton(Button):
     def __init__(self):
         super().__init__(label="Enter In-Game Name", style=discord.ButtonStyle.secondary, row=0)
+    @timed("name.custom")
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.send_modal(AoEMNameModal(view=self.view))
 
-class BuffRequestView(View):
+class BuffRequestView(TrackedView):
     def __init__(self, interaction: discord.Interaction):
         super().__init__(timeout=300)
         self.interaction = interaction
@@ -196,25 +639,44 @@ class BuffRequestView(View):
     async def finalize_request(self, interaction: discord.Interaction, requester_name: str):
         await interaction.response.defer()
         for item in self.children: item.disabled = True
-        await self.interaction.edit_original_response(content="Request submitted! The confirmation has been sent to the channel.", view=self)
 
         sanitized_name = discord.utils.escape_markdown(requester_name)
-        requests = load_data()
         request_time_utc = datetime.now(timezone.utc)
         start_time_obj = datetime.fromisoformat(self.time_slot)
         time_range_str = f"{start_time_obj.strftime('%H:%M')} UTC"
 
-        request_id = str(request_time_utc.timestamp())
-        requests[request_id] = {
-            "user_id": interaction.user.id,
-            "user_name": sanitized_name,
-            "title": self.buff_title,
-            "time_slot": self.time_slot,
-            "region": self.region,
-            "request_time": request_time_utc.isoformat()
-        }
-        save_data(requests)
-        logger.info(f"New buff request by {interaction.user} ({sanitized_name}): {self.buff_title} in {self.region} at {self.time_slot}")
+        slot = parse_slot(self.time_slot)
+        async with slot_lock(self.buff_title, slot):
+            # Final re-check: the slot was free when it was picked, but others may have booked it in the clicks since
+            await load_data()
+            status = 409 if is_slot_taken(self.buff_title, slot) else None
+            if status is None and bridge:
+                status = await bridge.create(interaction.user.id, sanitized_name, self.buff_title, self.region, self.time_slot)
+            if status is None:
+                # No bridge configured, or the web app is down or rejected the call (logged): book straight into the shared file
+                async with data_lock:
+                    requests = await load_data()
+                    if is_slot_taken(self.buff_title, slot): # a web booking may have landed meanwhile
+                        status = 409
+                    else:
+                        request_id = str(request_time_utc.timestamp())
+                        requests[request_id] = {
+                            "user_id": interaction.user.id,
+                            "user_name": sanitized_name,
+                            "title": self.buff_title,
+                            "time_slot": self.time_slot,
+                            "region": self.region,
+                            "request_time": request_time_utc.isoformat()
+                        }
+                        await save_data(requests)
+                        status = 201
+        if status == 409:
+            await self.interaction.edit_original_response(content="Sorry, that time slot was just taken. Please run /requestbuff again.", view=self)
+            logger.info("Rejected buff request by %s (%s): %s at %s was taken (HTTP %s)", interaction.user, sanitized_name, self.buff_title, self.time_slot, status)
+            return
+
+        await self.interaction.edit_original_response(content="Request submitted! The confirmation has been sent to the channel.", view=self)
+        logger.info("New buff request by %s (%s): %s in %s at %s", interaction.user, sanitized_name, self.buff_title, self.region, self.time_slot)
 
         embed = discord.Embed(title="New Capital Buff Request!", description=f"{interaction.user.mention} (**{sanitized_name}**) has requested the **{self.buff_title}** buff for **{start_time_obj.strftime('%Y-%m-%d')} at {time_range_str}** in the **{self.region}** region.", color=discord.Color.green())
         ping_role = interaction.guild.get_role(PING_ROLE_ID)
@@ -235,6 +697,7 @@ class DateSelect(Select):
             options.append(discord.SelectOption(label=current_date.strftime('%A, %B %d'), value=current_date.isoformat()))
         super().__init__(placeholder="Step 1: Select a date...", options=options)
     
+    @timed("request.date")
     async def callback(self, interaction: discord.Interaction):
         self.view.selected_date = self.values[0]
         self.disabled = True
@@ -243,33 +706,38 @@ class DateSelect(Select):
 
 class TitleSelect(Select):
     def __init__(self):
-        options = [discord.SelectOption(label=t, value=t) for t in ["Research", "Training", "Building", "Combat", "PvP"]]
+        options = [discord.SelectOption(label=t, value=t) for t in BUFF_TITLES]
         super().__init__(placeholder="Step 2: Select a buff title...", options=options)
 
+    @timed("request.title")
     async def callback(self, interaction: discord.Interaction):
+        hours = await available_hours(self.values[0], date.fromisoformat(self.view.selected_date))
+        if not hours:
+            await interaction.response.send_message(f"There are no free **{self.values[0]}** time slots left on that date. Please pick another title.", ephemeral=True)
+            return
         self.view.buff_title = self.values[0]
         self.disabled = True
-        self.view.add_item(TimeSelect(self.view.selected_date))
+        self.view.add_item(TimeSelect(hours))
         await interaction.response.edit_message(view=self.view)
 
 class TimeSelect(Select):
-    def __init__(self, selected_date_str: str):
-        selected_date = date.fromisoformat(selected_date_str)
-        options = []
-        for i in range(24):
-            dt_obj = datetime.combine(selected_date, datetime.min.time(), tzinfo=timezone.utc) + timedelta(hours=i)
-            label = f"{dt_obj.strftime('%H:%M')} - {(dt_obj + timedelta(hours=1)).strftime('%H:%M')} UTC"
-            options.append(discord.SelectOption(label=label, value=dt_obj.isoformat()))
-        super().__init__(placeholder="Step 3: Select a time slot (UTC)...", options=options)
+    """Offers only the hours that are still free for the chosen title, so conflicts are rare races rather than the norm."""
+    def __init__(self, hours):
+        super().__init__(placeholder="Step 3: Select a time slot (UTC)...", options=time_slot_options(hours))
 
+    @timed("request.time")
     async def callback(self, interaction: discord.Interaction):
-        requests = load_data()
         selected_time = self.values[0]
-        for req in requests.values():
-            if req['time_slot'] == selected_time and req['title'] == self.view.buff_title:
-                await interaction.response.send_message("This time slot is already taken.", ephemeral=True)
-                await self.view.interaction.edit_original_response(content="Selection conflict. Please start over.", view=BuffRequestView(self.view.interaction))
+        await load_data()
+        if is_slot_taken(self.view.buff_title, parse_slot(selected_time)):
+            # Someone booked it after the picker was built; refresh the choices instead of starting over.
+            hours = await available_hours(self.view.buff_title, date.fromisoformat(self.view.selected_date))
+            if not hours:
+                await interaction.response.edit_message(content="All remaining time slots for this title were just taken. Please start over.", view=BuffRequestView(self.view.interaction))
                 return
+            self.options = time_slot_options(hours)
+            await interaction.response.edit_message(content="That time slot was just taken. Please pick another free slot.", view=self.view)
+            return
         self.view.time_slot = selected_time
         self.disabled = True
         self.view.add_item(RegionSelect())
@@ -277,28 +745,28 @@ class TimeSelect(Select):
 
 class RegionSelect(Select):
     def __init__(self):
-        regions = ["Imperial City", "Gaul", "Olympia", "Neilos", "Tinir", "East Kingsland", "Eastland", "Kyuno", "North Kingsland", "West Kingsland", "NA"]
-        options = [discord.SelectOption(label=r, value=r) for r in regions]
+        options = [discord.SelectOption(label=r, value=r) for r in REGIONS.names]
         super().__init__(placeholder="Step 4: Select a region...", options=options)
 
+    @timed("request.region")
     async def callback(self, interaction: discord.Interaction):
-        self.view.region = self.values[0]
-        self.view.clear_items()
-        self.view.add_item(UseDiscordNameButton())
-        self.view.add_item(EnterCustomNameButton())
-        await interaction.response.edit_message(content="Last step! Specify your name for the request.", view=self.view)
-
-class MyBuffsView(View):
-    def __init__(self, user_buffs: dict):
+        view = self.view # clear_items() detaches this select from the view on newer discord.py
+        view.region = self.values[0]
+        view.clear_items()
+        view.add_item(UseDiscordNameButton())
+        view.add_item(EnterCustomNameButton())
+        await interaction.response.edit_message(content="Last step! Specify your name for the request.", view=view)
+
+class MyBuffsView(TrackedView):
+    def __init__(self, user_buffs: list):
         super().__init__(timeout=180)
         self.user_buffs = user_buffs
         self.selected_buff_id = None
 
         options = []
-        for req_id, req in user_buffs.items():
-            start_time = datetime.fromisoformat(req['time_slot'])
-            label = f"{req['title']} in {req['region']} at {start_time.strftime('%Y-%m-%d %H:%M')}"
-            options.append(discord.SelectOption(label=label, value=req_id))
+        for rec in user_buffs:
+            label = f"{rec.title_name} in {rec.region_name} at {rec.start.strftime('%Y-%m-%d %H:%M')}"
+            options.append(discord.SelectOption(label=label, value=rec.id))
 
         self.buff_select = Select(placeholder="Select a buff to manage...", options=options)
         self.buff_select.callback = self.on_select
@@ -316,6 +784,7 @@ class MyBuffsView(View):
         self.delete_button.callback = self.on_delete
         self.add_item(self.delete_button)
 
+    @timed("mybuffs.select")
     async def on_select(self, interaction: discord.Interaction):
         self.selected_buff_id = interaction.data['values'][0]
         self.delete_button.disabled = False
@@ -323,26 +792,47 @@ class MyBuffsView(View):
         self.change_time_button.disabled = False
         await interaction.response.edit_message(view=self)
 
+    @timed("mybuffs.change_title")
     async def on_change_title(self, interaction: discord.Interaction):
-        view = ChangeTitleView(self.selected_buff_id)
+        await load_data()
+        rec = records.get(self.selected_buff_id)
+        if rec is None:
+            await interaction.response.edit_message(content="This buff seems to have been deleted or expired.", view=None)
+            return
+
+        titles = [t for t in BUFF_TITLES if not is_slot_taken(t, rec.slot, exclude_id=rec.id)]
+        view = ChangeTitleView(self.selected_buff_id, titles)
         await interaction.response.edit_message(content="Please select the new title for your buff.", view=view)
 
+    @timed("mybuffs.change_time")
     async def on_change_time(self, interaction: discord.Interaction):
-        requests = load_data()
-        if self.selected_buff_id not in requests:
+        await load_data()
+        rec = records.get(self.selected_buff_id)
+        if rec is None:
             await interaction.response.edit_message(content="This buff seems to have been deleted or expired.", view=None)
             return
         
-        original_buff_date = datetime.fromisoformat(requests[self.selected_buff_id]['time_slot']).date()
-        view = ChangeTimeView(self.selected_buff_id, original_buff_date.isoformat())
+        hours = free_hours(rec.title_name, rec.start.date(), exclude_id=rec.id)
+        if not hours:
+            await interaction.response.edit_message(content="There are no free time slots left for this buff on that date.", view=None)
+            return
+
+        view = ChangeTimeView(self.selected_buff_id, hours)
         await interaction.response.edit_message(content="Please select the new time slot for your buff.", view=view)
 
+    @timed("mybuffs.delete")
     async def on_delete(self, interaction: discord.Interaction):
-        requests = load_data()
+        requests = await load_data()
         if self.selected_buff_id in requests:
-            del requests[self.selected_buff_id]
-            save_data(requests)
-            logger.info(f"User {interaction.user} deleted their buff request (ID: {self.selected_buff_id})")
+            req = requests[self.selected_buff_id]
+            if bridge:
+                # Removes the web copy too; the shared-file entry is dropped below either way
+                await bridge.delete(req['title'], req['time_slot'])
+            async with data_lock:
+                requests = await load_data()
+                requests.pop(self.selected_buff_id, None)
+                await save_data(requests)
+            logger.info("User %s deleted their buff request (ID: %s)", interaction.user, self.selected_buff_id)
             
             for item in self.children:
                 item.disabled = True
@@ -352,103 +842,222 @@ class MyBuffsView(View):
                 item.disabled = True
             await interaction.response.edit_message(content="This buff may have already been deleted or expired.", view=self)
 
-class ChangeTitleView(View):
-    def __init__(self, buff_id: str):
+class ChangeTitleView(TrackedView):
+    def __init__(self, buff_id: str, titles: list):
         super().__init__(timeout=180)
         self.buff_id = buff_id
 
-        options = [discord.SelectOption(label=t, value=t) for t in ["Research", "Training", "Building", "Combat", "PvP"]]
+        options = [discord.SelectOption(label=t, value=t) for t in titles]
         title_select = Select(placeholder="Select a new title for your buff...", options=options)
         title_select.callback = self.on_title_change
         self.add_item(title_select)
 
+    @timed("change_title.select")
     async def on_title_change(self, interaction: discord.Interaction):
         new_title = interaction.data['values'][0]
-        requests = load_data()
-
-        if self.buff_id not in requests:
+        await load_data()
+        rec = records.get(self.buff_id)
+        if rec is None:
             await interaction.response.edit_message(content="This buff seems to have been deleted or expired.", view=None)
             return
 
-        original_buff = requests[self.buff_id]
-        original_time_slot = original_buff['time_slot']
-
-        for req_id, req in requests.items():
-            if req_id != self.buff_id and req['time_slot'] == original_time_slot and req['title'] == new_title:
-                await interaction.response.edit_message(content=f"A **{new_title}** buff is already scheduled for this time slot.", view=None)
-                return
+        async with slot_lock(new_title, rec.slot):
+            # The web app moves its DB row and the shared-file entry together
+            status = await bridge.move(rec.title_name, rec.start.isoformat(), new_title, rec.start.isoformat()) if bridge else None
+            gone, taken = False, status == 409
+            if status is None:
+                # No bridge, the web app is down or rejected the call (logged), or the booking only lives in the shared file
+                async with data_lock:
+                    requests = await load_data()
+                    gone = self.buff_id not in requests
+                    taken = not gone and is_slot_taken(new_title, rec.slot, exclude_id=self.buff_id)
+                    if not gone and not taken:
+                        requests[self.buff_id]['title'] = new_title
+                        await save_data(requests)
+        if gone:
+            await interaction.response.edit_message(content="This buff seems to have been deleted or expired.", view=None)
+            return
+        if taken:
+            await interaction.response.edit_message(content=f"A **{new_title}** buff is already scheduled for this time slot.", view=None)
+            return
 
-        requests[self.buff_id]['title'] = new_title
-        save_data(requests)
-        logger.info(f"User {interaction.user} changed title for buff {self.buff_id} to {new_title}")
+        logger.info("User %s changed title for buff %s to %s", interaction.user, self.buff_id, new_title)
         await interaction.response.edit_message(content=f"Your buff's title has been changed to **{new_title}**.", view=None)
 
-class ChangeTimeView(View):
-    def __init__(self, buff_id: str, buff_date_str: str):
+class ChangeTimeView(TrackedView):
+    def __init__(self, buff_id: str, hours: list):
         super().__init__(timeout=180)
         self.buff_id = buff_id
-        
-        buff_date = date.fromisoformat(buff_date_str)
-        options = []
-        for i in range(24):
-            dt_obj = datetime.combine(buff_date, datetime.min.time(), tzinfo=timezone.utc) + timedelta(hours=i)
-            label = f"{dt_obj.strftime('%H:%M')} - {(dt_obj + timedelta(hours=1)).strftime('%H:%M')} UTC"
-            options.append(discord.SelectOption(label=label, value=dt_obj.isoformat()))
 
-        time_select = Select(placeholder="Select a new time slot...", options=options)
+        time_select = Select(placeholder="Select a new time slot...", options=time_slot_options(hours))
         time_select.callback = self.on_time_change
         self.add_item(time_select)
 
+    @timed("change_time.select")
     async def on_time_change(self, interaction: discord.Interaction):
         new_time_slot = interaction.data['values'][0]
-        requests = load_data()
-
-        if self.buff_id not in requests:
+        new_slot = parse_slot(new_time_slot)
+        await load_data()
+        rec = records.get(self.buff_id)
+        if rec is None:
             await interaction.response.edit_message(content="This buff seems to have been deleted or expired.", view=None)
             return
 
-        original_title = requests[self.buff_id]['title']
-
-        for req_id, req in requests.items():
-            if req_id != self.buff_id and req['time_slot'] == new_time_slot and req['title'] == original_title:
-                await interaction.response.edit_message(content=f"A **{original_title}** buff is already scheduled for this new time.", view=None)
-                return
+        original_title = rec.title_name
+        async with slot_lock(original_title, new_slot):
+            # The web app moves its DB row and the shared-file entry together
+            status = await bridge.move(original_title, rec.start.isoformat(), original_title, new_time_slot) if bridge else None
+            gone, taken = False, status == 409
+            if status is None:
+                # No bridge, the web app is down or rejected the call (logged), or the booking only lives in the shared file
+                async with data_lock:
+                    requests = await load_data()
+                    gone = self.buff_id not in requests
+                    taken = not gone and is_slot_taken(original_title, new_slot, exclude_id=self.buff_id)
+                    if not gone and not taken:
+                        requests[self.buff_id]['time_slot'] = new_time_slot
+                        await save_data(requests)
+        if gone:
+            await interaction.response.edit_message(content="This buff seems to have been deleted or expired.", view=None)
+            return
+        if taken:
+            await interaction.response.edit_message(content=f"A **{original_title}** buff is already scheduled for this new time.", view=None)
+            return
 
-        requests[self.buff_id]['time_slot'] = new_time_slot
-        save_data(requests)
-        logger.info(f"User {interaction.user} changed time for buff {self.buff_id} to {new_time_slot}")
+        logger.info("User %s changed time for buff %s to %s", interaction.user, self.buff_id, new_time_slot)
         new_time_obj = datetime.fromisoformat(new_time_slot)
         await interaction.response.edit_message(content=f"Your buff's time has been changed to **{new_time_obj.strftime('%Y-%m-%d %H:%M')} UTC**.", view=None)
 
+# /viewbuffs pages through one message. The records are sorted by slot once per command; a page
+# renders only its own PAGE_SIZE fields, and the date filter is a bisect on that slot order.
+PAGE_SIZE = 10 # buffs per page; an embed holds at most 25 fields
+
+class BuffListView(TrackedView):
+    def __init__(self, owner_id: int, recs: list):
+        super().__init__(timeout=300)
+        self.owner_id = owner_id
+        self.recs = recs # upcoming BuffRecords, oldest slot first
+        self.slots = [rec.slot for rec in recs]
+        self.matches = recs
+        self.filters = {"title": None, "region": None, "day": None}
+        self.page = 0
+        self.message = None
+
+        titles = sorted({rec.title for rec in recs})
+        regions = sorted({rec.region for rec in recs})
+        days = sorted({rec.start.date() for rec in recs})[:24]
+        self.title_select = self._filter_select("title", "Filter by title...", "All titles", [(TITLES.name(c), str(c)) for c in titles[:24]])
+        self.region_select = self._filter_select("region", "Filter by region...", "All regions", [(REGIONS.name(c), str(c)) for c in regions[:24]])
+        self.day_select = self._filter_select("day", "Filter by date...", "All dates", [(d.strftime('%A, %B %d'), d.isoformat()) for d in days])
+
+        self.prev_button = Button(label="Prev", style=discord.ButtonStyle.secondary, row=3)
+        self.prev_button.callback = self.on_prev
+        self.add_item(self.prev_button)
+        self.next_button = Button(label="Next", style=discord.ButtonStyle.secondary, row=3)
+        self.next_button.callback = self.on_next
+        self.add_item(self.next_button)
+
+    def _filter_select(self, key: str, placeholder: str, all_label: str, choices: list):
+        options = [discord.SelectOption(label=all_label, value="")] + [discord.SelectOption(label=label, value=value) for label, value in choices]
+        select = Select(placeholder=placeholder, options=options, row=len(self.children))
+
+        @timed("viewbuffs.filter")
+        async def callback(interaction: discord.Interaction):
+            value = select.values[0]
+            for option in select.options:
+                option.default = bool(value) and option.value == value
+            self.filters[key] = (date.fromisoformat(value) if key == "day" else int(value)) if value else None
+            self.apply_filters()
+            await interaction.response.edit_message(embed=self.render(), view=self)
+
+        select.callback = callback
+        self.add_item(select)
+        return select
+
+    def apply_filters(self):
+        recs = self.recs
+        day = self.filters["day"]
+        if day is not None:
+            first = slot_of(datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc))
+            recs = recs[bisect.bisect_left(self.slots, first):bisect.bisect_left(self.slots, first + 24)]
+        title, region = self.filters["title"], self.filters["region"]
+        if title is not None or region is not None:
+            recs = [rec for rec in recs if (title is None or rec.title == title) and (region is None or rec.region == region)]
+        self.matches = recs
+        self.page = 0
+
+    def render(self) -> discord.Embed:
+        pages = max(1, -(-len(self.matches) // PAGE_SIZE))
+        self.page = max(0, min(self.page, pages - 1))
+        embed = discord.Embed(title="Current Buff Requests", color=discord.Color.blue())
+        for rec in self.matches[self.page * PAGE_SIZE:(self.page + 1) * PAGE_SIZE]:
+            add_buff_field(embed, rec)
+        if not self.matches:
+            embed.description = "No buff requests match these filters."
+        embed.set_footer(text=f"Page {self.page + 1}/{pages} · {len(self.matches)} of {len(self.recs)} buffs")
+        self.prev_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= pages - 1
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id == self.owner_id:
+            return True
+        await interaction.response.send_message("Use /viewbuffs to page through your own copy of the list.", ephemeral=True)
+        return False
+
+    @timed("viewbuffs.page")
+    async def on_prev(self, interaction: discord.Interaction):
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @timed("viewbuffs.page")
+    async def on_next(self, interaction: discord.Interaction):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
 # --- Slash Commands ---
 @tree.command(name="requestbuff", description="Request a capital buff.")
+@timed("/requestbuff")
 async def requestbuff(interaction: discord.Interaction):
     view = ConfirmationView()
     await interaction.response.send_message("Did you apply for the buff at the IC?", view=view, ephemeral=True)
 
 @tree.command(name="viewbuffs", description="View all active buff requests.")
+@timed("/viewbuffs")
 async def viewbuffs(interaction: discord.Interaction):
     if not interaction.guild:
         await interaction.response.send_message("This command can only be used in a server channel.", ephemeral=True)
         return
         
-    buff_embeds = await create_buffs_embeds(interaction.guild)
-    if buff_embeds:
-        await interaction.response.send_message(embed=buff_embeds[0])
-        for embed in buff_embeds[1:]:
-            await interaction.followup.send(embed=embed)
-    else:
+    now = now_slot()
+    recs = sorted((rec for rec in await current_records() if rec.slot > now), key=lambda rec: rec.slot)
+    if not recs:
         await interaction.response.send_message("There are no active buff requests.", ephemeral=True)
+        return
+
+    view = BuffListView(interaction.user.id, recs)
+    await interaction.response.send_message(embed=view.render(), view=view)
+    view.message = await interaction.original_response()
 
 @tree.command(name="mybuffs", description="View and manage your active buff requests.")
+@timed("/mybuffs")
 async def mybuffs(interaction: discord.Interaction):
-    requests = load_data()
-    now_utc = datetime.now(timezone.utc)
+    await load_data()
+    now = now_slot()
     
-    user_buffs = {
-        req_id: req for req_id, req in requests.items()
-        if req.get('user_id') == interaction.user.id and datetime.fromisoformat(req['time_slot']) > now_utc
-    }
+    user_buffs = [
+        records[req_id] for req_id in user_index.get(interaction.user.id, ())
+        if records[req_id].slot > now
+    ]
     
     if not user_buffs:
         await interaction.response.send_message("You have no active, upcoming buff requests.", ephemeral=True)
@@ -459,59 +1068,73 @@ async def mybuffs(interaction: discord.Interaction):
 
 @tree.command(name="clearbuffs", description="[Admin] Manually clears all buff requests.")
 @app_commands.checks.has_permissions(manage_guild=True)
+@timed("/clearbuffs")
 async def clearbuffs(interaction: discord.Interaction):
-    save_data({})
+    await interaction.response.defer(ephemeral=True)
+    # The web app's bookings live in its DB too; clear them there or they come straight back in listings
+    web_cleared = await bridge.clear() if bridge else 0
+    async with data_lock:
+        await save_data({})
     sent_reminders.clear()
-    logger.info(f"Buffs cleared manually by {interaction.user.name} ({interaction.user.id}).")
-    await interaction.response.send_message("All buff requests have been cleared.", ephemeral=True)
+    logger.info("Buffs cleared manually by %s (%s).", interaction.user.name, interaction.user.id)
+    if web_cleared is None:
+        await interaction.followup.send("Buff requests in Discord were cleared, but the web app could not be reached or refused the request (see bot.log); its bookings were kept.", ephemeral=True)
+    else:
+        await interaction.followup.send("All buff requests have been cleared.", ephemeral=True)
 
 @clearbuffs.error
 async def on_clearbuffs_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
     if isinstance(error, app_commands.MissingPermissions):
         await interaction.response.send_message("You do not have permission.", ephemeral=True)
     else:
-        logger.error(f"Error in clearbuffs command: {error}")
-        await interaction.response.send_message("An error occurred.", ephemeral=True)
+        logger.error("Error in clearbuffs command: %s", error)
+        if interaction.response.is_done(): # the command defers before calling the web app
+            await interaction.followup.send("An error occurred.", ephemeral=True)
+        else:
+            await interaction.response.send_message("An error occurred.", ephemeral=True)
 
 # --- Background Tasks ---
+async def send_due_reminders(guild):
+    """Sends the 5-minute reminders that are due now (kept separate so loadtest.py can drive it under a fake clock)."""
+    await load_data()
+    now_ts = time.time()
+    
+    for req_id, rec in list(records.items()):
+        if req_id in sent_reminders:
+            continue
+
+        time_diff = rec.slot * 3600 - now_ts
+        
+        if 240 < time_diff <= 300:
+            logger.info("Time condition met for request %s. Preparing to send reminder.", req_id)
+            if not guild:
+                logger.warning("Reminder task could not find a guild.")
+                continue
+                
+            channel = guild.get_channel(LOG_CHANNEL_ID)
+            role = guild.get_role(PING_ROLE_ID)
+            user = guild.get_member(rec.user_id)
+            user_mention = user.mention if user else rec.user_name
+
+            if channel and role:
+                reminder_msg = f"{role.mention} Reminder: The **{rec.title_name}** buff in **{rec.region_name}** requested by **{user_mention} ({rec.user_name})** starts in 5 minutes!"
+                await channel.send(reminder_msg)
+                sent_reminders.add(req_id)
+                REMINDER_LATENESS.observe(max(0.0, time.time() - (rec.slot * 3600 - 300)))
+                logger.info("Successfully sent 5-minute reminder for request %s", req_id)
+            else:
+                if not channel: logger.warning("Could not send reminder for %s: Channel with ID %s not found.", req_id, LOG_CHANNEL_ID)
+                if not role: logger.warning("Could not send reminder for %s: Role with ID %s not found.", req_id, PING_ROLE_ID)
+
 async def reminder_task():
     await client.wait_until_ready()
     while not client.is_closed():
         try:
             logger.debug("Reminder task checking for upcoming buffs...")
-            requests = load_data()
-            now_utc = datetime.now(timezone.utc)
-            
-            for req_id, req in requests.items():
-                if req_id in sent_reminders:
-                    continue
-
-                start_time = datetime.fromisoformat(req['time_slot'])
-                time_diff = start_time - now_utc
-                
-                if timedelta(minutes=4) < time_diff <= timedelta(minutes=5):
-                    logger.info(f"Time condition met for request {req_id}. Preparing to send reminder.")
-                    guild = client.guilds[0]
-                    if not guild:
-                        logger.warning("Reminder task could not find a guild.")
-                        continue
-                        
-                    channel = guild.get_channel(LOG_CHANNEL_ID)
-                    role = guild.get_role(PING_ROLE_ID)
-                    user = guild.get_member(req['user_id'])
-                    user_mention = user.mention if user else req['user_name']
-
-                    if channel and role:
-                        reminder_msg = f"{role.mention} Reminder: The **{req['title']}** buff in **{req['region']}** requested by **{user_mention} ({req['user_name']})** starts in 5 minutes!"
-                        await channel.send(reminder_msg)
-                        sent_reminders.add(req_id)
-                        logger.info(f"Successfully sent 5-minute reminder for request {req_id}")
-                    else:
-                        if not channel: logger.warning(f"Could not send reminder for {req_id}: Channel with ID {LOG_CHANNEL_ID} not found.")
-                        if not role: logger.warning(f"Could not send reminder for {req_id}: Role with ID {PING_ROLE_ID} not found.")
-                
+            await cleanup_old_data()
+            await send_due_reminders(client.guilds[0] if client.guilds else None)
         except Exception as e:
-            logger.error(f"An unexpected error occurred in reminder_task: {e}", exc_info=True)
+            logger.error("An unexpected error occurred in reminder_task: %s", e, exc_info=True)
             
         await asyncio.sleep(60)
 
@@ -519,7 +1142,6 @@ async def schedule_task():
     await client.wait_until_ready()
     while not client.is_closed():
         try:
-            cleanup_old_data()
             guild = client.guilds[0]
             channel = guild.get_channel(LOG_CHANNEL_ID)
             if channel:
@@ -530,19 +1152,55 @@ async def schedule_task():
                         await channel.send(embed=embed)
                     logger.info("Posted scheduled buff list.")
         except Exception as e:
-            logger.error(f"Error in schedule_task: {e}", exc_info=True)
+            logger.error("Error in schedule_task: %s", e, exc_info=True)
             
         await asyncio.sleep(12 * 60 * 60)
 
+# --- Data File Watch ---
+data_watcher = None
+seen_request_ids = None # Request ids already known, so only new web bookings get announced
+
+async def on_data_file_changed():
+    """Reloads the data file right after another process (the web app) rewrites it and announces new web bookings."""
+    global seen_request_ids
+    await load_data()
+    if seen_request_ids is None:
+        seen_request_ids = set(records)
+        return
+    new_ids = [req_id for req_id in records if req_id not in seen_request_ids]
+    seen_request_ids.update(new_ids)
+    # Bot bookings carry the Discord user id and were already announced by finalize_request
+    web_ids = [req_id for req_id in new_ids if not records[req_id].user_id]
+    if not web_ids or not client.guilds:
+        return
+    channel = client.guilds[0].get_channel(LOG_CHANNEL_ID)
+    if not channel:
+        return
+    role = client.guilds[0].get_role(PING_ROLE_ID)
+    for req_id in web_ids:
+        rec = records[req_id]
+        start_time_obj = rec.start
+        embed = discord.Embed(title="New Capital Buff Request!", description=f"**{rec.user_name}** has requested the **{rec.title_name}** buff for **{start_time_obj.strftime('%Y-%m-%d')} at {start_time_obj.strftime('%H:%M')} UTC** in the **{rec.region_name}** region (via the web app).", color=discord.Color.green())
+        await channel.send(content=role.mention if role else None, embed=embed)
+        logger.info("Announced web buff request %s: %r", req_id, rec)
+
+async def start_data_watch():
+    global data_watcher, seen_request_ids
+    if data_watcher is not None or FileWatcher is None:
+        return
+    await load_data()
+    seen_request_ids = set(records)
+    data_watcher = FileWatcher(DATA_FILE)
+    data_watcher.subscribe(on_data_file_changed)
+    data_watcher.start()
+    logger.info("Watching %s for changes (%s).", DATA_FILE, data_watcher.mode)
+
 # --- Bot Events ---
 @client.event
 async def on_ready():
-    await tree.sync()
-    logger.info(f'Logged in as {client.user}!')
+    # Also fires after reconnects; background tasks and command sync live in BuffBot.setup_hook
+    logger.info('Logged in as %s!', client.user)
     print(f'Logged in as {client.user}!')
-    
-    client.loop.create_task(reminder_task())
-    client.loop.create_task(schedule_task())
 
 if __name__ == "__main__":
-    client.run(DISCORD_TOKEN)
\ No newline at end of file
+    client.run(DISCORD_TOKEN, log_handler=None) # keep discord.py on our queued root handler instead of its own stderr one
\ No newline at end of file
@@ -3,16 +3,19 @@ from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from itsdangerous import URLSafeSerializer
 from starlette.responses import RedirectResponse
 from sqlalchemy.orm import Session
-from passlib.hash import argon2
+import hmac
 from .db import get_db
 from .models import User, Role
 from .settings import settings
+from .services import logs
 
-# Argon2id via passlib (argon2-cffi under the hood)
+# Argon2id via passlib (argon2-cffi under the hood); imported on first use, only login/register need it
 def hash_password(pw: str) -> str:
+    from passlib.hash import argon2
     return argon2.using(type="ID").hash(pw)
 
 def verify_password(pw: str, hashed: str) -> bool:
+    from passlib.hash import argon2
     try:
         return argon2.verify(pw, hashed)
     except Exception:
@@ -31,10 +34,22 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> User |
         if not name:
             return None
         user = db.query(User).filter(User.aoe_name == name).first()
+        request.state.role = user.role if user else None  # lets middleware (Server-Timing) see who is asking; the User is detached by then
+        logs.bind(user=name)
         return user
     except Exception:
         return None
 
+def ical_token(aoe_name: str) -> str:
+    """Signed, URL-safe token for a user's personal iCal feed (calendar apps cannot send cookies)."""
+    return ser.dumps(aoe_name, salt="s77-ical")
+
+def ical_token_user(token: str) -> str | None:
+    try:
+        return ser.loads(token, salt="s77-ical")
+    except Exception:
+        return None
+
 def require_login(user: User | None):
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
@@ -42,3 +57,25 @@ def require_login(user: User | None):
 def require_admin(user: User | None):
     if not user or user.role != Role.admin:
         raise HTTPException(status_code=403, detail="Admin required")
+
+BRIDGE_HEADER = "X-S77-Bridge-Token"
+
+def is_local_request(request: Request, allowed_hosts: str) -> bool:
+    """True for direct callers from `allowed_hosts` (comma separated), BIND_HOST or a Unix socket; never via the reverse proxy."""
+    if request.headers.get("x-forwarded-for"):
+        return False
+    # request.client is None when uvicorn serves a Unix socket (--uds)
+    if request.client is None:
+        return True
+    allowed = {h.strip() for h in allowed_hosts.split(",") if h.strip()} | {settings.BIND_HOST}
+    return request.client.host in allowed
+
+def require_bridge(request: Request):
+    """Guard for the bot bridge API: shared token, local callers only."""
+    if not settings.BRIDGE_TOKEN:
+        raise HTTPException(status_code=404)
+    if not is_local_request(request, settings.BRIDGE_ALLOWED_HOSTS):
+        raise HTTPException(status_code=403, detail="Bridge is local only")
+    token = request.headers.get(BRIDGE_HEADER, "")
+    if not hmac.compare_digest(token, settings.BRIDGE_TOKEN):
+        raise HTTPException(status_code=401, detail="Bad bridge token")
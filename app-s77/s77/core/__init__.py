@@ -0,0 +1,2 @@
+# Shared buff model for the Discord bot and the web app (stdlib only)
+from .records import TITLES, REGIONS, Codes, BuffRecord, slot_of, parse_slot, slot_start, slot_iso, now_slot
@@ -0,0 +1,101 @@
+"""Compact buff records shared by the bot and the web app.
+
+A slot is the integer number of hours since the Unix epoch (UTC), so comparing or
+indexing slots is int work instead of parsing ISO strings. Titles and regions are
+stored as small interned codes. Legacy JSON (ISO "time_slot", title/region names)
+is only touched at the edges via BuffRecord.from_legacy / to_legacy.
+"""
+import time
+from datetime import datetime, timezone
+
+class Codes:
+    """Bidirectional name <-> small int table. Unknown names (old data) are interned on first sight."""
+    __slots__ = ("names", "index")
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.index = {n: i for i, n in enumerate(self.names)}
+
+    def code(self, name: str) -> int:
+        c = self.index.get(name)
+        if c is None:
+            c = self.index[name] = len(self.names)
+            self.names.append(name)
+        return c
+
+    def lookup(self, name: str):
+        """Code for `name` without interning it (for untrusted query input); None if unknown."""
+        return self.index.get(name)
+
+    def name(self, code: int) -> str:
+        return self.names[code]
+
+TITLES = Codes(["Research", "Training", "Building", "Combat", "PvP"])
+REGIONS = Codes(["Imperial City", "Gaul", "Olympia", "Neilos", "Tinir", "East Kingsland", "Eastland", "Kyuno", "North Kingsland", "West Kingsland", "NA"])
+
+def slot_of(dt: datetime) -> int:
+    """Epoch hour of `dt`; naive values (old bot data) are UTC."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()) // 3600
+
+def parse_slot(iso: str) -> int:
+    return slot_of(datetime.fromisoformat(iso))
+
+def slot_start(slot: int) -> datetime:
+    return datetime.fromtimestamp(slot * 3600, tz=timezone.utc)
+
+def slot_iso(slot: int) -> str:
+    return slot_start(slot).isoformat()
+
+def now_slot() -> float:
+    """Current time in (fractional) epoch hours, for comparing against int slots."""
+    return time.time() / 3600
+
+class BuffRecord:
+    __slots__ = ("id", "slot", "title", "region", "user_id", "user_name", "request_time")
+
+    def __init__(self, id: str, slot: int, title: int, region: int, user_id: int = 0, user_name: str = "", request_time: str = ""):
+        self.id = id
+        self.slot = slot
+        self.title = title
+        self.region = region
+        self.user_id = user_id
+        self.user_name = user_name
+        self.request_time = request_time
+
+    @classmethod
+    def from_legacy(cls, req_id: str, d: dict) -> "BuffRecord":
+        """Build from a legacy JSON entry; raises KeyError/ValueError on malformed data."""
+        return cls(req_id, parse_slot(d["time_slot"]), TITLES.code(d["title"]), REGIONS.code(d.get("region", "NA")),
+                   d.get("user_id") or 0, d.get("user_name", ""), d.get("request_time", ""))
+
+    def to_legacy(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "user_name": self.user_name,
+            "title": TITLES.name(self.title),
+            "time_slot": slot_iso(self.slot),
+            "region": REGIONS.name(self.region),
+            "request_time": self.request_time,
+        }
+
+    @property
+    def key(self) -> tuple:
+        """(title code, slot): the uniqueness key for bookings."""
+        return (self.title, self.slot)
+
+    @property
+    def title_name(self) -> str:
+        return TITLES.name(self.title)
+
+    @property
+    def region_name(self) -> str:
+        return REGIONS.name(self.region)
+
+    @property
+    def start(self) -> datetime:
+        return slot_start(self.slot)
+
+    def __repr__(self):
+        return f"BuffRecord({self.id!r}, {slot_iso(self.slot)}, {self.title_name}, {self.region_name}, {self.user_name!r})"
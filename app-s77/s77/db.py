@@ -1,14 +1,59 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base, scoped_session
 from .settings import settings
 
-engine = create_engine(settings.DB_URL, pool_pre_ping=True, echo=False, future=True)
+def _sqlite_pragmas(dbapi_conn, _record):
+    # dev path: WAL lets readers run alongside the writer; NORMAL sync is safe with WAL and far fewer fsyncs
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cur.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cur.close()
+
+def make_engine(url: str):
+    if url.startswith("sqlite"):
+        eng = create_engine(url, echo=False, future=True)
+        event.listen(eng, "connect", _sqlite_pragmas)
+        return eng
+    return create_engine(
+        url,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        echo=False, future=True,
+    )
+
+engine = make_engine(settings.DB_URL)
 SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
 Base = declarative_base()
 
+# Read-only GETs (listings, iCal) can go to a replica; without DB_REPLICA_URL they share the primary
+read_engine = make_engine(settings.DB_REPLICA_URL) if settings.DB_REPLICA_URL else engine
+ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False)
+
+def _after_fork():
+    # gunicorn --preload imports the app (and opens connections) before forking workers;
+    # a child must not reuse the parent's sockets, so it starts with empty pools
+    engine.dispose(close=False)
+    if read_engine is not engine:
+        read_engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_after_fork)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
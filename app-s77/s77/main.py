@@ -1,28 +1,24 @@
-from fastapi import FastAPI, Request, Depends, Form, Response, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi import FastAPI, Request, Depends, Form, Response, HTTPException, Query
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from datetime import datetime, timezone, timedelta
-import logging, os
+import asyncio, ipaddress, logging, os, uuid
 
 from .settings import settings
-from .db import Base, engine, get_db
+from .db import Base, engine, read_engine, get_db, get_read_db
 from .models import User, Role, AuditLog, Buff
-from .auth import hash_password, verify_password, get_current_user, AUTH_COOKIE, ser
+from .auth import hash_password, verify_password, get_current_user, AUTH_COOKIE, ser, ical_token, ical_token_user
 from .i18n import load_lang, pick_lang, SUPPORTED
-from .services import audit, ical
-from .services.buffs import VALID_TITLES, VALID_REGIONS, create_buff, normalized_hour, check_conflict
-from .services.discord_sync import list_upcoming_two_days
+from .services import audit, broadcast, events, ical, ratelimit
+from .services.buffs import VALID_TITLES, VALID_REGIONS, create_buff, normalized_hour, check_conflict, list_merged
+from .services.discord_sync import start_watching
+from .services.logs import setup_logging, new_context, end_context
 
-# logging
-try:
-    logging.basicConfig(filename=settings.LOG_FILE, level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
-except PermissionError:
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
-    logging.getLogger().warning("LOG_FILE not writable, using stdout")
-
-app = FastAPI(title=settings.APP_NAME)
+# JSON endpoints serialize with orjson; HTML routes declare HTMLResponse themselves
+app = FastAPI(title=settings.APP_NAME, default_response_class=ORJSONResponse)
 app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
 
 from sqlalchemy import text
@@ -35,28 +31,107 @@ def _ensure_user_schema(db):
         pass
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
 
-# DB init
-Base.metadata.create_all(bind=engine)
+def _parse_proxies(raw: str) -> list:
+    nets = []
+    for item in (p.strip() for p in raw.split(",")):
+        if item == "unix":
+            nets.append(item)
+        elif item:
+            nets.append(ipaddress.ip_network(item, strict=False))
+    return nets
 
-def ip_of(request: Request) -> str | None:
-    return request.headers.get("x-forwarded-for") or request.client.host
+_TRUSTED_PROXIES = _parse_proxies(settings.TRUSTED_PROXIES)
+
+def _is_trusted_proxy(host: str) -> bool:
+    if host == "unix":
+        return "unix" in _TRUSTED_PROXIES
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(net != "unix" and addr in net for net in _TRUSTED_PROXIES)
+
+def ip_of(request: Request) -> str:
+    """Client IP for rate limits and the audit log.
+
+    X-Forwarded-For is only believed when the peer is a trusted proxy; then the right-most hop that is
+    not itself a trusted proxy is the client (everything left of it is whatever the client sent).
+    """
+    peer = request.client.host if request.client else "unix"  # request.client is None over a Unix socket (--uds)
+    if not _is_trusted_proxy(peer):
+        return peer
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return peer
+
+def wants_fragment(request: Request) -> bool:
+    # static/js/fragments.js sets this; plain form posts still get the 303 and a full page
+    return request.headers.get("x-requested-with") == "fetch"
+
+def fragment(request: Request, name: str, status_code: int = 200, **context) -> HTMLResponse:
+    return templates.TemplateResponse(name, {"request": request, "t": _load_t(request), **context}, status_code=status_code)
 
 def set_lang_cookie(resp: Response, lang: str):
     resp.set_cookie("lang", lang, httponly=False, samesite="Lax", max_age=3600*24*365)
 
+# Logging and DB setup run at startup, not import, so importing s77.main stays cheap and touches no files
+@app.on_event("startup")
+async def _init_app():
+    # logging: request threads only enqueue records, a listener thread writes LOG_FILE
+    setup_logging(settings.LOG_FILE, json_lines=settings.LOG_JSON)
+    await asyncio.to_thread(_init_db)
+
+def _init_db():
+    with broadcast.exclusive("schema"):  # workers starting together would race on CREATE TABLE
+        Base.metadata.create_all(bind=engine)
+        # create_all skips tables that already exist; the reminder dispatcher's range query needs this index
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_buffs_start_utc ON buffs (start_utc)"))
+
+@app.on_event("startup")
+async def _watch_shared_json():
+    # bot writes to SHARED_JSON invalidate the discord_sync cache within a second
+    try:
+        start_watching()
+    except OSError:
+        logging.getLogger().warning("Could not watch %s; falling back to per-read stat checks", settings.SHARED_JSON)
+    # other workers' writes reach this worker's caches immediately (no-op with a single worker)
+    broadcast.start()
+
+@app.on_event("shutdown")
+async def _leave_broadcast():
+    broadcast.stop()
+
 @app.middleware("http")
 async def utc_mw(request: Request, call_next):
     request.state.now_utc = datetime.now(timezone.utc)
     return await call_next(request)
 
+@app.middleware("http")
+async def log_context_mw(request: Request, call_next):
+    # log records from this request (including its threadpool work) carry these fields; auth adds the user
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:12]
+    token = new_context(request_id=request_id, method=request.method, path=request.url.path)
+    try:
+        response = await call_next(request)
+    finally:
+        end_context(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request, db: Session = Depends(get_db), user: User | None = Depends(get_current_user)):
     if not user:
         return RedirectResponse("/login", status_code=302)
     lang = load_lang(pick_lang(request))
+    now = request.state.now_utc
     return templates.TemplateResponse("home.html", {
         "request": request, "t": _load_t(request), "user": user, "is_admin": user.role==Role.admin,
-        "titles": VALID_TITLES, "regions": VALID_REGIONS
+        "titles": VALID_TITLES, "regions": VALID_REGIONS, "ical_url": f"/ical/feed/{ical_token(user.aoe_name)}.ics",
+        "events": events.upcoming_events(db, user.alliance, now), "polls": events.open_polls(db, user.alliance, user.aoe_name, now),
+        "event_kinds": events.EVENT_KINDS, "legions": events.LEGIONS
     })
 
 @app.get("/login", response_class=HTMLResponse)
@@ -66,6 +141,7 @@ def login_page(request: Request):
 
 @app.post("/login")
 def login(request: Request, aoe_name: str = Form(...), password: str = Form(...), lang: str = Form("en"), db: Session = Depends(get_db)):
+    ratelimit.hit("login", ip_of(request), aoe_name.strip())  # before the Argon2 verify
     user = db.query(User).filter(User.aoe_name == aoe_name.strip()).first()
     if not user or not verify_password(password, user.password_hash):
         resp = RedirectResponse("/login?e=1", status_code=303); set_lang_cookie(resp, lang); return resp
@@ -96,6 +172,7 @@ def register(request: Request,
              alliance: str = Form(""),
              lang: str = Form("en"),
              db: Session = Depends(get_db)):
+    ratelimit.hit("register", ip_of(request))
     aoe_name = aoe_name.strip()
     if not aoe_name or not password:
         return RedirectResponse("/register?e=1", status_code=303)
@@ -113,7 +190,7 @@ def register(request: Request,
     return resp
 
 @app.get("/admin", response_class=HTMLResponse)
-def admin_panel(request: Request, db: Session = Depends(get_db), user: User | None = Depends(get_current_user)):
+def admin_panel(request: Request, db: Session = Depends(get_read_db), user: User | None = Depends(get_current_user)):
     if not user or user.role != Role.admin:
         return RedirectResponse("/", status_code=302)
     lang = load_lang(pick_lang(request))
@@ -129,6 +206,8 @@ def admin_approve(request: Request, id: int = Form(...), db: Session = Depends(g
     if target and not target.is_approved:
         target.is_approved = True; db.commit()
         audit.log(db, "approve_user", ip_of(request), actor=user.aoe_name, details=target.aoe_name)
+    if wants_fragment(request):
+        return _user_row(request, target)
     return RedirectResponse("/admin", status_code=303)
 
 @app.post("/admin/disable")
@@ -138,19 +217,49 @@ def admin_disable(request: Request, id: int = Form(...), db: Session = Depends(g
     if target:
         target.is_approved = False; db.commit()
         audit.log(db, "disable_user", ip_of(request), actor=user.aoe_name, details=target.aoe_name)
+    if wants_fragment(request):
+        return _user_row(request, target)
     return RedirectResponse("/admin", status_code=303)
 
 @app.get("/ical/two-days.ics")
-def ical_feed(db: Session = Depends(get_db)):
+def ical_feed():
     now = datetime.now(timezone.utc); end = now + timedelta(days=2)
-    buffs = db.query(Buff).filter(Buff.start_utc >= now, Buff.start_utc < end).order_by(Buff.start_utc.asc()).all()
-    events = [{"title": b.title, "region": b.region, "aoe_name": b.aoe_name, "start_utc": b.start_utc} for b in buffs]
-    body = ical.generate_ics(events)
-    return StreamingResponse(iter([body]), media_type="text/calendar")
+    return StreamingResponse(ical.iter_ics(ical.feed_rows(now, end)), media_type="text/calendar")
+
+@app.get("/ical/feed/{token}.ics")
+def ical_personal_feed(token: str, title: list[str] = Query([]), region: list[str] = Query([]), mine: bool = False,
+                       days: int = settings.ICAL_DEFAULT_DAYS, past_days: int = 0, db: Session = Depends(get_read_db)):
+    # e.g. /ical/feed/<token>.ics?title=Research&title=Combat&region=Gaul&mine=1&days=90
+    name = ical_token_user(token)
+    owner = db.query(User).filter(User.aoe_name == name).first() if name else None
+    if not owner or not owner.is_approved:
+        raise HTTPException(status_code=404)
+    if any(t not in VALID_TITLES for t in title) or any(r not in VALID_REGIONS for r in region):
+        raise HTTPException(status_code=400, detail="bad filter")
+    days = max(1, min(days, settings.ICAL_MAX_DAYS))
+    past_days = max(0, min(past_days, settings.ICAL_MAX_DAYS))
+    now = normalized_hour(datetime.now(timezone.utc))
+    rows = ical.feed_rows(now - timedelta(days=past_days), now + timedelta(days=days), title, region, owner=name if mine else None)
+    return StreamingResponse(ical.iter_ics(rows), media_type="text/calendar")
 
 # ---------- Buff APIs ----------
-@app.get("/api/conflict")
-def api_conflict(title: str, start_iso: str, db: Session = Depends(get_db)):
+class BuffItem(BaseModel):
+    id: str           # "db:<id>" or "discord:<request time>"
+    aoe_name: str
+    title: str
+    region: str
+    start_iso: str
+    source: str
+
+class BuffList(BaseModel):
+    items: list[BuffItem]
+
+class ConflictOut(BaseModel):
+    conflict: bool
+
+@app.get("/api/conflict", response_model=ConflictOut)
+def api_conflict(request: Request, title: str, start_iso: str, db: Session = Depends(get_db)):
+    ratelimit.hit("conflict", ip_of(request))
     try:
         when = datetime.fromisoformat(start_iso)
         if when.tzinfo is None:
@@ -160,17 +269,14 @@ def api_conflict(title: str, start_iso: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Bad start_iso")
     return {"conflict": check_conflict(db, title, when)}
 
-@app.get("/api/list-two-days")
-def api_list_two_days(request: Request, db: Session = Depends(get_db)):
+@app.get("/api/list-two-days", response_model=BuffList)
+def api_list_two_days(request: Request, db: Session = Depends(get_read_db)):
     now = datetime.now(timezone.utc); end = now + timedelta(days=2)
-    db_items = db.query(Buff).filter(Buff.start_utc >= now, Buff.start_utc < end).order_by(Buff.start_utc.asc()).all()
-    db_json = [{"id": f"db:{b.id}", "aoe_name": b.aoe_name, "title": b.title, "region": b.region, "start_iso": b.start_utc.isoformat(), "source": b.source} for b in db_items]
-    disc = list_upcoming_two_days(now)
-    disc_json = [{"id": d["id"], "aoe_name": d["aoe_name"], "title": d["title"], "region": d["region"], "start_iso": d["start_utc"].isoformat(), "source": "discord"} for d in disc]
-    seen = set((x["title"], x["start_iso"]) for x in db_json)
-    merged = db_json + [d for d in disc_json if (d["title"], d["start_iso"]) not in seen]
-    merged.sort(key=lambda x: x["start_iso"])
-    return {"items": merged}
+    return {"items": list_merged(db, now, end)}
+
+def _buff_item(buff_id: int, aoe_name: str, title: str, region: str, start: datetime, source: str = "web") -> dict:
+    # the same shape as one /api/list-two-days item, so the page can slot it into its list
+    return {"id": f"db:{buff_id}", "aoe_name": aoe_name, "title": title, "region": region, "start_iso": start.isoformat(), "source": source}
 
 @app.post("/buffs/create")
 def buffs_create(request: Request, title: str = Form(...), region: str = Form(...), date: str = Form(...), hour_utc: str = Form(...),
@@ -183,10 +289,13 @@ def buffs_create(request: Request, title: str = Form(...), region: str = Form(..
     except Exception:
         raise HTTPException(status_code=400, detail="bad date/hour")
     try:
-        create_buff(db, user.aoe_name, title, region, start, source="web")
-        audit.log(db, "buff_create", ip_of(request), actor=user.aoe_name, details=f"{title} {region} {start}")
+        buff_id = create_buff(db, user.aoe_name, title, region, start, source="web", audit_action="buff_create", ip=ip_of(request))
     except ValueError:
+        if wants_fragment(request):
+            return ORJSONResponse({"conflict": True}, status_code=409)
         return RedirectResponse("/?conflict=1", status_code=303)
+    if wants_fragment(request):
+        return ORJSONResponse(_buff_item(buff_id, user.aoe_name, title, region, start), status_code=201)
     return RedirectResponse("/", status_code=303)
 
 @app.get("/buffs/edit/{buff_id}", response_class=HTMLResponse)
@@ -214,15 +323,20 @@ def buff_update(buff_id: int, request: Request, title: str = Form(...), region:
     except Exception:
         raise HTTPException(status_code=400)
     if (b.title != title or b.start_utc != new_start) and check_conflict(db, title, new_start):
+        if wants_fragment(request):
+            return ORJSONResponse({"conflict": True}, status_code=409)
         return RedirectResponse(f"/buffs/edit/{buff_id}?conflict=1", status_code=303)
     b.title, b.region, b.start_utc = title, region, new_start
     db.commit()
     audit.log(db, "buff_edit", ip_of(request), actor=user.aoe_name, details=f"id={buff_id}")
+    if wants_fragment(request):
+        return _buff_item(buff_id, user.aoe_name, title, region, new_start, b.source)
     return RedirectResponse("/", status_code=303)
 
 def run():
     import uvicorn
-    uvicorn.run("s77.main:app", host=settings.BIND_HOST, port=settings.BIND_PORT, reload=False)
+    # multiple workers re-import the app in each process; deploy/systemd/s77-app.service uses gunicorn --preload instead
+    uvicorn.run("s77.main:app", host=settings.BIND_HOST, port=settings.BIND_PORT, reload=False, workers=settings.WORKERS)
 
 if __name__ == "__main__":
     run()
@@ -246,6 +360,8 @@ def admin_change_role(request: Request, id: int = Form(...), role: str = Form(..
         target.is_approved = True
     db.commit()
     audit.log(db, "change_role", ip_of(request), actor=user.aoe_name, details=f"{target.aoe_name}->{role}")
+    if wants_fragment(request):
+        return _user_row(request, target)
     return RedirectResponse("/admin", status_code=303)
 
 @app.post("/admin/buffs/delete")
@@ -267,6 +383,8 @@ def admin_delete_buff(request: Request,
         if b:
             db.delete(b); db.commit()
             audit.log(db, "buff_delete_db", ip_of(request), actor=user.aoe_name, details=f"id={bid}")
+        if wants_fragment(request):
+            return {"deleted": b is not None}
         return RedirectResponse("/", status_code=303)
     elif src == "discord":
         if not (title and start_iso):
@@ -279,6 +397,8 @@ def admin_delete_buff(request: Request,
             raise HTTPException(status_code=400)
         ok = discord_delete(title, when)
         audit.log(db, "buff_delete_discord", ip_of(request), actor=user.aoe_name, details=f"{title} {start_iso} ok={ok}")
+        if wants_fragment(request):
+            return {"deleted": bool(ok)}
         return RedirectResponse("/", status_code=303)
     else:
         raise HTTPException(status_code=400)
@@ -294,13 +414,100 @@ def admin_clear_buffs(request: Request, db: Session = Depends(get_db), user: Use
     db.commit()
     discord_clear()
     audit.log(db, "buff_clear_all", ip_of(request), actor=user.aoe_name, details=f"db_deleted={deleted}, json_cleared=1")
+    if wants_fragment(request):
+        return {"db_deleted": deleted}
     return RedirectResponse("/", status_code=303)
 
-# --- IP masking filter for templates ---
-import ipaddress
+# ===== Bot bridge API (local only, shared token) =====
+from datetime import date as _date
+from .auth import require_bridge
+from .services.buffs import free_hours, move_buff
+
+class BridgeBuffIn(BaseModel):
+    aoe_name: str
+    title: str
+    region: str
+    start_iso: str
+    discord_user_id: int = 0
+
+class BridgeBuffMove(BaseModel):
+    title: str
+    start_iso: str
+    new_title: str
+    new_start_iso: str
+
+def _parse_start(start_iso: str) -> datetime:
+    try:
+        when = datetime.fromisoformat(start_iso)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Bad start_iso")
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return normalized_hour(when)
+
+@app.get("/bridge/buffs", response_model=BuffList, dependencies=[Depends(require_bridge)])
+def bridge_list(days: int = 2, db: Session = Depends(get_db)):
+    now = datetime.now(timezone.utc); end = now + timedelta(days=max(1, min(days, 14)))
+    return {"items": list_merged(db, now, end)}
+
+@app.get("/bridge/availability", dependencies=[Depends(require_bridge)])
+def bridge_availability(title: str, date: str, db: Session = Depends(get_db)):
+    if title not in VALID_TITLES:
+        raise HTTPException(status_code=400, detail="bad title")
+    try:
+        day = _date.fromisoformat(date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bad date")
+    return {"title": title, "date": day.isoformat(), "free_hours": free_hours(db, title, day, datetime.now(timezone.utc))}
+
+@app.post("/bridge/buffs", status_code=201, dependencies=[Depends(require_bridge)])
+def bridge_create(payload: BridgeBuffIn, db: Session = Depends(get_db)):
+    start = _parse_start(payload.start_iso)
+    name = payload.aoe_name.strip()[:80]
+    if not name:
+        raise HTTPException(status_code=400, detail="bad aoe_name")
+    try:
+        buff_id = create_buff(db, name, payload.title, payload.region, start, source="discord",
+                              discord_user_id=payload.discord_user_id, audit_action="buff_create_bridge")
+    except ValueError as e:
+        raise HTTPException(status_code=409 if str(e) == "Conflict" else 400, detail=str(e))
+    return {"id": f"db:{buff_id}", "start_iso": start.isoformat()}
+
+@app.delete("/bridge/buffs", dependencies=[Depends(require_bridge)])
+def bridge_delete(title: str, start_iso: str, db: Session = Depends(get_db)):
+    when = _parse_start(start_iso)
+    deleted = db.query(Buff).filter(Buff.title == title, Buff.start_utc == when).delete(synchronize_session=False)
+    db.commit()
+    json_deleted = discord_delete(title, when)
+    if deleted or json_deleted:
+        audit.log(db, "buff_delete_bridge", None, actor="discord-bot", details=f"{title} {when.isoformat()} db={deleted} json={json_deleted}")
+    return {"deleted": bool(deleted or json_deleted)}
+
+@app.patch("/bridge/buffs", dependencies=[Depends(require_bridge)])
+def bridge_move(payload: BridgeBuffMove, db: Session = Depends(get_db)):
+    # /mybuffs title and time changes; 404 means the booking only lives in the shared JSON
+    try:
+        moved = move_buff(db, payload.title, _parse_start(payload.start_iso), payload.new_title, _parse_start(payload.new_start_iso),
+                          audit_action="buff_move_bridge", actor="discord-bot")
+    except ValueError as e:
+        raise HTTPException(status_code=409 if str(e) == "Conflict" else 400, detail=str(e))
+    if not moved:
+        raise HTTPException(status_code=404)
+    return {"moved": True}
+
+@app.post("/bridge/clear", dependencies=[Depends(require_bridge)])
+def bridge_clear(db: Session = Depends(get_db)):
+    # /clearbuffs: every upcoming booking in the DB and the shared JSON; past rows stay for history
+    deleted = db.query(Buff).filter(Buff.start_utc >= datetime.now(timezone.utc)).delete(synchronize_session=False)
+    db.commit()
+    discord_clear()
+    audit.log(db, "buff_clear_bridge", None, actor="discord-bot", details=f"db_deleted={deleted}, json_cleared=1")
+    return {"db_deleted": deleted}
 
+# --- IP masking filter for templates ---
 def mask_ip(value: str | None) -> str:
     """Hide last two octets (IPv4) or last two hextets (IPv6)."""
+    import ipaddress
     if not value:
         return "-"
     # If X-Forwarded-For contains multiple IPs, take the first
@@ -351,8 +558,56 @@ def admin_force_reset(
     target.must_change_password = True
     db.commit()
     audit.log(db, "force_password_reset", ip_of(request), actor=user.aoe_name, details=f"{target.aoe_name}")
+    if wants_fragment(request):
+        return _user_row(request, target)
     return RedirectResponse("/admin", status_code=303)
 
+# --- Batch admin actions: one UPDATE and one multi-row audit insert for a list of users ---
+from .services import users as user_batch
+
+@app.post("/admin/users/batch")
+def admin_users_batch(
+    request: Request,
+    action: str = Form(...),
+    ids: list[int] = Form([]),
+    db: Session = Depends(get_db),
+    user: User | None = Depends(get_current_user),
+):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    if action == "force_reset":
+        _ensure_user_schema(db)
+    try:
+        changed = user_batch.batch_update(db, action, ids, actor=user.aoe_name, ip=ip_of(request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Whole rendered rows, so the per-row buttons match the new role/approval state
+    row = templates.get_template("_user_row.html")
+    t = _load_t(request)
+    targets = db.query(User).filter(User.id.in_([c["id"] for c in changed])).all() if changed else []
+    rows = {u.id: row.render(request=request, t=t, u=u) for u in targets}
+    return {"action": action, "changed": changed, "skipped": len(set(ids)) - len(changed), "rows": rows}
+
+# --- Admin page fragments: one user row or the newest audit rows instead of the whole /admin page ---
+def _user_row(request: Request, target: User | None) -> HTMLResponse:
+    if not target:
+        raise HTTPException(status_code=404)
+    return fragment(request, "_user_row.html", u=target)
+
+@app.get("/admin/fragments/users/{user_id}", response_class=HTMLResponse)
+def admin_user_row(user_id: int, request: Request, db: Session = Depends(get_read_db), user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    return _user_row(request, db.query(User).filter(User.id == user_id).first())
+
+@app.get("/admin/fragments/audit", response_class=HTMLResponse)
+def admin_audit_rows(request: Request, after: int = 0, limit: int = 50, db: Session = Depends(get_db), user: User | None = Depends(get_current_user)):
+    # primary session: the rows the caller just wrote may not have reached a replica yet
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    logs = db.query(AuditLog).filter(AuditLog.id > after).order_by(AuditLog.id.desc()).limit(max(1, min(limit, 200))).all()
+    return fragment(request, "_audit_rows.html", logs=logs)
+
 # ---- Global gate: force password change if flagged ----
 from fastapi.responses import RedirectResponse as _RR
 
@@ -511,3 +766,217 @@ def _load_t(request):
     t = _read("en")
     t.update(_read(code))
     return t
+
+# ---- Metrics: per-route timing, DB query counts, /metrics and Server-Timing ----
+# Registered last so it is the outermost middleware and times the gates above too.
+import time as _time
+from fastapi.responses import PlainTextResponse
+from .auth import is_local_request
+from .services import metrics
+
+metrics.instrument_engine(engine)
+if read_engine is not engine:
+    metrics.instrument_engine(read_engine)
+
+@app.middleware("http")
+async def metrics_mw(request: Request, call_next):
+    if not settings.METRICS_ENABLED:
+        return await call_next(request)
+    stats = metrics.begin_request()
+    start = _time.perf_counter()
+    response = await call_next(request)
+    elapsed = _time.perf_counter() - start
+    route = request.scope.get("route")
+    metrics.finish_request(request.method, getattr(route, "path", "unmatched"), response.status_code, elapsed, stats)
+    if settings.SERVER_TIMING == "all" or (settings.SERVER_TIMING == "admin" and getattr(request.state, "role", None) == Role.admin):
+        response.headers["Server-Timing"] = metrics.server_timing(elapsed, stats)
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint(request: Request):
+    if not settings.METRICS_ENABLED or not is_local_request(request, settings.METRICS_ALLOWED_HOSTS):
+        raise HTTPException(status_code=404)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ---- Request profiler (admin only) ----
+from fastapi.responses import FileResponse
+from .db import ReadSessionLocal
+from .services import profiler
+
+def _session_is_admin(request: Request) -> bool:
+    db = ReadSessionLocal()
+    try:
+        user = get_current_user(request, db)
+        return bool(user and user.role == Role.admin)
+    finally:
+        db.close()
+
+@app.middleware("http")
+async def profiler_mw(request: Request, call_next):
+    # ?_profile=1 only for admin sessions, checked before cProfile is switched on; sampling applies to everyone
+    if profiler.on_demand(request):
+        wanted = await asyncio.to_thread(_session_is_admin, request)
+    else:
+        wanted = profiler.sampled()
+    if not wanted:
+        return await call_next(request)
+    prof = profiler.start()
+    start = _time.perf_counter()
+    response = await call_next(request)
+    elapsed = _time.perf_counter() - start
+    route = request.scope.get("route")
+    await asyncio.to_thread(profiler.finish, prof, request.method, getattr(route, "path", request.url.path), response.status_code, elapsed)
+    return response
+
+@app.get("/admin/profiles", response_class=HTMLResponse)
+def admin_profiles(request: Request, user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        return RedirectResponse("/", status_code=302)
+    return templates.TemplateResponse("profiles.html", {"request": request, "t": _load_t(request), "user": user, "is_admin": True,
+                                                        "profiles": profiler.slowest(), "sample_rate": settings.PROFILE_SAMPLE_RATE})
+
+@app.get("/admin/profiles/{pid}", response_class=PlainTextResponse)
+def admin_profile_report(pid: int, user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    entry = profiler.get(pid)
+    if not entry:
+        raise HTTPException(status_code=404)
+    return PlainTextResponse(f"{entry['method']} {entry['path']} -> {entry['status']} in {entry['ms']} ms\n\n{entry['report']}")
+
+@app.get("/admin/profiles/{pid}/download")
+def admin_profile_download(pid: int, user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    entry = profiler.get(pid)
+    if not entry or not entry["file"]:
+        raise HTTPException(status_code=404)
+    return FileResponse(entry["file"], media_type="application/octet-stream", filename=f"s77-{pid}.prof")
+
+# ---- Buff history archive and usage rollups ----
+from .db import SessionLocal
+from .services import history
+
+def _archive_once():
+    db = SessionLocal()
+    try:
+        history.archive_past(db, settings.ARCHIVE_AFTER_HOURS)
+    finally:
+        db.close()
+
+async def _archive_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_archive_once)
+        except Exception:
+            logging.getLogger().exception("Buff archiver failed")
+        await asyncio.sleep(settings.ARCHIVE_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def _start_archiver():
+    # one archiver across all workers
+    if settings.ARCHIVE_INTERVAL_SECONDS > 0 and broadcast.hold_lock("archiver"):
+        asyncio.create_task(_archive_loop())
+
+# ---- Reminder dispatcher ----
+from .services import notify
+
+@app.on_event("startup")
+async def _start_notifier():
+    sinks = notify.configured_sinks()
+    if sinks and broadcast.hold_lock("notifier"):
+        asyncio.create_task(notify.Dispatcher(sinks, SessionLocal).run())
+
+@app.get("/admin/analytics")
+def admin_analytics(days: int = 30, db: Session = Depends(get_read_db), user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    return history.usage_report(db, max(1, min(days, 3660)))
+
+# ---- Alliance events and polls ----
+# Fetch posts get back just the events list or the one poll they changed (see wants_fragment)
+def _events_fragment(request: Request, db: Session, user: User) -> HTMLResponse:
+    return fragment(request, "_events.html", events=events.upcoming_events(db, user.alliance, request.state.now_utc), is_admin=user.role == Role.admin)
+
+def _poll_fragment(request: Request, db: Session, user: User, poll_id: int) -> HTMLResponse:
+    polls = events.open_polls(db, user.alliance, user.aoe_name, request.state.now_utc, poll_id=poll_id)
+    if not polls:
+        return HTMLResponse("")  # closed or not visible: the form is removed
+    return fragment(request, "_poll.html", p=polls[0], is_admin=user.role == Role.admin)
+
+@app.get("/fragments/events", response_class=HTMLResponse)
+def events_fragment(request: Request, db: Session = Depends(get_read_db), user: User | None = Depends(get_current_user)):
+    if not user: raise HTTPException(status_code=401)
+    return _events_fragment(request, db, user)
+
+@app.get("/fragments/polls/{poll_id}", response_class=HTMLResponse)
+def poll_fragment(poll_id: int, request: Request, db: Session = Depends(get_read_db), user: User | None = Depends(get_current_user)):
+    if not user: raise HTTPException(status_code=401)
+    return _poll_fragment(request, db, user, poll_id)
+
+def _form_start(date: str, hour_utc: str) -> datetime:
+    y, m, d = [int(x) for x in date.split("-")]
+    return datetime(y, m, d, int(hour_utc), 0, 0, tzinfo=timezone.utc)
+
+@app.post("/events/create")
+def events_create(request: Request, kind: str = Form(...), date: str = Form(...), hour_utc: str = Form(...), alliance: str = Form(""),
+                  legion: str = Form(""), notes: str = Form(""), db: Session = Depends(get_db), user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    try:
+        ev = events.create_event(db, user.aoe_name, alliance, kind, _form_start(date, hour_utc), legion or None, notes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e) or "bad date/hour")
+    audit.log(db, "event_create", ip_of(request), actor=user.aoe_name, details=f"{ev.kind} {ev.legion or ''} {ev.alliance or 'all'} {ev.start_utc}")
+    if wants_fragment(request):
+        return _events_fragment(request, db, user)
+    return RedirectResponse("/", status_code=303)
+
+@app.post("/events/delete")
+def events_delete(request: Request, id: int = Form(...), db: Session = Depends(get_db), user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    if events.delete_event(db, id):
+        audit.log(db, "event_delete", ip_of(request), actor=user.aoe_name, details=f"id={id}")
+    if wants_fragment(request):
+        return _events_fragment(request, db, user)
+    return RedirectResponse("/", status_code=303)
+
+@app.post("/polls/create")
+def polls_create(request: Request, question: str = Form(...), options: str = Form(...), alliance: str = Form(""), days: int = Form(0),
+                 db: Session = Depends(get_db), user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    closes_at = request.state.now_utc + timedelta(days=days) if days > 0 else None
+    try:
+        poll = events.create_poll(db, user.aoe_name, alliance, question, options.splitlines(), closes_at)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    audit.log(db, "poll_create", ip_of(request), actor=user.aoe_name, details=f"id={poll.id} {poll.alliance or 'all'}")
+    if wants_fragment(request):
+        return _poll_fragment(request, db, user, poll.id)
+    return RedirectResponse("/", status_code=303)
+
+@app.post("/polls/{poll_id}/close")
+def polls_close(poll_id: int, request: Request, db: Session = Depends(get_db), user: User | None = Depends(get_current_user)):
+    if not user or user.role != Role.admin:
+        raise HTTPException(status_code=403)
+    if events.close_poll(db, poll_id):
+        audit.log(db, "poll_close", ip_of(request), actor=user.aoe_name, details=f"id={poll_id}")
+    if wants_fragment(request):
+        return HTMLResponse("")
+    return RedirectResponse("/", status_code=303)
+
+@app.post("/polls/{poll_id}/vote")
+def polls_vote(poll_id: int, request: Request, option_id: int = Form(...), db: Session = Depends(get_db), user: User | None = Depends(get_current_user)):
+    if not user: raise HTTPException(status_code=401)
+    if not events.vote(db, poll_id, option_id, user.aoe_name, user.alliance, request.state.now_utc):
+        if wants_fragment(request):
+            return HTMLResponse("")
+        return RedirectResponse("/?poll_closed=1", status_code=303)
+    if wants_fragment(request):
+        return _poll_fragment(request, db, user, poll_id)
+    return RedirectResponse("/", status_code=303)
+
+# must run after every route is registered
+profiler.instrument_routes(app)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Enum, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, Enum, Float, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from .db import Base
@@ -37,8 +37,99 @@ class Buff(Base):
     aoe_name = Column(String(80), nullable=False, index=True)
     title = Column(String(32), nullable=False)      # Research, Training, Building, Combat, PvP
     region = Column(String(40), nullable=False)     # Imperial City, ...
-    start_utc = Column(DateTime(timezone=True), nullable=False)  # hour start
+    start_utc = Column(DateTime(timezone=True), nullable=False, index=True)  # hour start
     source = Column(String(16), nullable=False, default="web")   # "discord" or "web"
     created_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
 
     __table_args__ = (UniqueConstraint("title", "start_utc", name="uniq_title_time"), )
+
+class BuffHistory(Base):
+    """Past buffs moved out of `buffs` by services.history. Range-partitioned by month on Postgres."""
+    __tablename__ = "buff_history"
+    id = Column(Integer, primary_key=True, autoincrement=False)       # id it had in buffs
+    start_utc = Column(DateTime(timezone=True), primary_key=True)     # partition key must be in the PK
+    aoe_name = Column(String(80), nullable=False, index=True)
+    title = Column(String(32), nullable=False)
+    region = Column(String(40), nullable=False)
+    source = Column(String(16), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    archived_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
+
+    __table_args__ = ({"postgresql_partition_by": "RANGE (start_utc)"}, )
+
+class BuffRollupHourly(Base):
+    """Archived bookings per slot hour, title, region and source."""
+    __tablename__ = "buff_rollup_hourly"
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    title = Column(String(32), primary_key=True)
+    region = Column(String(40), primary_key=True)
+    source = Column(String(16), primary_key=True)
+    bookings = Column(Integer, nullable=False, default=0)
+
+class BuffRollupDaily(Base):
+    """Archived bookings per slot day, title, region, hour of day and user."""
+    __tablename__ = "buff_rollup_daily"
+    day = Column(Date, primary_key=True)
+    title = Column(String(32), primary_key=True)
+    region = Column(String(40), primary_key=True)
+    hour = Column(Integer, primary_key=True)
+    aoe_name = Column(String(80), primary_key=True)
+    bookings = Column(Integer, nullable=False, default=0)
+
+class NotificationSent(Base):
+    """Notices delivered (or given up on) per sink, so services.notify sends each one once."""
+    __tablename__ = "notifications_sent"
+    sink = Column(String(16), primary_key=True)
+    key = Column(String(64), primary_key=True)      # "pre:<buff id>:<YYYYMMDDHH>" or "digest:<YYYYMMDDHH>"
+    sent_at = Column(DateTime(timezone=True), default=utcnow, nullable=False, index=True)
+
+class AllianceEvent(Base):
+    """Alliance (or server-wide, alliance == "") events shown in the home-page widget."""
+    __tablename__ = "alliance_events"
+    id = Column(Integer, primary_key=True)
+    alliance = Column(String(120), nullable=False, default="")  # "" = every alliance
+    kind = Column(String(32), nullable=False)                   # Trojan, World Boss, Treasure Hunt, Wonder, Dawn
+    legion = Column(String(8), nullable=True)                   # Legion group tag for Wonder/Dawn, e.g. SAT01
+    start_utc = Column(DateTime(timezone=True), nullable=False)
+    notes = Column(String(500), nullable=True)
+    created_by = Column(String(80), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
+
+    __table_args__ = (Index("ix_alliance_events_alliance_start", "alliance", "start_utc"), )
+
+class Poll(Base):
+    """A poll; total_votes and PollOption.votes are counters kept in step with each vote."""
+    __tablename__ = "polls"
+    id = Column(Integer, primary_key=True)
+    alliance = Column(String(120), nullable=False, default="")  # "" = every alliance
+    question = Column(String(300), nullable=False)
+    is_open = Column(Boolean, default=True, nullable=False)
+    closes_at = Column(DateTime(timezone=True), nullable=True)
+    total_votes = Column(Integer, default=0, nullable=False)
+    created_by = Column(String(80), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
+
+    __table_args__ = (Index("ix_polls_alliance_open", "alliance", "is_open", "created_at"), )
+
+class PollOption(Base):
+    __tablename__ = "poll_options"
+    id = Column(Integer, primary_key=True)
+    poll_id = Column(Integer, ForeignKey("polls.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    label = Column(String(200), nullable=False)
+    votes = Column(Integer, default=0, nullable=False)
+
+class PollVote(Base):
+    """One row per (poll, voter); changing a vote moves the counters instead of adding a row."""
+    __tablename__ = "poll_votes"
+    poll_id = Column(Integer, ForeignKey("polls.id", ondelete="CASCADE"), primary_key=True)
+    aoe_name = Column(String(80), primary_key=True)
+    option_id = Column(Integer, ForeignKey("poll_options.id", ondelete="CASCADE"), nullable=False)
+    ts = Column(DateTime(timezone=True), default=utcnow, nullable=False)
+
+class RateBucket(Base):
+    """Token buckets shared by all workers when S77_RATE_LIMIT_BACKEND=db (services.ratelimit)."""
+    __tablename__ = "rate_buckets"
+    key = Column(String(200), primary_key=True)  # "<route>:<ip|name>:<value>"
+    tokens = Column(Float, nullable=False)
+    updated = Column(Float, nullable=False)      # epoch seconds
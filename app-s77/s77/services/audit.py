@@ -2,5 +2,9 @@ from sqlalchemy.orm import Session
 from ..models import AuditLog
 
 def log(db: Session, action: str, ip: str | None = None, actor: str | None = None, details: str | None = None):
-    db.add(AuditLog(action=action, ip=ip, actor=actor, details=details))
+    add(db, action, ip, actor, details)
     db.commit()
+
+def add(db: Session, action: str, ip: str | None = None, actor: str | None = None, details: str | None = None):
+    """Stage an audit row in the caller's transaction (committed with the change it records)."""
+    db.add(AuditLog(action=action, ip=ip, actor=actor, details=details))
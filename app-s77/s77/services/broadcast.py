@@ -0,0 +1,211 @@
+"""Cross-worker cache invalidation for multi-worker deployments.
+
+Each worker process keeps its own in-memory caches (e.g. the parsed shared JSON in discord_sync).
+publish(topic) tells every other worker to drop the cache registered for `topic`:
+
+- "pg": NOTIFY on one Postgres channel; each worker LISTENs on a dedicated connection in a daemon thread
+- "socket": each worker binds a Unix datagram socket in BROADCAST_DIR and publish() sends to all of them
+- "off": single worker, nothing to tell
+
+Messages carry only "<pid>:<topic>". Receivers re-check the source of truth, so a lost message
+only delays invalidation until the file watcher notices the change.
+"""
+import asyncio, fcntl, glob, logging, os, select, socket, threading
+from contextlib import contextmanager
+from ..settings import settings
+
+log = logging.getLogger(__name__)
+CHANNEL = "s77_invalidate"
+
+_subscribers: dict[str, list] = {}
+_state = {"mode": "off", "loop": None, "sock": None, "path": None, "send": None, "thread": None, "stop": None}
+_held = {}  # name -> open lock file, kept for the life of the worker
+
+def subscribe(topic: str, callback):
+    """Run `callback()` on the event loop when another worker publishes `topic`."""
+    _subscribers.setdefault(topic, []).append(callback)
+    return callback
+
+def mode() -> str:
+    return _state["mode"]
+
+def _resolve_mode() -> str:
+    wanted = settings.BROADCAST
+    if wanted != "auto":
+        return wanted
+    if settings.WORKERS <= 1:
+        return "off"
+    return "pg" if settings.DB_URL.startswith("postgresql") else "socket"
+
+def _dispatch(message: str, everything: bool = False):
+    pid, _, topic = message.partition(":")
+    if pid == str(os.getpid()) and not everything:
+        return
+    topics = list(_subscribers) if everything else [topic]
+    for t in topics:
+        for callback in _subscribers.get(t, ()):
+            try:
+                callback()
+            except Exception:
+                log.exception("Invalidation callback for %s failed", t)
+
+def start():
+    """Join the broadcast group; call once per worker from the running event loop (after any fork)."""
+    if _state["mode"] != "off":
+        return _state["mode"]
+    wanted = _resolve_mode()
+    _state["loop"] = asyncio.get_running_loop()
+    try:
+        if wanted == "pg":
+            _start_pg()
+        elif wanted == "socket":
+            _start_socket()
+        elif wanted != "off":
+            raise ValueError(f"unknown S77_BROADCAST mode {wanted!r}")
+    except (OSError, ValueError, ImportError):
+        log.exception("Cross-worker broadcast (%s) unavailable; workers rely on the file watcher", wanted)
+        return "off"
+    _state["mode"] = wanted
+    log.info("Cross-worker broadcast: %s (pid %s)", wanted, os.getpid())
+    return wanted
+
+def stop():
+    if _state["stop"] is not None:
+        _state["stop"].set()
+    if _state["sock"] is not None:
+        _state["loop"].remove_reader(_state["sock"].fileno())
+        _state["sock"].close()
+        try:
+            os.unlink(_state["path"])
+        except OSError:
+            pass
+    _state.update(mode="off", sock=None, path=None, thread=None, stop=None)
+
+def publish(topic: str):
+    """Tell the other workers that `topic` changed. Safe from threadpool code; never raises."""
+    message = f"{os.getpid()}:{topic}"
+    try:
+        if _state["mode"] == "pg":
+            _publish_pg(message)
+        elif _state["mode"] == "socket":
+            _publish_socket(message)
+    except Exception:
+        log.exception("Broadcast of %s failed", topic)
+
+# --- Postgres LISTEN/NOTIFY ---
+
+def _pg_dsn() -> str:
+    from sqlalchemy.engine import make_url
+    return make_url(settings.DB_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+
+def _publish_pg(message: str):
+    from sqlalchemy import text
+    from ..db import engine
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_notify(:channel, :message)"), {"channel": CHANNEL, "message": message})
+
+def _start_pg():
+    import psycopg2  # noqa: F401 - fail at startup rather than in the thread
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_listen_pg, args=(_state["loop"], stop_event), name="s77-listen", daemon=True)
+    _state.update(stop=stop_event, thread=thread)
+    thread.start()
+
+def _listen_pg(loop, stop_event):
+    # A dedicated connection outside the pool: it sits in LISTEN for the life of the worker
+    import psycopg2
+    first = True
+    while not stop_event.is_set():
+        try:
+            conn = psycopg2.connect(_pg_dsn())
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CHANNEL}")
+            if not first:
+                # notifications sent while we were disconnected are lost: drop every cache once
+                loop.call_soon_threadsafe(_dispatch, "", True)
+            first = False
+            while not stop_event.is_set():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    loop.call_soon_threadsafe(_dispatch, conn.notifies.pop(0).payload)
+        except Exception:
+            log.exception("LISTEN %s connection lost; reconnecting", CHANNEL)
+            stop_event.wait(3)
+
+# --- Unix datagram sockets ---
+
+def _start_socket():
+    os.makedirs(settings.BROADCAST_DIR, exist_ok=True)
+    path = os.path.join(settings.BROADCAST_DIR, f"worker-{os.getpid()}.sock")
+    try:
+        os.unlink(path)  # left over from a previous worker with the same pid
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.setblocking(False)
+    _state.update(sock=sock, path=path, send=socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM))
+    _state["send"].setblocking(False)
+    _state["loop"].add_reader(sock.fileno(), _on_datagram)
+
+def _on_datagram():
+    while True:
+        try:
+            data = _state["sock"].recv(256)
+        except BlockingIOError:
+            return
+        _dispatch(data.decode("utf-8", "replace"))
+
+def _publish_socket(message: str):
+    data = message.encode()
+    for path in glob.glob(os.path.join(settings.BROADCAST_DIR, "worker-*.sock")):
+        if path == _state["path"]:
+            continue
+        try:
+            _state["send"].sendto(data, path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            try:
+                os.unlink(path)  # the worker that bound it is gone
+            except OSError:
+                pass
+        except BlockingIOError:
+            log.warning("Worker socket %s is backed up; it will catch up via the file watcher", path)
+
+# --- Single-runner jobs ---
+
+def hold_lock(name: str) -> bool:
+    """Try to become the one worker that runs background job `name`; True if this worker holds it.
+
+    The flock is released when the worker exits, so another worker takes over after a restart.
+    Without a usable BROADCAST_DIR every worker runs the job.
+    """
+    if name in _held:
+        return True
+    try:
+        os.makedirs(settings.BROADCAST_DIR, exist_ok=True)
+        f = open(os.path.join(settings.BROADCAST_DIR, f"{name}.lock"), "a")
+    except OSError:
+        return True
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return False
+    _held[name] = f
+    return True
+
+@contextmanager
+def exclusive(name: str):
+    """Run the block in one worker at a time (blocking flock); unguarded without a usable BROADCAST_DIR."""
+    try:
+        os.makedirs(settings.BROADCAST_DIR, exist_ok=True)
+        f = open(os.path.join(settings.BROADCAST_DIR, f"{name}.lock"), "a")
+    except OSError:
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
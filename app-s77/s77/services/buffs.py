@@ -1,11 +1,17 @@
-from datetime import datetime, timezone
+from datetime import datetime, date, time, timezone, timedelta
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from ..models import Buff
-from .discord_sync import conflicts as discord_conflicts, write_request
+from ..core import TITLES, REGIONS
+from . import audit
+from .discord_sync import conflicts as discord_conflicts, moving, reserving, taken_starts, list_upcoming_two_days
 
-VALID_TITLES = ["Research","Training","Building","Combat","PvP"]
-VALID_REGIONS = ["Imperial City","Gaul","Olympia","Neilos","Tinir","East Kingsland","Eastland","Kyuno","North Kingsland","West Kingsland","NA"]
+# copied before any legacy names get interned into the shared code tables
+VALID_TITLES = list(TITLES.names)
+VALID_REGIONS = list(REGIONS.names)
 
 def normalized_hour(dt: datetime) -> datetime:
     dt = dt.astimezone(timezone.utc)
@@ -13,22 +19,108 @@ def normalized_hour(dt: datetime) -> datetime:
 
 def check_conflict(db: Session, title: str, start_utc: datetime) -> bool:
     # DB conflict
-    exists = db.query(Buff).filter(and_(Buff.title==title, Buff.start_utc==start_utc)).first()
+    exists = db.query(Buff.id).filter(and_(Buff.title==title, Buff.start_utc==start_utc)).first()
     if exists:
         return True
     # Discord JSON conflict
     return discord_conflicts(title, start_utc)
 
-def create_buff(db: Session, aoe_name: str, title: str, region: str, start_utc: datetime, source="web"):
+def as_utc(dt: datetime) -> datetime:
+    # SQLite hands back naive datetimes for DateTime(timezone=True); values are always stored as UTC
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+def free_hours(db: Session, title: str, day: date, now_utc: datetime) -> list[int]:
+    """UTC hours on `day` that have not ended and are free for `title` in both the DB and the Discord JSON."""
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    end = start + timedelta(days=1)
+    taken = {as_utc(r[0]) for r in db.query(Buff.start_utc).filter(Buff.title==title, Buff.start_utc>=start, Buff.start_utc<end)}
+    taken |= taken_starts(title, start, end)
+    hours = []
+    for h in range(24):
+        slot = start + timedelta(hours=h)
+        if slot + timedelta(hours=1) > now_utc and slot not in taken:
+            hours.append(h)
+    return hours
+
+def list_merged(db: Session, now_utc: datetime, end: datetime) -> list[dict]:
+    """DB buffs plus Discord JSON entries in [now_utc, end), deduped on (title, start) and sorted by start."""
+    # plain column rows: no identity map or attribute instrumentation for a read-only listing
+    db_items = (db.query(Buff.id, Buff.aoe_name, Buff.title, Buff.region, Buff.start_utc, Buff.source)
+                .filter(Buff.start_utc >= now_utc, Buff.start_utc < end).order_by(Buff.start_utc.asc()).all())
+    db_json = [{"id": f"db:{b.id}", "aoe_name": b.aoe_name, "title": b.title, "region": b.region, "start_iso": as_utc(b.start_utc).isoformat(), "source": b.source} for b in db_items]
+    disc = [d for d in list_upcoming_two_days(now_utc, days=(end - now_utc).days + 1) if d["start_utc"] < end]
+    disc_json = [{"id": d["id"], "aoe_name": d["aoe_name"], "title": d["title"], "region": d["region"], "start_iso": d["start_utc"].isoformat(), "source": "discord"} for d in disc]
+    seen = set((x["title"], x["start_iso"]) for x in db_json)
+    merged = db_json + [d for d in disc_json if (d["title"], d["start_iso"]) not in seen]
+    merged.sort(key=lambda x: x["start_iso"])
+    return merged
+
+def _insert_once(db: Session, values: dict):
+    """INSERT the buff unless (title, start_utc) is taken; returns the new id or None, in one statement."""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = pg_insert if dialect == "postgresql" else sqlite_insert
+        stmt = insert(Buff).values(**values).on_conflict_do_nothing(index_elements=["title", "start_utc"]).returning(Buff.id)
+        return db.execute(stmt).scalar()
+    try:
+        with db.begin_nested():
+            return db.execute(Buff.__table__.insert().values(**values).returning(Buff.id)).scalar()
+    except IntegrityError:
+        return None
+
+def create_buff(db: Session, aoe_name: str, title: str, region: str, start_utc: datetime, source="web", discord_user_id: int = 0,
+                audit_action: str | None = None, ip: str | None = None) -> int:
+    """Book (title, hour) and return the new buff id; raises ValueError("Conflict") if it is taken.
+
+    The insert is the conflict check (uniq_title_time), and the audit row commits in the same
+    transaction. The shared JSON lock is held throughout, so the Discord mirror cannot gain the
+    same slot in between and gets the entry right after the commit.
+    """
     start_utc = normalized_hour(start_utc)
     if title not in VALID_TITLES:
         raise ValueError("Invalid title")
     if region not in VALID_REGIONS:
         raise ValueError("Invalid region")
-    if check_conflict(db, title, start_utc):
-        raise ValueError("Conflict")
-    b = Buff(aoe_name=aoe_name, title=title, region=region, start_utc=start_utc, source=source)
-    db.add(b); db.commit()
-    # write to shared JSON so bot can announce & see parity
-    write_request(aoe_name, title, region, start_utc)
-    return b
+    with reserving(title, start_utc) as mirror:
+        if mirror is None:
+            raise ValueError("Conflict")
+        buff_id = _insert_once(db, {"aoe_name": aoe_name, "title": title, "region": region, "start_utc": start_utc, "source": source})
+        if buff_id is None:
+            db.rollback()
+            raise ValueError("Conflict")
+        if audit_action:
+            audit.add(db, audit_action, ip, actor=aoe_name, details=f"{title} {region} {start_utc}")
+        db.commit()
+        # write to shared JSON so bot can announce & see parity
+        mirror(aoe_name, region, user_id=discord_user_id)
+    return buff_id
+
+def move_buff(db: Session, title: str, start_utc: datetime, new_title: str, new_start: datetime,
+              audit_action: str | None = None, actor: str | None = None, ip: str | None = None) -> bool:
+    """Move the booking at (title, hour) to (new_title, new hour) in the DB and the Discord mirror.
+
+    Returns False if no DB row holds the old slot; raises ValueError("Conflict") if the new one is taken.
+    """
+    start_utc, new_start = normalized_hour(start_utc), normalized_hour(new_start)
+    if new_title not in VALID_TITLES:
+        raise ValueError("Invalid title")
+    if (title, start_utc) == (new_title, new_start):
+        return db.query(Buff.id).filter(Buff.title == title, Buff.start_utc == start_utc).first() is not None
+    with moving(title, start_utc, new_title, new_start) as commit:
+        if commit is None:
+            raise ValueError("Conflict")
+        try:
+            moved = (db.query(Buff).filter(Buff.title == title, Buff.start_utc == start_utc)
+                     .update({"title": new_title, "start_utc": new_start}, synchronize_session=False))
+            db.flush()  # uniq_title_time rejects a DB booking already in the new slot
+        except IntegrityError:
+            db.rollback()
+            raise ValueError("Conflict")
+        if not moved:
+            db.rollback()
+            return False
+        if audit_action:
+            audit.add(db, audit_action, ip, actor=actor, details=f"{title} {start_utc} -> {new_title} {new_start}")
+        db.commit()
+        commit()
+    return True
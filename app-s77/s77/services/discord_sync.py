@@ -1,105 +1,204 @@
-import json, os
-from datetime import datetime, timezone, timedelta
+import fcntl, json, os
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from typing import Dict, List
 from ..settings import settings
+from ..core import TITLES, BuffRecord, slot_of, slot_start
+from .metrics import span
+from . import broadcast
+
+TOPIC = "discord_json"
 
 def _ensure_file():
     if not os.path.exists(settings.SHARED_JSON):
         with open(settings.SHARED_JSON, "w", encoding="utf-8") as f:
             f.write("{}")
 
-def read_all() -> Dict[str, dict]:
+# Parsed SHARED_JSON kept between calls. Without a watcher it is revalidated with one os.stat per read;
+# once start_watching() runs, the watcher's bump() invalidates it and reads skip the stat entirely.
+_cache = {"gen": 0, "stamp": None, "data": None, "records_of": None, "records": {}, "by_key": {}}
+_watcher = None
+
+def _stamp():
+    st = os.stat(settings.SHARED_JSON)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def bump():
+    """Invalidate the cached parse (file watcher callback)."""
+    try:
+        if _cache["data"] is not None and _cache["stamp"] == _stamp():
+            return  # our own _write_all already refreshed the cache
+    except FileNotFoundError:
+        pass
+    _cache["data"] = None
+    _cache["gen"] += 1
+
+def generation() -> int:
+    return _cache["gen"]
+
+def start_watching():
+    """Subscribe the cache to change notifications for SHARED_JSON; call from the running event loop."""
+    global _watcher
+    if _watcher is None:
+        from .filewatch import FileWatcher
+        _ensure_file()
+        _watcher = FileWatcher(settings.SHARED_JSON)
+        _watcher.subscribe(bump)
+        _watcher.start()
+    return _watcher
+
+def read_all(verify: bool = False) -> Dict[str, dict]:
+    """Parsed SHARED_JSON; `verify` re-checks the file even while a watcher is running."""
     _ensure_file()
-    with open(settings.SHARED_JSON, "r", encoding="utf-8") as f:
+    data = _cache["data"]
+    if data is not None and ((_watcher is not None and not verify) or _cache["stamp"] == _stamp()):
+        return data
+    stamp = _stamp()
+    with span("discord_json"), open(settings.SHARED_JSON, "r", encoding="utf-8") as f:
         try:
-            return json.load(f)
+            data = json.load(f)
         except json.JSONDecodeError:
-            return {}
+            data = {}
+    _cache.update(stamp=stamp, data=data)
+    return data
+
+@contextmanager
+def _locked():
+    """Exclusive flock around a read-modify-write, shared by every worker process and thread.
 
-def write_request(aoe_name: str, title: str, region: str, start_utc: datetime):
-    d = read_all()
+    Yields a fresh copy of the file's contents; pass it to _write_all before leaving the block.
+    """
+    _ensure_file()
+    with open(settings.SHARED_JSON + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield dict(read_all(verify=True))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _write_all(d: Dict[str, dict]):
+    # temp file + rename: readers in other workers (and the bot) never see a half-written file
+    tmp = f"{settings.SHARED_JSON}.{os.getpid()}.tmp"
+    with span("discord_json_write"):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(d, f, indent=4)
+        os.replace(tmp, settings.SHARED_JSON)
+    _cache.update(stamp=_stamp(), data=d, gen=_cache["gen"] + 1)
+    broadcast.publish(TOPIC)
+
+broadcast.subscribe(TOPIC, bump)
+
+def _add_entry(d: Dict[str, dict], aoe_name: str, title: str, region: str, start_utc: datetime, user_id: int = 0):
     req_id = str(datetime.now(timezone.utc).timestamp())
     d[req_id] = {
-        "user_id": 0,
+        "user_id": user_id,                           # Discord user id when booked through the bot bridge
         "user_name": aoe_name,
         "title": title,
         "time_slot": start_utc.isoformat(),          # ISO8601 UTC
         "region": region,
         "request_time": datetime.now(timezone.utc).isoformat()
     }
-    with open(settings.SHARED_JSON, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=4)
+
+def write_request(aoe_name: str, title: str, region: str, start_utc: datetime, user_id: int = 0):
+    with _locked() as d:
+        _add_entry(d, aoe_name, title, region, start_utc, user_id)
+        _write_all(d)
+
+@contextmanager
+def reserving(title: str, start_utc: datetime):
+    """Hold the SHARED_JSON lock for one booking.
+
+    Yields None if the file already holds (title, hour); otherwise a `mirror(aoe_name, region, user_id=0)`
+    callable that adds the entry. Nobody else can book the slot in the file until the block exits.
+    """
+    with _locked() as d:
+        _, by_key = read_records()  # the locked read refreshed the cache
+        if (TITLES.lookup(title), slot_of(start_utc)) in by_key:
+            yield None
+            return
+
+        def mirror(aoe_name: str, region: str, user_id: int = 0):
+            _add_entry(d, aoe_name, title, region, start_utc, user_id)
+            _write_all(d)
+        yield mirror
+
+@contextmanager
+def moving(title: str, start_utc: datetime, new_title: str, new_start: datetime):
+    """Hold the SHARED_JSON lock while a booking moves from (title, hour) to (new_title, new hour).
+
+    Yields None if the file already holds the new slot; otherwise a `commit()` callable that moves
+    the file's entries for the old slot as well.
+    """
+    with _locked() as d:
+        _, by_key = read_records()  # the locked read refreshed the cache
+        if (TITLES.lookup(new_title), slot_of(new_start)) in by_key:
+            yield None
+            return
+
+        def commit():
+            keys = by_key.get((TITLES.lookup(title), slot_of(start_utc)), [])
+            for k in keys:
+                d[k] = {**d[k], "title": new_title, "time_slot": new_start.isoformat()}
+            if keys:
+                _write_all(d)
+        yield commit
+
+def read_records():
+    """BuffRecords for the current SHARED_JSON plus a (title code, slot) -> [request ids] index, rebuilt only when the file changed."""
+    data = read_all()
+    if _cache["records_of"] is not data:
+        records, by_key = {}, {}
+        for k, v in data.items():
+            try:
+                rec = BuffRecord.from_legacy(k, v)
+            except Exception:
+                continue
+            records[k] = rec
+            by_key.setdefault(rec.key, []).append(k)
+        _cache.update(records_of=data, records=records, by_key=by_key)
+    return _cache["records"], _cache["by_key"]
 
 def conflicts(title: str, start_utc: datetime) -> bool:
-    for req in read_all().values():
-        t = req.get("title")
-        ts = req.get("time_slot")
-        if not (t and ts):
-            continue
-        try:
-            when = datetime.fromisoformat(ts)
-            if when.tzinfo is None:
-                when = when.replace(tzinfo=timezone.utc)
-            if t == title and when == start_utc:
-                return True
-        except Exception:
-            continue
-    return False
-
-def list_upcoming_two_days(now_utc: datetime) -> List[dict]:
-    end = now_utc + timedelta(days=2)
-    out: List[dict] = []
-    for _, v in read_all().items():
-        ts = v.get("time_slot")
-        if not ts:
-            continue
-        try:
-            when = datetime.fromisoformat(ts)
-            if when.tzinfo is None:
-                when = when.replace(tzinfo=timezone.utc)
-        except Exception:
-            continue
-        if now_utc <= when < end:
-            out.append({
-                "id": f"discord:{v.get('request_time','')}",
-                "aoe_name": v.get("user_name", "unknown"),
-                "title": v.get("title", "Unknown"),
-                "region": v.get("region", "NA"),
-                "start_utc": when,
+    _, by_key = read_records()
+    return (TITLES.lookup(title), slot_of(start_utc)) in by_key
+
+def taken_starts(title: str, start: datetime, end: datetime) -> set:
+    """UTC hour starts in [start, end) that the Discord JSON already holds for `title`."""
+    code, lo, hi = TITLES.lookup(title), start.timestamp() / 3600, end.timestamp() / 3600
+    return {slot_start(rec.slot) for rec in read_records()[0].values() if rec.title == code and lo <= rec.slot < hi}
+
+def list_upcoming_two_days(now_utc: datetime, days: int = 2) -> List[dict]:
+    lo = now_utc.timestamp() / 3600
+    hi = lo + days * 24
+    dedup = {}  # (title, slot) -> entry
+    for rec in read_records()[0].values():
+        if lo <= rec.slot < hi:
+            dedup[rec.key] = {
+                "id": f"discord:{rec.request_time}",
+                "aoe_name": rec.user_name or "unknown",
+                "title": rec.title_name,
+                "region": rec.region_name,
+                "start_utc": rec.start,
                 "source": "discord"
-            })
-    # dedupe by (title, start)
-    dedup = {}
-    for e in out:
-        k = (e["title"], e["start_utc"].isoformat())
-        dedup[k] = e
+            }
     return list(dedup.values())
 
 def delete_request(title: str, start_utc: datetime) -> bool:
     """Remove the Discord JSON entry that matches (title, exact UTC hour)."""
-    d = read_all()
-    keys = []
-    for k, v in d.items():
-        ts = v.get("time_slot")
-        if not ts:
-            continue
-        try:
-            when = datetime.fromisoformat(ts)
-            if when.tzinfo is None:
-                when = when.replace(tzinfo=timezone.utc)
-        except Exception:
-            continue
-        if v.get("title") == title and when == start_utc:
-            keys.append(k)
-    for k in keys:
-        d.pop(k, None)
-    if keys:
-        with open(settings.SHARED_JSON, "w", encoding="utf-8") as f:
-            json.dump(d, f, indent=4)
-        return True
-    return False
+    _, by_key = read_records()
+    key = (TITLES.lookup(title), slot_of(start_utc))
+    if key not in by_key:
+        return False
+    with _locked() as d:
+        _, by_key = read_records()  # the locked read refreshed the cache
+        keys = by_key.get(key, [])
+        for k in keys:
+            d.pop(k, None)
+        if keys:
+            _write_all(d)
+    return bool(keys)
 
 def clear_all():
     """Clear the entire shared JSON (admin use)."""
-    with open(settings.SHARED_JSON, "w", encoding="utf-8") as f:
-        f.write("{}")
+    with _locked():
+        _write_all({})
@@ -0,0 +1,112 @@
+"""Alliance events and polls for the home-page widgets.
+
+Each widget is one query: events come off the (alliance, start_utc) index, and open polls are read
+together with their options and the viewer's own vote. Vote totals are counters on polls and
+poll_options, updated in the same transaction as the vote row, so no COUNT(*) runs at render time.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..models import AllianceEvent, Poll, PollOption, PollVote
+from .buffs import as_utc
+
+EVENT_KINDS = ["Trojan", "World Boss", "Treasure Hunt", "Wonder", "Dawn"]
+LEGION_KINDS = {"Wonder", "Dawn"}  # events that belong to one Legion group
+LEGIONS = ["SAT01", "SAT11", "SAT19", "SUN01", "SUN19"]
+MAX_OPTIONS = 10
+
+def _scopes(alliance: str | None) -> list[str]:
+    # "" marks server-wide events/polls, visible to every alliance
+    return sorted({alliance or "", ""})
+
+# --- Events ---
+
+def upcoming_events(db: Session, alliance: str | None, now: datetime, days: int = 14, limit: int = 20) -> list[dict]:
+    rows = (db.query(AllianceEvent.id, AllianceEvent.alliance, AllianceEvent.kind, AllianceEvent.legion, AllianceEvent.start_utc, AllianceEvent.notes)
+            .filter(AllianceEvent.alliance.in_(_scopes(alliance)), AllianceEvent.start_utc >= now, AllianceEvent.start_utc < now + timedelta(days=days))
+            .order_by(AllianceEvent.start_utc).limit(limit).all())
+    return [{"id": r.id, "alliance": r.alliance, "kind": r.kind, "legion": r.legion, "start_utc": as_utc(r.start_utc), "notes": r.notes} for r in rows]
+
+def create_event(db: Session, actor: str, alliance: str, kind: str, start_utc: datetime, legion: str | None = None, notes: str | None = None) -> AllianceEvent:
+    if kind not in EVENT_KINDS:
+        raise ValueError("Invalid event kind")
+    if legion and (kind not in LEGION_KINDS or legion not in LEGIONS):
+        raise ValueError("Invalid legion")
+    ev = AllianceEvent(alliance=alliance.strip(), kind=kind, legion=legion or None, start_utc=start_utc, notes=(notes or "").strip()[:500] or None, created_by=actor)
+    db.add(ev); db.commit()
+    return ev
+
+def delete_event(db: Session, event_id: int) -> bool:
+    deleted = db.query(AllianceEvent).filter(AllianceEvent.id == event_id).delete()
+    db.commit()
+    return bool(deleted)
+
+# --- Polls ---
+
+def open_polls(db: Session, alliance: str | None, aoe_name: str, now: datetime, limit: int = 10, poll_id: int | None = None) -> list[dict]:
+    """Open polls for the viewer, newest first, with options, counters and the viewer's own choice (just `poll_id` if given)."""
+    newest = (select(Poll.id)
+              .where(Poll.alliance.in_(_scopes(alliance)), Poll.is_open.is_(True), or_(Poll.closes_at.is_(None), Poll.closes_at > now))
+              .order_by(Poll.created_at.desc()).limit(limit))
+    if poll_id is not None:
+        newest = newest.where(Poll.id == poll_id)
+    rows = (db.query(Poll.id, Poll.question, Poll.total_votes, Poll.closes_at,
+                     PollOption.id.label("option_id"), PollOption.label, PollOption.votes, PollVote.option_id.label("mine"))
+            .join(PollOption, PollOption.poll_id == Poll.id)
+            .outerjoin(PollVote, and_(PollVote.poll_id == Poll.id, PollVote.aoe_name == aoe_name))
+            .filter(Poll.id.in_(newest))
+            .order_by(Poll.created_at.desc(), Poll.id.desc(), PollOption.position).all())
+    polls: dict[int, dict] = {}
+    for r in rows:
+        p = polls.get(r.id)
+        if p is None:
+            p = polls[r.id] = {"id": r.id, "question": r.question, "total": r.total_votes, "mine": r.mine,
+                               "closes_at": as_utc(r.closes_at) if r.closes_at else None, "options": []}
+        pct = round(100 * r.votes / r.total_votes) if r.total_votes else 0
+        p["options"].append({"id": r.option_id, "label": r.label, "votes": r.votes, "pct": pct})
+    return list(polls.values())
+
+def create_poll(db: Session, actor: str, alliance: str, question: str, options: list[str], closes_at: datetime | None = None) -> Poll:
+    labels = [o.strip()[:200] for o in options if o.strip()][:MAX_OPTIONS]
+    if not question.strip() or len(labels) < 2:
+        raise ValueError("A poll needs a question and at least two options")
+    poll = Poll(alliance=alliance.strip(), question=question.strip()[:300], closes_at=closes_at, created_by=actor)
+    db.add(poll); db.flush()
+    db.add_all(PollOption(poll_id=poll.id, position=i, label=label) for i, label in enumerate(labels))
+    db.commit()
+    return poll
+
+def close_poll(db: Session, poll_id: int) -> bool:
+    closed = db.execute(update(Poll).where(Poll.id == poll_id).values(is_open=False)).rowcount
+    db.commit()
+    return bool(closed)
+
+def _counter(model, row_id: int, column: str, delta: int):
+    col = getattr(model, column)
+    return update(model).where(model.id == row_id).values({column: col + delta})
+
+def vote(db: Session, poll_id: int, option_id: int, aoe_name: str, alliance: str | None, now: datetime) -> bool:
+    """Record or change a vote; the counters move in the same transaction. False if the poll is not open to the voter."""
+    for _ in range(2):
+        poll = db.query(Poll.id).join(PollOption, PollOption.poll_id == Poll.id).filter(
+            Poll.id == poll_id, PollOption.id == option_id, Poll.alliance.in_(_scopes(alliance)),
+            Poll.is_open.is_(True), or_(Poll.closes_at.is_(None), Poll.closes_at > now)).first()
+        if poll is None:
+            return False
+        prev = db.query(PollVote).filter(PollVote.poll_id == poll_id, PollVote.aoe_name == aoe_name).with_for_update().first()
+        try:
+            if prev is None:
+                db.add(PollVote(poll_id=poll_id, aoe_name=aoe_name, option_id=option_id, ts=now))
+                db.flush()  # a concurrent first vote by the same user fails here on the primary key
+                db.execute(_counter(Poll, poll_id, "total_votes", 1))
+                db.execute(_counter(PollOption, option_id, "votes", 1))
+            elif prev.option_id != option_id:
+                db.execute(_counter(PollOption, prev.option_id, "votes", -1))
+                db.execute(_counter(PollOption, option_id, "votes", 1))
+                prev.option_id, prev.ts = option_id, now
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()  # lost the race: retry as a vote change
+    return False
@@ -0,0 +1,133 @@
+"""Change notification for one file (the shared buff JSON).
+
+Stdlib only so the Discord bot can import it too (its systemd unit puts /opt/s77/app on PYTHONPATH).
+Uses inotify on Linux via ctypes and falls back to polling os.stat elsewhere.
+"""
+import asyncio, ctypes, ctypes.util, inspect, logging, os, struct
+
+log = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (+ name[len])
+
+def _libc():
+    name = ctypes.util.find_library("c")
+    if not name:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+class FileWatcher:
+    """Calls subscribers (plain or async callables) shortly after `path` is rewritten.
+
+    The parent directory is watched rather than the file so truncate-and-write, atomic rename
+    and delete/recreate are all seen. Bursts are debounced and a callback only fires when the
+    file's (mtime, size, inode) actually changed.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 1.0, debounce: float = 0.05):
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.callbacks = []
+        self.mode = None        # "inotify" or "poll" once started
+        self._loop = None
+        self._fd = None
+        self._task = None
+        self._pending = None
+        self._stamp = self._read_stamp()
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+        return callback
+
+    def _read_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def start(self):
+        """Start watching on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        if self._start_inotify():
+            self.mode = "inotify"
+        else:
+            self.mode = "poll"
+            self._task = self._loop.create_task(self._poll())
+        log.info("Watching %s via %s", self.path, self.mode)
+
+    def stop(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._pending:
+            self._pending.cancel()
+            self._pending = None
+
+    def _start_inotify(self) -> bool:
+        libc = _libc()
+        if libc is None:
+            return False
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return False
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(fd, os.path.dirname(self.path).encode(), mask) < 0:
+            os.close(fd)
+            return False
+        self._fd = fd
+        self._loop.add_reader(fd, self._on_readable)
+        return True
+
+    def _on_readable(self):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        name = os.path.basename(self.path).encode()
+        hit = False
+        offset = 0
+        while offset + _EVENT.size <= len(buf):
+            _wd, _mask, _cookie, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            if buf[offset:offset + length].rstrip(b"\0") == name:
+                hit = True
+            offset += length
+        if hit:
+            if self._pending:
+                self._pending.cancel()
+            self._pending = self._loop.call_later(self.debounce, self._fire)
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self._fire()
+
+    def _fire(self):
+        self._pending = None
+        stamp = self._read_stamp()
+        if stamp == self._stamp:
+            return
+        self._stamp = stamp
+        for cb in list(self.callbacks):
+            try:
+                result = cb()
+                if inspect.isawaitable(result):
+                    self._loop.create_task(result)
+            except Exception:
+                log.exception("File watch callback %r failed", cb)
@@ -0,0 +1,123 @@
+"""Moves past buffs into buff_history and keeps the usage rollups current.
+
+Each run deletes a batch of finished buffs with DELETE ... RETURNING, so only the transaction that
+actually removed a row archives and counts it (safe with several workers). The same transaction
+inserts the rows into buff_history and adds them to the hourly and daily rollups, both keyed on the
+buff's slot hour. The rollups therefore cover archived buffs only; usage_report adds the buffs still
+in the (small) buffs table at read time, so reports are current and never scan history.
+"""
+import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.orm import Session
+from ..models import Buff, BuffHistory, BuffRollupHourly, BuffRollupDaily
+
+log = logging.getLogger(__name__)
+
+BATCH = 1000
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+def ensure_partitions(db: Session, starts) -> None:
+    """Create the monthly buff_history partitions the given start times fall into (Postgres only)."""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for month in sorted({_month_start(s) for s in starts}):
+        nxt = _month_start(month + timedelta(days=32))
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS buff_history_{month:%Y_%m} PARTITION OF buff_history "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{nxt:%Y-%m-%d}')"
+        ))
+
+HOURLY_KEYS = ("bucket", "title", "region", "source")
+DAILY_KEYS = ("day", "title", "region", "hour", "aoe_name")
+
+def _count(hourly: Counter, daily: Counter, start: datetime, title: str, region: str, source: str, aoe_name: str) -> None:
+    start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    hourly[(start.replace(minute=0, second=0, microsecond=0), title, region, source)] += 1
+    daily[(start.date(), title, region, start.hour, aoe_name)] += 1
+
+def _bump(db: Session, model, counts: Counter, keys: tuple) -> None:
+    for key, n in counts.items():
+        where = [getattr(model, k) == v for k, v in zip(keys, key)]
+        if db.execute(update(model).where(*where).values(bookings=model.bookings + n)).rowcount == 0:
+            db.add(model(**dict(zip(keys, key)), bookings=n))
+
+def archive_batch(db: Session, cutoff: datetime) -> int:
+    """Archive up to BATCH buffs that started before `cutoff`; returns how many were moved."""
+    ids = db.execute(select(Buff.id).where(Buff.start_utc < cutoff).order_by(Buff.start_utc).limit(BATCH)).scalars().all()
+    if not ids:
+        return 0
+    rows = db.execute(
+        delete(Buff).where(Buff.id.in_(ids)).returning(
+            Buff.id, Buff.aoe_name, Buff.title, Buff.region, Buff.start_utc, Buff.source, Buff.created_at)
+    ).all()
+    if not rows:
+        db.rollback()
+        return 0
+    ensure_partitions(db, [r.start_utc for r in rows])
+    now = datetime.now(timezone.utc)
+    hourly, daily = Counter(), Counter()
+    for r in rows:
+        start = r.start_utc if r.start_utc.tzinfo else r.start_utc.replace(tzinfo=timezone.utc)
+        created = r.created_at if r.created_at.tzinfo else r.created_at.replace(tzinfo=timezone.utc)
+        db.add(BuffHistory(id=r.id, start_utc=start, aoe_name=r.aoe_name, title=r.title, region=r.region,
+                           source=r.source, created_at=created, archived_at=now))
+        _count(hourly, daily, start, r.title, r.region, r.source, r.aoe_name)
+    _bump(db, BuffRollupHourly, hourly, HOURLY_KEYS)
+    _bump(db, BuffRollupDaily, daily, DAILY_KEYS)
+    db.commit()
+    return len(rows)
+
+def archive_past(db: Session, after_hours: int) -> int:
+    """Archive every buff that started more than `after_hours` ago, batch by batch."""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=after_hours)
+    total = 0
+    while True:
+        moved = archive_batch(db, cutoff)
+        total += moved
+        if moved < BATCH:
+            break
+    if total:
+        log.info("Archived %s past buffs into buff_history", total)
+    return total
+
+def usage_report(db: Session, days: int, top: int = 20) -> dict:
+    """Bookings whose slot falls in the last `days` days (and any booked ahead): archived buffs from
+    the rollup tables plus the buffs not archived yet, counted the same way."""
+    since = datetime.now(timezone.utc).date() - timedelta(days=days)
+    since_ts = datetime.combine(since, datetime.min.time(), tzinfo=timezone.utc)
+    live_hourly, live_daily = Counter(), Counter()
+    for r in db.execute(select(Buff.start_utc, Buff.title, Buff.region, Buff.source, Buff.aoe_name).where(Buff.start_utc >= since_ts)):
+        _count(live_hourly, live_daily, *r)
+    D = BuffRollupDaily
+
+    def rows(*names, by_key=False, limit=None):
+        counts = Counter()
+        cols = [getattr(D, n) for n in names]
+        for r in db.execute(select(*cols, func.sum(D.bookings)).where(D.day >= since).group_by(*cols)):
+            counts[tuple(r[:-1])] += r[-1]
+        for key, n in live_daily.items():
+            fields = dict(zip(DAILY_KEYS, key))
+            counts[tuple(fields[n_] for n_ in names)] += n
+        items = sorted(counts.items()) if by_key else counts.most_common()
+        return [dict(zip(names, key), bookings=n) for key, n in items[:limit]]
+
+    H = BuffRollupHourly
+    hourly = Counter()
+    for r in db.execute(select(H.bucket, func.sum(H.bookings)).where(H.bucket >= since_ts).group_by(H.bucket)):
+        hourly[r[0] if r[0].tzinfo else r[0].replace(tzinfo=timezone.utc)] += r[1]
+    for key, n in live_hourly.items():
+        hourly[key[0]] += n
+    return {
+        "since": since.isoformat(),
+        "by_title": rows("title"),
+        "by_region": rows("region"),
+        "by_hour": rows("hour", by_key=True),
+        "contested": rows("title", "hour", limit=top),
+        "by_day": rows("day", by_key=True),
+        "top_users": rows("aoe_name", limit=top),
+        "by_slot_hour": [{"bucket": b.isoformat(), "bookings": n} for b, n in sorted(hourly.items())],
+    }
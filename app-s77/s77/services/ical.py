@@ -1,15 +1,72 @@
-from icalendar import Calendar, Event
+"""iCal feeds, streamed.
+
+Rows come from a server-side cursor (yield_per) on the read engine and each VEVENT is serialized as
+it arrives, so a season-long feed never sits in memory and the calendar header goes out before
+the query has finished.
+"""
 from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from ..db import ReadSessionLocal
+from ..models import Buff
+from .metrics import SPAN_SECONDS
+import time
+
+FETCH_BATCH = 500  # rows per cursor round trip
+CHUNK = 50         # VEVENTs per yielded chunk
 
-def generate_ics(events: list[dict]) -> bytes:
+def _frame() -> tuple[bytes, bytes]:
+    from icalendar import Calendar  # heavy; imported on the first feed request, not at app import
     cal = Calendar()
     cal.add('prodid', '-//S77 Buffs//server-77.com//')
     cal.add('version', '2.0')
-    for e in events:
-        ev = Event()
-        ev.add('summary', f"{e['title']} | {e['region']} | {e['aoe_name']}")
-        ev.add('dtstart', e['start_utc'])
-        ev.add('dtend', e['start_utc'] + timedelta(hours=1))
-        ev.add('dtstamp', datetime.now(timezone.utc))
-        cal.add_component(ev)
-    return cal.to_ical()
+    head, end, tail = cal.to_ical().rpartition(b"END:VCALENDAR")
+    return head, end + tail
+
+def _event(row, stamp: datetime):
+    from icalendar import Event
+    ev = Event()
+    ev.add('uid', f"buff-{row.id}@server-77.com")
+    ev.add('summary', f"{row.title} | {row.region} | {row.aoe_name}")
+    ev.add('dtstart', row.start_utc)
+    ev.add('dtend', row.start_utc + timedelta(hours=1))
+    ev.add('dtstamp', stamp)
+    return ev
+
+def iter_ics(rows):
+    """Yield a VCALENDAR for `rows` (objects with id/title/region/aoe_name/start_utc) chunk by chunk."""
+    head, footer = _frame()
+    yield head
+    started = time.perf_counter()
+    stamp = datetime.now(timezone.utc)
+    buf = []
+    first = True  # flush the first event right away so data goes out as soon as the first row arrives
+    for row in rows:
+        buf.append(_event(row, stamp).to_ical())
+        if first or len(buf) >= CHUNK:
+            yield b"".join(buf)
+            buf.clear()
+            first = False
+    if buf:
+        yield b"".join(buf)
+    yield footer
+    SPAN_SECONDS.observe(time.perf_counter() - started, "ical")
+
+def feed_rows(start: datetime, end: datetime, titles=None, regions=None, owner: str | None = None):
+    """Buffs in [start, end) matching the filters, read in FETCH_BATCH batches from a dedicated read session.
+
+    The session lives as long as the generator, so it works with StreamingResponse whatever the
+    FastAPI dependency teardown order is.
+    """
+    stmt = select(Buff.id, Buff.title, Buff.region, Buff.aoe_name, Buff.start_utc).where(Buff.start_utc >= start, Buff.start_utc < end)
+    if titles:
+        stmt = stmt.where(Buff.title.in_(titles))
+    if regions:
+        stmt = stmt.where(Buff.region.in_(regions))
+    if owner:
+        stmt = stmt.where(Buff.aoe_name == owner)
+    stmt = stmt.order_by(Buff.start_utc.asc()).execution_options(yield_per=FETCH_BATCH)
+    db = ReadSessionLocal()
+    try:
+        yield from db.execute(stmt)
+    finally:
+        db.close()
@@ -0,0 +1,128 @@
+"""Non-blocking logging shared by the web app and the Discord bot.
+
+Callers only enqueue records (QueueHandler); a QueueListener thread does the formatting-to-disk
+and rotation. Records pick up the current request / interaction fields from a ContextVar so
+JSON-line output can be filtered per request, interaction or user.
+Stdlib only so the bot can import it too.
+"""
+import atexit, copy, json, logging, logging.handlers, os, queue, sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+_context: ContextVar[dict | None] = ContextVar("s77_log_context", default=None)
+CONTEXT_FIELDS = ("request_id", "method", "path", "interaction", "user")
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+
+def new_context(**fields):
+    """Start a fresh context (one request or interaction); returns a token for end_context."""
+    return _context.set(dict(fields))
+
+def end_context(token):
+    _context.reset(token)
+
+def bind(**fields):
+    """Add fields to the current context, e.g. the user once authentication has run."""
+    ctx = _context.get()
+    if ctx is not None:
+        ctx.update(fields)
+
+class ContextFilter(logging.Filter):
+    # Runs in the caller's thread/task, where the ContextVar is visible
+    def filter(self, record):
+        ctx = _context.get()
+        if ctx:
+            for key, value in ctx.items():
+                setattr(record, key, value)
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Merge args and render the traceback now (they may change or hold frames), but leave the
+        # timestamp/level layout to the listener thread's formatter.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+# The listener/handler pair of the latest setup_logging() call; the exit and fork hooks are
+# registered once and act on whichever pair is current.
+_active: dict = {"listener": None, "handler": None}
+_hooks_registered = False
+
+def _stop(listener):
+    if listener._thread is not None: # not already stopped by the caller
+        listener.stop()
+
+def _stop_active():
+    if _active["listener"] is not None:
+        _stop(_active["listener"])
+
+def _restart_active():
+    # Threads do not survive fork (gunicorn --preload): give the child its own queue and listener thread
+    listener, handler = _active["listener"], _active["handler"]
+    if listener is None:
+        return
+    listener.queue = handler.queue = queue.SimpleQueue()
+    listener._thread = None
+    listener.start()
+
+def setup_logging(path: str | None = None, level=logging.INFO, json_lines: bool = False, text_format: str = TEXT_FORMAT,
+                  rotate_when: str | None = None, rotate_interval: int = 1, backup_count: int = 0):
+    """Route the root logger through a queue to a file (or stderr) handler; returns the started listener.
+
+    `rotate_when` switches to a TimedRotatingFileHandler. If `path` is not writable the records go
+    to stderr and a warning is logged.
+    """
+    fallback = False
+    try:
+        if path and rotate_when:
+            target = logging.handlers.TimedRotatingFileHandler(path, when=rotate_when, interval=rotate_interval, backupCount=backup_count)
+        elif path:
+            target = logging.FileHandler(path)
+        else:
+            target = logging.StreamHandler(sys.stderr)
+    except OSError:
+        target = logging.StreamHandler(sys.stderr)
+        fallback = True
+    target.setFormatter(JsonFormatter() if json_lines else logging.Formatter(text_format))
+
+    q = queue.SimpleQueue()
+    handler = _QueueHandler(q)
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(q, target, respect_handler_level=True)
+    listener.start()
+    _stop_active()  # a repeat call replaces the previous listener; flush it first
+    _active.update(listener=listener, handler=handler)
+    global _hooks_registered
+    if not _hooks_registered:
+        atexit.register(_stop_active)
+        os.register_at_fork(after_in_child=_restart_active)
+        _hooks_registered = True
+    if fallback:
+        root.warning("Log file %s not writable, using stderr", path)
+    return listener
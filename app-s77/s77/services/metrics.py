@@ -0,0 +1,96 @@
+"""In-process request metrics, exported in Prometheus text format on /metrics.
+
+Per-request stats (DB query count/time and named spans) live in a ContextVar set by the
+metrics middleware, so route code in the threadpool adds to the right request.
+"""
+import threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+_lock = threading.Lock()
+_stats: ContextVar[dict | None] = ContextVar("s77_request_stats", default=None)
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = SECONDS_BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, labels, buckets
+        self.series: dict[tuple, list] = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *label_values):
+        with _lock:
+            row = self.series.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            series = [(k, list(v)) for k, v in self.series.items()]
+        for label_values, row in series:
+            pairs = [f'{k}="{v}"' for k, v in zip(self.labels, label_values)]
+            for bound, count in zip(list(self.buckets) + ["+Inf"], row[:len(self.buckets)] + [row[-1]]):
+                bucket_pairs = ",".join(pairs + ['le="%s"' % bound])
+                lines.append(f"{self.name}_bucket{{{bucket_pairs}}} {count}")
+            suffix = "{" + ",".join(pairs) + "}" if pairs else ""
+            lines.append(f"{self.name}_sum{suffix} {row[-2]}")
+            lines.append(f"{self.name}_count{suffix} {row[-1]}")
+        return lines
+
+REQUEST_SECONDS = Histogram("s77_request_seconds", "Request latency by route (middleware to response).", ("method", "route", "status"))
+REQUEST_DB_QUERIES = Histogram("s77_request_db_queries", "SQL statements executed per request.", ("route",), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("s77_request_db_seconds", "Total SQL time per request.", ("route",))
+SPAN_SECONDS = Histogram("s77_span_seconds", "Timed sections (shared JSON reads, iCal generation).", ("span",))
+REGISTRY = [REQUEST_SECONDS, REQUEST_DB_QUERIES, REQUEST_DB_SECONDS, SPAN_SECONDS]
+
+def begin_request() -> dict:
+    stats = {"db_count": 0, "db_seconds": 0.0, "spans": {}}
+    _stats.set(stats)
+    return stats
+
+def finish_request(method: str, route: str, status: int, elapsed: float, stats: dict):
+    REQUEST_SECONDS.observe(elapsed, method, route, status)
+    REQUEST_DB_QUERIES.observe(stats["db_count"], route)
+    REQUEST_DB_SECONDS.observe(stats["db_seconds"], route)
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.observe(elapsed, name)
+        stats = _stats.get()
+        if stats is not None:
+            stats["spans"][name] = stats["spans"].get(name, 0.0) + elapsed
+
+def instrument_engine(engine):
+    """Count statements and DB time for the current request via SQLAlchemy cursor events."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("s77_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["s77_query_start"].pop()
+        stats = _stats.get()
+        if stats is not None:
+            stats["db_count"] += 1
+            stats["db_seconds"] += elapsed
+
+def server_timing(elapsed: float, stats: dict) -> str:
+    parts = [f"app;dur={elapsed * 1000:.1f}", f'db;dur={stats["db_seconds"] * 1000:.1f};desc="{stats["db_count"]} queries"']
+    parts += [f"{name};dur={secs * 1000:.1f}" for name, secs in stats["spans"].items()]
+    return ", ".join(parts)
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
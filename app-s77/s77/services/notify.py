@@ -0,0 +1,299 @@
+"""Server-side reminders: pings shortly before each buff and a periodic digest of upcoming buffs.
+
+One dispatcher task (in one worker) reads upcoming buffs with a single range query on
+buffs.start_utc, turns them into notices and queues each notice for every configured sink.
+Each sink sends its queue in batches and retries failures with exponential backoff (or the
+server's Retry-After); when one batch takes several webhook posts or recipients, a retry resends
+only what did not go out. Delivered keys are recorded in notifications_sent, so every notice goes out
+once per sink, even across restarts. The dispatcher sleeps until the next reminder is due rather
+than polling on a fixed scan interval.
+"""
+import abc, asyncio, json, logging, time, urllib.error, urllib.request
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+from ..settings import settings
+from ..models import Buff, NotificationSent
+from .buffs import as_utc
+
+log = logging.getLogger(__name__)
+
+DISCORD_LIMIT = 2000   # characters per webhook message
+WHATSAPP_LIMIT = 4096  # characters per text message
+KEEP_SENT = timedelta(days=7)
+
+class SendError(Exception):
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.delivered: list[str] = []  # keys of the batch that did go out before the failure; not retried
+
+def _post_json(url: str, payload: dict, headers: dict | None = None, timeout: float = 10):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(), method="POST",
+                                 headers={"Content-Type": "application/json", **(headers or {})})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        retry_after = e.headers.get("Retry-After") if e.code == 429 else None
+        raise SendError(f"HTTP {e.code} from {url}", float(retry_after) if retry_after else None) from e
+    except OSError as e:  # URLError, timeouts, refused connections
+        raise SendError(f"{url}: {e}") from e
+
+def _chunks(lines: list[tuple[str, str]], limit: int) -> list[tuple[str, list[str]]]:
+    """Join (key, line) pairs into (message, keys) of at most `limit` characters (over-long lines are cut)."""
+    out, cur, keys = [], "", []
+    for key, line in lines:
+        line = line[:limit]
+        if cur and len(cur) + 1 + len(line) > limit:
+            out.append((cur, keys))
+            cur, keys = "", []
+        cur = f"{cur}\n{line}" if cur else line
+        keys.append(key)
+    if cur:
+        out.append((cur, keys))
+    return out
+
+# --- Sinks: send(notices) delivers a batch or raises SendError, with SendError.delivered set to the
+# keys that already went out when one batch takes several requests ---
+
+class Sink(abc.ABC):
+    name = "sink"
+    batch = 10
+
+    @abc.abstractmethod
+    def send(self, notices: list[dict]) -> None:
+        ...
+
+class DiscordWebhookSink(Sink):
+    name = "discord"
+
+    def __init__(self, url: str, mention: str = ""):
+        self.url = url
+        self.mention = mention
+
+    def send(self, notices):
+        lines = [(n["key"], f"{self.mention} {n['text']}" if self.mention and n["kind"] == "pre" else n["text"]) for n in notices]
+        delivered = []
+        try:
+            for content, keys in _chunks(lines, DISCORD_LIMIT):
+                _post_json(self.url, {"content": content, "allowed_mentions": {"parse": ["roles"]}})
+                delivered += keys
+        except SendError as e:
+            e.delivered = delivered
+            raise
+
+class WhatsAppSink(Sink):
+    """WhatsApp Cloud API text messages to a fixed list of numbers."""
+    name = "whatsapp"
+
+    def __init__(self, token: str, phone_id: str, recipients: list[str]):
+        self.url = f"https://graph.facebook.com/v19.0/{phone_id}/messages"
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.recipients = recipients
+        self.reached: dict[str, set[str]] = {}  # key -> recipients that already have it, kept across a failed send
+
+    def send(self, notices):
+        # A failed batch stays at the head of the queue, so its retry is this same batch (plus maybe newer
+        # notices); entries for keys outside it belong to a batch that was given up on
+        keys = [n["key"] for n in notices]
+        self.reached = {k: self.reached[k] for k in keys if k in self.reached}
+        try:
+            for to in self.recipients:
+                todo = [(n["key"], n["text"].replace("**", "*")) for n in notices if to not in self.reached.get(n["key"], ())]
+                for body, sent in _chunks(todo, WHATSAPP_LIMIT):
+                    _post_json(self.url, {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}}, self.headers)
+                    for k in sent:
+                        self.reached.setdefault(k, set()).add(to)
+        except SendError as e:
+            e.delivered = [k for k in keys if len(self.reached.get(k, ())) == len(self.recipients)]
+            raise
+        self.reached = {}
+
+class FileSink(Sink):
+    """Appends one JSON line per notice; for tests and local setups."""
+    name = "file"
+    batch = 100
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, notices):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for n in notices:
+                    f.write(json.dumps({k: n[k] for k in ("key", "kind", "text")} | {"sent": datetime.now(timezone.utc).isoformat()}) + "\n")
+        except OSError as e:
+            raise SendError(str(e)) from e
+
+class HttpSink(Sink):
+    """POSTs {"notices": [...]} to a URL; for tests or a local relay."""
+    name = "http"
+    batch = 100
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def send(self, notices):
+        _post_json(self.url, {"notices": [{k: n[k] for k in ("key", "kind", "text")} for n in notices]})
+
+def configured_sinks() -> list[Sink]:
+    sinks = []
+    if settings.NOTIFY_DISCORD_WEBHOOK:
+        sinks.append(DiscordWebhookSink(settings.NOTIFY_DISCORD_WEBHOOK, settings.NOTIFY_DISCORD_MENTION))
+    if settings.NOTIFY_WHATSAPP:
+        recipients = [r.strip() for r in settings.NOTIFY_WHATSAPP_TO.split(",") if r.strip()]
+        if settings.NOTIFY_WHATSAPP_TOKEN and settings.NOTIFY_WHATSAPP_PHONE_ID and recipients:
+            sinks.append(WhatsAppSink(settings.NOTIFY_WHATSAPP_TOKEN, settings.NOTIFY_WHATSAPP_PHONE_ID, recipients))
+        else:
+            log.warning("S77_NOTIFY_WHATSAPP is set but token, phone id or recipients are missing")
+    if settings.NOTIFY_FILE:
+        sinks.append(FileSink(settings.NOTIFY_FILE))
+    if settings.NOTIFY_HTTP_URL:
+        sinks.append(HttpSink(settings.NOTIFY_HTTP_URL))
+    return sinks
+
+# --- Notices ---
+
+def _line(b) -> str:
+    return f"{as_utc(b.start_utc):%H:%M} UTC **{b.title}** in **{b.region}** for **{b.aoe_name}**"
+
+def _digest_bucket(now: datetime) -> datetime:
+    hours = max(1, settings.NOTIFY_DIGEST_HOURS)
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day + timedelta(hours=(now.hour // hours) * hours)
+
+def due_notices(db: Session, now: datetime) -> tuple[list[dict], datetime]:
+    """Notices due at `now` and the time the next one falls due."""
+    pre = timedelta(minutes=settings.NOTIFY_PRE_MINUTES)
+    digest_span = timedelta(hours=max(1, settings.NOTIFY_DIGEST_HOURS))
+    bucket = _digest_bucket(now)
+    rows = (db.query(Buff.id, Buff.aoe_name, Buff.title, Buff.region, Buff.start_utc)
+            .filter(Buff.start_utc >= bucket, Buff.start_utc < now + max(pre, digest_span))
+            .order_by(Buff.start_utc).all())
+
+    notices, next_due = [], bucket + digest_span
+    for b in rows:
+        start = as_utc(b.start_utc)
+        if start <= now:
+            continue
+        if start - pre <= now:
+            minutes = max(1, round((start - now).total_seconds() / 60))
+            notices.append({"key": f"pre:{b.id}:{start:%Y%m%d%H}", "kind": "pre",
+                            "text": f"Reminder: {_line(b)} starts in {minutes} min!"})
+        else:
+            next_due = min(next_due, start - pre)
+    if settings.NOTIFY_DIGEST_HOURS > 0 and now < bucket + timedelta(hours=1):  # late digests are skipped, not sent hours later
+        upcoming = [b for b in rows if bucket <= as_utc(b.start_utc) < bucket + digest_span and as_utc(b.start_utc) > now]
+        lines = [_line(b) for b in upcoming] or ["No buffs booked."]
+        notices.append({"key": f"digest:{bucket:%Y%m%d%H}", "kind": "digest",
+                        "text": "\n".join([f"Buffs {bucket:%Y-%m-%d %H:%M}-{bucket + digest_span:%H:%M} UTC:"] + lines)})
+    return notices, next_due
+
+# --- Dispatcher ---
+
+class _Queue:
+    def __init__(self, sink: Sink):
+        self.sink = sink
+        self.pending: dict[str, dict] = {}  # key -> notice, in due order
+        self.attempts = 0
+        self.next_try = 0.0                 # time.monotonic() of the next allowed send
+
+class Dispatcher:
+    def __init__(self, sinks: list[Sink], session_factory):
+        self.queues = [_Queue(s) for s in sinks]
+        self.session_factory = session_factory
+        self.done: set[tuple[str, str]] = set()  # (sink, key) delivered or given up
+
+    def load_sent(self):
+        db = self.session_factory()
+        try:
+            cutoff = datetime.now(timezone.utc) - KEEP_SENT
+            db.execute(delete(NotificationSent).where(NotificationSent.sent_at < cutoff))
+            db.commit()
+            self.done = {(r.sink, r.key) for r in db.query(NotificationSent.sink, NotificationSent.key)}
+        finally:
+            db.close()
+
+    def collect(self, now: datetime) -> datetime:
+        """Queue newly due notices for every sink; returns when the next one falls due."""
+        db = self.session_factory()
+        try:
+            notices, next_due = due_notices(db, now)
+        finally:
+            db.close()
+        current = {n["key"] for n in notices}
+        for q in self.queues:
+            # reminders for buffs that were deleted, moved or have started are dropped, not sent late
+            for key in [k for k in q.pending if k not in current]:
+                del q.pending[key]
+            for n in notices:
+                if (q.sink.name, n["key"]) not in self.done:
+                    q.pending.setdefault(n["key"], n)
+        return next_due
+
+    def _record(self, sink: str, keys: list[str]):
+        db = self.session_factory()
+        try:
+            now = datetime.now(timezone.utc)
+            for key in keys:
+                db.merge(NotificationSent(sink=sink, key=key, sent_at=now))
+            db.commit()
+        finally:
+            db.close()
+
+    async def _flush(self, q: _Queue):
+        while q.pending and time.monotonic() >= q.next_try:
+            batch = list(q.pending.values())[:q.sink.batch]
+            try:
+                await asyncio.to_thread(q.sink.send, batch)
+            except SendError as e:
+                if e.delivered:
+                    sent = [n for n in batch if n["key"] in e.delivered]
+                    batch = [n for n in batch if n["key"] not in e.delivered]
+                    self._drop(q, sent)
+                    await asyncio.to_thread(self._record, q.sink.name, [n["key"] for n in sent])
+                q.attempts += 1
+                if q.attempts >= settings.NOTIFY_MAX_ATTEMPTS:
+                    log.error("Giving up on %d %s notices after %d attempts: %s", len(batch), q.sink.name, q.attempts, e)
+                    self._finish(q, batch)
+                    await asyncio.to_thread(self._record, q.sink.name, [n["key"] for n in batch])
+                    continue
+                delay = e.retry_after or min(settings.NOTIFY_RETRY_MAX_SECONDS, settings.NOTIFY_RETRY_BASE_SECONDS * 2 ** (q.attempts - 1))
+                q.next_try = time.monotonic() + delay
+                log.warning("%s sink failed (attempt %d), retrying in %.0fs: %s", q.sink.name, q.attempts, delay, e)
+                return
+            self._finish(q, batch)
+            log.info("Sent %d notices via %s", len(batch), q.sink.name)
+            await asyncio.to_thread(self._record, q.sink.name, [n["key"] for n in batch])
+
+    def _finish(self, q: _Queue, batch: list[dict]):
+        q.attempts, q.next_try = 0, 0.0
+        self._drop(q, batch)
+
+    def _drop(self, q: _Queue, batch: list[dict]):
+        for n in batch:
+            q.pending.pop(n["key"], None)
+            self.done.add((q.sink.name, n["key"]))
+
+    async def run_once(self, now: datetime | None = None) -> float:
+        """One collect-and-send pass; returns seconds until the next pass is needed."""
+        now = now or datetime.now(timezone.utc)
+        next_due = await asyncio.to_thread(self.collect, now)
+        await asyncio.gather(*(self._flush(q) for q in self.queues))
+        wait = (next_due - datetime.now(timezone.utc)).total_seconds()
+        for q in self.queues:
+            if q.pending:
+                wait = min(wait, q.next_try - time.monotonic())
+        return max(1.0, min(wait, settings.NOTIFY_INTERVAL_SECONDS))
+
+    async def run(self):
+        await asyncio.to_thread(self.load_sent)
+        log.info("Notification dispatcher started with sinks: %s", ", ".join(q.sink.name for q in self.queues))
+        while True:
+            try:
+                wait = await self.run_once()
+            except Exception:
+                log.exception("Notification dispatcher pass failed")
+                wait = settings.NOTIFY_INTERVAL_SECONDS
+            await asyncio.sleep(wait)
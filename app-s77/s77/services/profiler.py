@@ -0,0 +1,84 @@
+"""Opt-in request profiler.
+
+A sampled fraction of requests (PROFILE_SAMPLE_RATE) or an admin request with ?_profile=1
+runs its endpoint under cProfile. Only the PROFILE_KEEP slowest profiled requests are kept,
+each with a pstats text report and a .prof dump in PROFILE_DIR (open with snakeviz or
+flameprof to get a flamegraph). Sync endpoints run in the threadpool, so the profiler is
+carried in a ContextVar and enabled around the endpoint call on the worker thread.
+"""
+import cProfile, functools, heapq, inspect, io, itertools, os, pstats, random, threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from ..settings import settings
+
+_active: ContextVar[cProfile.Profile | None] = ContextVar("s77_profile", default=None)
+_lock = threading.Lock()
+_slowest: list[tuple[float, int, dict]] = []  # min-heap on duration, at most PROFILE_KEEP entries
+_ids = itertools.count(1)
+
+def on_demand(request) -> bool:
+    """?_profile=1; the caller must still check the session is an admin's before profiling."""
+    return request.query_params.get("_profile") == "1"
+
+def sampled() -> bool:
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+def start() -> cProfile.Profile:
+    prof = cProfile.Profile()
+    _active.set(prof)
+    return prof
+
+def _wrap(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        prof = _active.get()
+        if prof is None:
+            return func(*args, **kwargs)
+        prof.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            prof.disable()
+    return wrapper
+
+def instrument_routes(app):
+    """Wrap every sync endpoint; FastAPI reads dependant.call at request time."""
+    from fastapi.routing import APIRoute
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not inspect.iscoroutinefunction(route.dependant.call):
+            route.dependant.call = _wrap(route.dependant.call)
+
+def finish(prof: cProfile.Profile, method: str, path: str, status: int, elapsed: float):
+    """Keep the profile if it is among the slowest seen so far. Blocking (pstats report, dump file): run it in a thread."""
+    with _lock:
+        if len(_slowest) >= settings.PROFILE_KEEP and elapsed <= _slowest[0][0]:
+            return
+    out = io.StringIO()
+    pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(40)
+    pid = next(_ids)
+    dump = os.path.join(settings.PROFILE_DIR, f"{pid}.prof")
+    try:
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        prof.dump_stats(dump)
+    except OSError:
+        dump = None
+    entry = {"id": pid, "ts": datetime.now(timezone.utc), "method": method, "path": path,
+             "status": status, "ms": round(elapsed * 1000, 1), "report": out.getvalue(), "file": dump}
+    with _lock:
+        heapq.heappush(_slowest, (elapsed, pid, entry))
+        while len(_slowest) > settings.PROFILE_KEEP:
+            _, _, old = heapq.heappop(_slowest)
+            if old["file"]:
+                try:
+                    os.remove(old["file"])
+                except OSError:
+                    pass
+
+def slowest() -> list[dict]:
+    with _lock:
+        return [e for _, _, e in sorted(_slowest, reverse=True)]
+
+def get(pid: int) -> dict | None:
+    with _lock:
+        return next((e for _, i, e in _slowest if i == pid), None)
@@ -0,0 +1,148 @@
+"""Token-bucket rate limits for the login, register and conflict-probe endpoints.
+
+Buckets are configured per route and key kind in RATE_LIMITS, e.g. "login:ip=10/60" allows a
+burst of 10 login attempts per client IP, refilled over 60 seconds. Routes call hit() before doing
+any expensive work (Argon2, DB lookups) and get HTTP 429 with Retry-After once a bucket is empty.
+
+State lives in this process by default. With several workers, RATE_LIMIT_BACKEND="db" keeps the
+buckets in the rate_buckets table and "redis" in any Redis-compatible store, so every worker
+draws from the same bucket. If the shared store fails, the worker falls back to its own buckets
+rather than locking everyone out.
+"""
+import logging, math, threading, time
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from ..settings import settings
+
+log = logging.getLogger(__name__)
+
+def parse_limits(spec: str) -> dict[str, tuple[float, float]]:
+    """"login:ip=10/60,login:name=5/300" -> {"login:ip": (10, 60), ...} as (capacity, seconds to refill)."""
+    limits = {}
+    for part in spec.split(","):
+        name, _, value = part.strip().partition("=")
+        if not value:
+            continue
+        burst, _, period = value.partition("/")
+        try:
+            limits[name.strip()] = (float(burst), float(period or 1))
+        except ValueError:
+            log.warning("Ignoring bad rate limit %r", part)
+    return limits
+
+def _take(tokens: float, updated: float, now: float, capacity: float, period: float) -> tuple[bool, float, float]:
+    """Refill then take one token: (allowed, tokens left, seconds until the next token)."""
+    rate = capacity / period
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+class MemoryBuckets:
+    PRUNE_AT = 10000  # keys; idle buckets that have refilled completely are dropped
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets: dict[str, tuple[float, float]] = {}
+
+    def take(self, key: str, capacity: float, period: float) -> tuple[bool, float]:
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            allowed, tokens, wait = _take(tokens, updated, now, capacity, period)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.PRUNE_AT:
+                self._prune(now, period)
+        return allowed, wait
+
+    def _prune(self, now: float, period: float):
+        for key in [k for k, (_, updated) in self.buckets.items() if now - updated > period]:
+            del self.buckets[key]
+
+class DbBuckets:
+    """Buckets in the rate_buckets table; the row lock serializes workers on one key."""
+
+    def take(self, key: str, capacity: float, period: float) -> tuple[bool, float]:
+        from ..db import engine
+        from ..models import RateBucket
+        now = time.time()
+        for _ in range(2):
+            try:
+                with engine.begin() as conn:
+                    row = conn.execute(select(RateBucket.tokens, RateBucket.updated).where(RateBucket.key == key).with_for_update()).first()
+                    tokens, updated = (row.tokens, row.updated) if row else (capacity, now)
+                    allowed, tokens, wait = _take(tokens, updated, now, capacity, period)
+                    if row:
+                        conn.execute(update(RateBucket).where(RateBucket.key == key).values(tokens=tokens, updated=now))
+                    else:
+                        conn.execute(RateBucket.__table__.insert().values(key=key, tokens=tokens, updated=now))
+                return allowed, wait
+            except IntegrityError:
+                continue  # another worker created the row first; take from it
+        return True, 0.0
+
+# KEYS[1] bucket; ARGV capacity, refill rate per second, now. Returns {allowed, tokens left}
+_REDIS_TAKE = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 't', 'u')
+local tokens = tonumber(b[1]) or capacity
+local updated = tonumber(b[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then tokens = tokens - 1; allowed = 1 end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'u', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+class RedisBuckets:
+    """Buckets in a Redis-compatible store, updated atomically by a Lua script (needs the `redis` package)."""
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.script = self.client.register_script(_REDIS_TAKE)
+
+    def take(self, key: str, capacity: float, period: float) -> tuple[bool, float]:
+        rate = capacity / period
+        allowed, tokens = self.script(keys=[f"s77:rl:{key}"], args=[capacity, rate, time.time()])
+        return bool(allowed), 0.0 if allowed else (1 - float(tokens)) / rate
+
+_limits = parse_limits(settings.RATE_LIMITS)
+_local = MemoryBuckets()
+_shared = {"store": None}
+
+def _store():
+    if _shared["store"] is None:
+        backend = settings.RATE_LIMIT_BACKEND
+        try:
+            if backend == "db":
+                _shared["store"] = DbBuckets()
+            elif backend == "redis":
+                _shared["store"] = RedisBuckets(settings.RATE_LIMIT_REDIS_URL)
+            else:
+                _shared["store"] = _local
+        except Exception:
+            log.exception("Rate limit backend %r unavailable; using per-worker buckets", backend)
+            _shared["store"] = _local
+    return _shared["store"]
+
+def hit(route: str, ip: str | None = None, name: str | None = None):
+    """Take a token from each configured bucket of `route`; raises HTTP 429 when one is empty."""
+    wait = 0.0
+    for kind, value in (("ip", ip), ("name", name.lower() if name else None)):
+        limit = _limits.get(f"{route}:{kind}")
+        if not limit or not value:
+            continue
+        key = f"{route}:{kind}:{value}"
+        try:
+            allowed, retry = _store().take(key, *limit)
+        except Exception:
+            log.warning("Shared rate limit store failed for %s; using per-worker buckets", key, exc_info=True)
+            allowed, retry = _local.take(key, *limit)
+        if not allowed:
+            wait = max(wait, retry)
+    if wait:
+        log.warning("Rate limited %s (ip=%s name=%s)", route, ip, name)
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(wait))})
@@ -0,0 +1,42 @@
+"""Batch admin actions on user accounts.
+
+Each action is one UPDATE ... WHERE id IN (...) and one multi-row insert into audit_logs, in a
+single transaction. Audit rows use the same action names and details as the one-user routes,
+so the audit log reads the same whichever way a change was made.
+"""
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from ..models import AuditLog, Role, User
+
+MAX_BATCH = 500  # ids per request
+
+# action -> (WHERE clause narrowing the targets, SET values, audit action, audit details)
+ACTIONS = {
+    "approve": (lambda: (User.is_approved.is_(False), User.role != Role.admin), {"is_approved": True}, "approve_user", "{name}"),
+    "disable": (lambda: (User.is_approved.is_(True),), {"is_approved": False}, "disable_user", "{name}"),
+    "make_admin": (lambda: (User.role != Role.admin,), {"role": Role.admin, "is_approved": True}, "change_role", "{name}->admin"),
+    "make_user": (lambda: (User.role != Role.user,), {"role": Role.user}, "change_role", "{name}->user"),
+    "force_reset": (lambda: (User.must_change_password.is_(False),), {"must_change_password": True}, "force_password_reset", "{name}"),
+}
+
+def batch_update(db: Session, action: str, ids: list[int], actor: str, ip: str | None = None) -> list[dict]:
+    """Apply `action` to the users in `ids`; returns the users that changed (already in that state are skipped)."""
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action {action!r}")
+    ids = sorted(set(ids))
+    if not ids:
+        return []
+    if len(ids) > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} users per batch")
+    where, values, audit_action, details = ACTIONS[action]
+    stmt = update(User).where(User.id.in_(ids), *where()).values(values)
+    if db.get_bind().dialect.update_returning:
+        changed = db.execute(stmt.returning(User.id, User.aoe_name)).all()
+    else:
+        changed = db.execute(select(User.id, User.aoe_name).where(User.id.in_(ids), *where()).with_for_update()).all()
+        db.execute(stmt)
+    if changed:
+        db.execute(insert(AuditLog), [{"action": audit_action, "ip": ip, "actor": actor, "details": details.format(name=r.aoe_name)}
+                                      for r in changed])
+    db.commit()
+    return [{"id": r.id, "aoe_name": r.aoe_name} for r in changed]
@@ -0,0 +1,37 @@
+// Forms with data-swap post in the background and patch the page with the server's fragment:
+//   data-swap="row"          replace every <tr data-id> of the same id with the returned row
+//   data-swap="remove"       drop the form's table row
+//   data-swap="#id"          replace that element with the returned HTML
+//   data-swap="prepend:#id"  insert the returned HTML at the top of that element
+//   data-swap="json"         fire a "fragment" event on the form with {status, data}
+// Without JavaScript the same forms post normally and get the full page back.
+document.addEventListener("submit", async (e) => {
+  const form = e.target.closest("form[data-swap]");
+  if (!form || e.defaultPrevented) return;
+  e.preventDefault();
+  const swap = form.dataset.swap;
+  const action = (e.submitter && e.submitter.getAttribute("formaction")) || form.action;
+  const res = await fetch(action, {method: "POST", body: new FormData(form, e.submitter), headers: {"X-Requested-With": "fetch"}});
+  if (swap === "json") {
+    const data = await res.json().catch(() => ({}));
+    form.dispatchEvent(new CustomEvent("fragment", {bubbles: true, detail: {status: res.status, data}}));
+    return;
+  }
+  if (!res.ok) { alert("Request failed (" + res.status + ")"); return; }
+  const html = await res.text();
+  if (swap === "row") {
+    const id = form.closest("tr").dataset.id;
+    document.querySelectorAll(`tr[data-id="${id}"]`).forEach(row => { row.outerHTML = html; });
+  } else if (swap === "remove") {
+    form.closest("tr").remove();
+  } else if (swap.startsWith("prepend:")) {
+    const box = document.querySelector(swap.slice(8));
+    box.querySelectorAll(":scope > p.muted").forEach(p => p.remove());
+    box.insertAdjacentHTML("afterbegin", html);
+    form.reset();
+  } else {
+    document.querySelector(swap).outerHTML = html;
+    if (form.isConnected) form.reset();
+  }
+  document.dispatchEvent(new CustomEvent("fragment:swapped"));
+});
@@ -0,0 +1,71 @@
+"""Import-time budget for s77.main; run before deploying (exit status 1 when over budget).
+
+    python scripts/check_import_time.py [--budget-ratio 0.33] [--runs 5]
+
+Each run is a fresh `python -X importtime` that first imports the frameworks s77.main cannot avoid
+(FRAMEWORK), then s77.main itself, pointed at a SQLite file and log file in a directory that does not
+exist, so the import fails if it touches the database or the log. The app's own import cost is
+compared with the framework cost measured in the same process, so a slow or busy machine moves both
+and the check does not fail on noise. Fails when the median ratio is over budget, or when a
+dependency that should load lazily (icalendar, passlib, argon2) is imported eagerly.
+
+The default budget is the measured median (0.26 on this tree) plus 25%.
+"""
+import argparse, os, statistics, subprocess, sys, tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY = ("icalendar", "passlib", "argon2")
+FRAMEWORK = ("fastapi", "fastapi.responses", "fastapi.security", "fastapi.staticfiles", "fastapi.templating",
+             "pydantic", "pydantic_settings", "sqlalchemy", "sqlalchemy.orm", "itsdangerous")
+SCRIPT = ("import time\n"
+          "t0 = time.perf_counter()\n"
+          f"import {', '.join(FRAMEWORK)}\n"
+          "t1 = time.perf_counter()\n"
+          "import s77.main\n"
+          "print((t1 - t0) * 1e6, (time.perf_counter() - t1) * 1e6)")
+
+def measure() -> tuple[float, float, dict[str, int], dict[str, int]]:
+    """One cold import: (framework us, s77.main us, self us per module, cumulative us per module)."""
+    missing = os.path.join(tempfile.gettempdir(), "s77-importtime-does-not-exist")
+    env = dict(os.environ, PYTHONPATH=APP_DIR,
+               S77_DB_URL=f"sqlite:///{missing}/s77.db", S77_LOG_FILE=f"{missing}/app.log")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT],
+                          cwd=APP_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f"import s77.main failed:\n{proc.stderr[-3000:]}")
+    own, cumulative = {}, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        own[name.strip()] = int(self_us)
+        cumulative[name.strip()] = int(cum_us)
+    framework_us, app_us = map(float, proc.stdout.split())
+    return framework_us, app_us, own, cumulative
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--budget-ratio", type=float, default=float(os.getenv("S77_IMPORT_BUDGET_RATIO", "0.33")),
+                    help="max s77.main import time as a fraction of the framework import time")
+    ap.add_argument("--runs", type=int, default=5, help="cold imports to run; the median counts")
+    ap.add_argument("--top", type=int, default=12, help="slowest modules to list")
+    args = ap.parse_args()
+
+    runs = [measure() for _ in range(max(1, args.runs))]
+    ratio = statistics.median(app / framework for framework, app, _, _ in runs)
+    framework, app, own, cumulative = sorted(runs, key=lambda r: r[1] / r[0])[len(runs) // 2]
+    print(f"import s77.main: {app / 1000:.0f} ms on top of {framework / 1000:.0f} ms of frameworks, "
+          f"ratio {ratio:.2f} (median of {len(runs)}), budget {args.budget_ratio:.2f}")
+    print("slowest modules (self time):")
+    for name, us in sorted(own.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:7.1f} ms  {name}  (cumulative {cumulative[name] / 1000:.1f} ms)")
+
+    failures = [f"{name} is imported at startup; import it where it is used" for name in LAZY if name in own]
+    if ratio > args.budget_ratio:
+        failures.append(f"s77.main costs {ratio:.2f}x the framework import, over the {args.budget_ratio:.2f} budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()